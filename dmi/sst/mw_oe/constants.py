@@ -48,3 +48,11 @@ INPUT_VARIABLES = ["amsre.latitude",                           # float, degrees
                    "{IS_SENSOR}_insitu.sst_qc_flag",           # int16, fill=-32768                                pre: squeeze
                    "{IS_SENSOR}_insitu.sst_track_flag",        # int16, fill=-32768                                pre: squeeze
                    ]
+
+# retrieval options, kept here so that the command line can be parsed without importing the numba kernels
+ENGINES = ["loop", "batch", "numba"]
+JACOBIANS = ["finite_difference", "analytic"]
+JACOBIAN_UPDATES = ["full", "broyden"]
+UPDATES = ["gauss_newton", "levenberg_marquardt"]
+FW_MODELS = ["physical", "lut"]
+FW_CACHE_TOLERANCE = 0.001  # default bound of the forward model cache quantization error [K]
@@ -0,0 +1,37 @@
+class DielectricCache:
+    """
+    Small cache of the sea-water dielectric stage of the forward model, keyed on (T_ow, sss, theta_d). Cleared per
+    matchup, it lets the finite difference perturbations of wind speed, water vapour and liquid water reuse the
+    dielectric constant of the central forward model run.
+    """
+    fw_model = None
+    max_size = None
+    entries = None
+    hits = None
+    misses = None
+
+    def __init__(self, fw_model, max_size=4):
+        self.fw_model = fw_model
+        self.max_size = max_size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, T_ow, sss, theta_d, context):
+        key = (float(T_ow), float(sss), float(theta_d))
+        dielectric = self.entries.get(key)
+        if dielectric is not None:
+            self.hits += 1
+            return dielectric
+
+        self.misses += 1
+        if len(self.entries) >= self.max_size:
+            # entries are kept in insertion order, the oldest is evicted
+            del self.entries[next(iter(self.entries))]
+
+        dielectric = self.fw_model.calc_dielectric(T_ow, sss, context)
+        self.entries[key] = dielectric
+        return dielectric
+
+    def clear(self):
+        self.entries.clear()
@@ -15,6 +15,9 @@ import numpy as np
 # inv_file_name         8   256     AMSR-E filename in MMD is not following conventions, cannot extract ascending/descending infomation
 # rfi_possible          9   512     Pixel is located in a RFI contaminated area
 # diurnal_warming       10  1024    Pixel is possibly affected by diurnal warming
+# rain_possible         11  2048    Pixel is possibly affected by rain (AMSR-E 18V brightness temperature above threshold)
+# std_dev_too_high      12  4096    AMSR-E brightness temperature standard deviation above threshold
+# retrieval_diverged    13  8192    Retrieval stopped by the divergence guard after repeated cost function increases
 
 class FlagCoding():
     flags = None
@@ -32,6 +35,7 @@ class FlagCoding():
     DIURNAL_WARMING = 1024
     RAIN_POSSIBLE = 2048
     STDDEV_TOO_HIGH = 4096
+    RETRIEVAL_DIVERGED = 8192
 
     def __init__(self, num_samples):
         self.flags = np.zeros(num_samples, dtype=np.int16)
@@ -41,11 +45,11 @@ class FlagCoding():
 
     @staticmethod
     def get_flag_masks():
-        return "1,2,4,8,16,32,64,128,256,512,1024,2048,4096"
+        return "1,2,4,8,16,32,64,128,256,512,1024,2048,4096,8192"
 
     @staticmethod
     def get_flag_meanings():
-        return "avg_inv_thresh amsre_flag bt_out_of_range ws_out_of_range inv_geolocation sza_out_of_range sst_out_of_range bt_pol_test_failed inv_file_name rfi_possible diurnal_warming rain_possible std_dev_too_high"
+        return "avg_inv_thresh amsre_flag bt_out_of_range ws_out_of_range inv_geolocation sza_out_of_range sst_out_of_range bt_pol_test_failed inv_file_name rfi_possible diurnal_warming rain_possible std_dev_too_high retrieval_diverged"
 
     def add_avg_inv_thresh(self, tags):
         self._add_flag(tags, self.AVG_INV_THRESH)
@@ -86,5 +90,8 @@ class FlagCoding():
     def add_stddev_too_high(self, tags):
         self._add_flag(tags, self.STDDEV_TOO_HIGH)
 
+    def add_retrieval_diverged(self, tags):
+        self._add_flag(tags, self.RETRIEVAL_DIVERGED)
+
     def _add_flag(self, tags, flag_value):
         self.flags = np.bitwise_or(self.flags, tags.astype(np.int16) * flag_value)
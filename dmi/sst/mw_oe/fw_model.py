@@ -1,6 +1,6 @@
 import numpy as np
 
-from numba import jit, prange
+from numba import jit
 
 # AMSR-E frequencies
 FREQ = np.array([6.93, 10.65, 18.70, 23.80, 36.50], dtype=np.float64)
@@ -51,15 +51,46 @@ MC_GEO = np.array([[-0.00027, 0.00054, -2.1e-005, 3.2e-005, -2.1e-005, -2.526e-0
                    [-0.00049, 0.00113, -5.3e-005, 7e-005, -2.1e-005, -3.69e-005, 3.1e-007, -1.2e-007], [-0.00063, 0.00139, -7e-005, 8.5e-005, -2.1e-005, -4.195e-005, 4.1e-007, -2e-007],
                    [-0.00101, 0.00191, -0.000105, 0.000112, -2.1e-005, -5.451e-005, 4.5e-007, -3.6e-007]], dtype=np.float64)
 
+# per frequency constants of equations (62a+b) and of the wind induced slope variance
+DELTA_S2_SLOPE = np.append(5.22e-3 * (1.0 - 0.00748 * (np.power(37.0 - FREQ[0:4], 1.3))), 5.22e-3)
+OMEGA_H_COEFF = 6.2 - 0.001 * np.square(37.0 - FREQ)
+OMEGA_V_COEFF = 2.5 + 0.018 * (37.0 - FREQ)
+
+
+# layout of the geometry context, the state independent terms of the forward model per matchup
+CTX_COS_THETA = 0
+CTX_SIN_THETA_SQ = 1
+CTX_EPSILON_S_SSS = 2
+CTX_SIGMA_SSS = 3
+CTX_BIAS_TRIG = 4  # the eight relative wind direction terms of the bias correction
+CTX_SIZE = 12
+
+
+def create_geometry_context(theta_d, sss, phi_rd):
+    """
+    Calculates the forward model terms depending on geometry and salinity only. Scalar parameters give a context of
+    shape (CTX_SIZE), arrays of length N a context of shape (N, CTX_SIZE).
+    """
+    theta_r = np.asarray(theta_d, dtype=np.float64) * DEG_TO_RAD
+    phi_rr = np.asarray(phi_rd, dtype=np.float64) * DEG_TO_RAD
+    sss = np.asarray(sss, dtype=np.float64)
+
+    sin_theta_r = np.sin(theta_r)
+    C = 0.5536 * sss  # equation (41)
+    terms = [np.cos(theta_r), sin_theta_r * sin_theta_r, np.exp(-3.45E-3 * sss + 4.69E-6 * sss * sss), 3.39E9 * np.power(C, 0.892), np.cos(phi_rr), np.sin(phi_rr), np.cos(phi_rr * 0.5),
+             np.sin(phi_rr * 0.5), np.cos(phi_rr / 3.0), np.sin(phi_rr / 3.0), np.cos(phi_rr * 0.25), np.sin(phi_rr * 0.25)]
+    return np.stack(np.broadcast_arrays(*terms), axis=-1)
+
 
 class FwModel:
     light_speed = 3.00E10  # Speed of light, [cm/s]
     LAMBA = light_speed / (FREQ * 1E9)
 
-    def run(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd):
-        # convert angles to radians
-        theta_r = theta_d * DEG_TO_RAD
-        phi_rr = phi_rd * DEG_TO_RAD
+    def run(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric_cache=None):
+        # callers running the model repeatedly for a matchup pass the geometry context calculated once and may pass a
+        # DielectricCache to share the sea-water dielectric constant between runs with the same surface temperature
+        if context is None:
+            context = create_geometry_context(theta_d, sss, phi_rd)
 
         # ---------------------
         # Information about ice
@@ -100,7 +131,7 @@ class FwModel:
         A_L = MC_ABS[:, 0] * (1.0 - MC_ABS[:, 1] * (T_L - 283.0)) * L
 
         # Total transmittance from the surface to the top of atmosphere - equation (22)
-        cos_theta_r = np.cos(theta_r)
+        cos_theta_r = context[CTX_COS_THETA]
         tau = np.exp((-1.0 / cos_theta_r) * (A_0 + A_V + A_L))
 
         T_BU = T_U * (1.0 - tau)  # The upwelling effective air temperature; equation (24a)
@@ -109,33 +140,13 @@ class FwModel:
         # --------------------------------
         # Dielectric Constant of Sea-water
         # --------------------------------
-        t_ow = T_ow - 273.15  # Surface temperature T_ow [deg Celcius]
-        epsilon_R = 4.44  # Dielectric constant at inf. freq.
-        ny = 0.012  # Spread factor
+        if dielectric_cache is None:
+            [epsilon, sqrt_eps_thet] = self.calc_dielectric(T_ow, sss, context)
+        else:
+            [epsilon, sqrt_eps_thet] = dielectric_cache.get(T_ow, sss, theta_d, context)
 
-        # equation (36) and (43)
-        epsilon_S = 87.9 * np.exp(-0.004585 * t_ow) * (np.exp(-3.45E-3 * sss + 4.69E-6 * sss * sss + 1.36E-5 * sss * t_ow))
-
-        # equation (38) and (44)
+        t_ow = T_ow - 273.15  # Surface temperature T_ow [deg Celcius]
         t_ow_sq = t_ow * t_ow
-        lambda_R = (3.3 * np.exp(-0.0346 * t_ow + 0.00017 * t_ow_sq)) - (6.54E-3 * (1 - 3.06E-2 * t_ow + 2.0E-4 * t_ow_sq) * sss)
-
-        C = 0.5536 * sss  # equation (41)
-        delta_t = 25.0 - t_ow  # equation (42)
-
-        # equation (40)
-        delta_t_sq = delta_t * delta_t
-        qsi = 2.03E-2 + 1.27E-4 * delta_t + 2.46E-6 * delta_t_sq - C * (3.34E-5 - 4.60E-7 * delta_t + 4.60E-8 * delta_t_sq)
-
-        sigma = 3.39E9 * np.power(C, 0.892) * np.exp(-delta_t * qsi)  # equation (39)
-
-        # equation (35)
-        lamb_r_ratio = np.complex128(1j * lambda_R / self.LAMBA)
-        sig_lamb = np.complex128(1j * sigma * self.LAMBA)
-        epsilon = epsilon_R + (epsilon_S - epsilon_R) / (1 + np.power(lamb_r_ratio, 1.0 - ny)) - 2 * sig_lamb / self.light_speed
-
-        sin_theta_r = np.sin(theta_r)
-        sqrt_eps_thet = np.sqrt(epsilon - sin_theta_r * sin_theta_r)
 
         # --------------------------------------------------
         # Atmospheric Radiation Scattered by the Sea Surface
@@ -171,22 +182,348 @@ class FwModel:
         # -----------------------------
         # Forward model bias correction
         # -----------------------------
-        T_B = bias_correction(T_B, W, phi_rr, t_ow, t_ow_sq)
+        T_B = bias_correction(T_B, W, context[CTX_BIAS_TRIG:], t_ow, t_ow_sq)
 
         return T_B
 
+    def run_with_jacobian(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None):
+        """
+        Runs the forward model and calculates the analytic derivatives of the brightness temperatures with respect
+        to the state vector (W, V, L, T_ow) in the same pass.
+        :return: [T_B, K] with T_B the ten brightness temperatures and K the (10, 4) Jacobian dT_B/d(W, V, L, T_ow)
+        """
+        if context is not None:
+            context = context[np.newaxis, :]
+        [W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd] = [np.atleast_1d(np.asarray(param, dtype=np.float64)) for param in [W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd]]
+
+        [T_B, K] = self._run_batch(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context, None, True)
+        return [T_B[0], K[0]]
+
+    def run_batch(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric=None):
+        """
+        Runs the forward model for N matchups at once, following run. All parameters are 1-D arrays of length N
+        or scalars applying to all matchups, the optional geometry context of shape (N, CTX_SIZE). The optional
+        dielectric is the result of calc_dielectric for the open water temperatures of the matchups.
+        :return: T_B of shape (N, 10)
+        """
+        [T_B, _] = self._run_batch(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context, dielectric, False)
+        return T_B
+
+    def run_batch_with_jacobian(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None):
+        """
+        Runs the forward model with the analytic derivatives for N matchups at once, following run_with_jacobian.
+        Parameters as for run_batch.
+        :return: [T_B, K] with T_B of shape (N, 10) and K the (N, 10, 4) Jacobian dT_B/d(W, V, L, T_ow)
+        """
+        return self._run_batch(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context, None, True)
+
+    def calc_dielectric(self, T_ow, sss, context, with_derivative=False):
+        """
+        Dielectric constant of sea-water and the Fresnel term sqrt(epsilon - sin^2(theta)) per frequency, depending on
+        the open water temperature, salinity and geometry only. Works on scalars with a context of shape (CTX_SIZE)
+        and on arrays of length N with a context of shape (N, CTX_SIZE).
+        :return: [epsilon, sqrt_eps_thet], complex of shape (5) or (N, 5), followed by their derivatives with respect
+        to T_ow if with_derivative is set
+        """
+        t_ow = np.asarray(T_ow, dtype=np.float64) - 273.15  # Surface temperature T_ow [deg Celcius]
+        sss = np.asarray(sss, dtype=np.float64)
+        epsilon_R = 4.44  # Dielectric constant at inf. freq.
+        ny = 0.012  # Spread factor
+
+        # equation (36) and (43)
+        epsilon_S = 87.9 * np.exp(-0.004585 * t_ow) * context[..., CTX_EPSILON_S_SSS] * np.exp(1.36E-5 * sss * t_ow)
+
+        # equation (38) and (44)
+        t_ow_sq = t_ow * t_ow
+        lambda_exp = 3.3 * np.exp(-0.0346 * t_ow + 0.00017 * t_ow_sq)
+        lambda_R = lambda_exp - (6.54E-3 * (1 - 3.06E-2 * t_ow + 2.0E-4 * t_ow_sq) * sss)
+
+        C = 0.5536 * sss  # equation (41)
+        delta_t = 25.0 - t_ow  # equation (42)
+
+        # equation (40)
+        delta_t_sq = delta_t * delta_t
+        qsi = 2.03E-2 + 1.27E-4 * delta_t + 2.46E-6 * delta_t_sq - C * (3.34E-5 - 4.60E-7 * delta_t + 4.60E-8 * delta_t_sq)
+
+        sigma = context[..., CTX_SIGMA_SSS] * np.exp(-delta_t * qsi)  # equation (39)
+
+        # equation (35)
+        lamb_r_ratio = 1j * lambda_R[..., np.newaxis] / self.LAMBA
+        sig_lamb = 1j * sigma[..., np.newaxis] * self.LAMBA
+        relax = 1 + np.power(lamb_r_ratio, 1.0 - ny)
+        epsilon = epsilon_R + (epsilon_S - epsilon_R)[..., np.newaxis] / relax - 2 * sig_lamb / self.light_speed
+
+        sqrt_eps_thet = np.sqrt(epsilon - context[..., CTX_SIN_THETA_SQ, np.newaxis])
+        if not with_derivative:
+            return [epsilon, sqrt_eps_thet]
+
+        depsilon_S = epsilon_S * (-0.004585 + 1.36E-5 * sss)
+        dlambda_R = lambda_exp * (-0.0346 + 0.00034 * t_ow) - 6.54E-3 * (-3.06E-2 + 4.0E-4 * t_ow) * sss
+        dqsi_ddelta_t = 1.27E-4 + 4.92E-6 * delta_t - C * (-4.60E-7 + 9.20E-8 * delta_t)
+        dsigma = sigma * (qsi + delta_t * dqsi_ddelta_t)  # d(delta_t)/dt = -1
+
+        drelax = (1.0 - ny) * (relax - 1) * (dlambda_R / lambda_R)[..., np.newaxis]
+        depsilon = depsilon_S[..., np.newaxis] / relax - (epsilon_S - epsilon_R)[..., np.newaxis] * drelax / (relax * relax) - 2j * dsigma[..., np.newaxis] * self.LAMBA / self.light_speed
+        dsqrt_eps_thet = depsilon / (2.0 * sqrt_eps_thet)
+        return [epsilon, sqrt_eps_thet, depsilon, dsqrt_eps_thet]
+
+    def _run_batch(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context, dielectric, with_jacobian):
+        # array implementation of the forward model shared by the batch and Jacobian entry points, the derivatives
+        # with respect to (W, V, L, T_ow) are calculated along if with_jacobian is set
+        [W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd] = np.broadcast_arrays(*[np.asarray(param, dtype=np.float64) for param in [W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd]])
+
+        if context is None:
+            context = create_geometry_context(theta_d, sss, phi_rd)
+
+        # ---------------------
+        # Information about ice
+        # ---------------------
+        F_MY = np.clip(F_MY, 0.0, 1.0)
+        C_is = np.clip(C_is, 0.0, 1.0)
+
+        C_MY = C_is * F_MY
+        C_FY = C_is - C_MY
+        C_ow = 1.0 - C_is
+
+        T_is = np.where(T_ow > 273.15, 273.15, 0.4 * T_ow + 163.2)
+        dT_is = np.where(T_ow > 273.15, 0.0, 0.4)
+        dT_o = np.where(C_is > 0.05, 0.0, 1.0)
+        T_ow = np.where(C_is > 0.05, 273.15, T_ow)
+
+        T_S_mix = C_is * T_is + C_ow * T_ow
+        T_L = (T_S_mix + 273.0) * 0.5
+
+        # ------------------------
+        # Model for the Atmosphere
+        # ------------------------
+        T_V = np.where(V <= 48.0, 273.16 + 0.8337 * V - 3.029e-5 * np.power(V, 3.33), 301.16)
+        delta = T_S_mix - T_V
+        sig_TS_TV = np.where(np.abs(delta) <= 20.0, 1.05 * delta * (1.0 - (delta * delta) / 1200), np.sign(delta) * 14.0)
+
+        # all per frequency quantities are of shape (N, 5), per matchup quantities are used as columns of shape (N, 1)
+        V_col = V[:, np.newaxis]
+        L_col = L[:, np.newaxis]
+        T_L_col = T_L[:, np.newaxis]
+        V_SQ = V_col * V_col
+        T_D = MC_ATM[:, 0] + MC_ATM[:, 1] * V_col + MC_ATM[:, 2] * V_SQ + MC_ATM[:, 3] * V_SQ * V_col + MC_ATM[:, 4] * V_SQ * V_SQ + MC_ATM[:, 5] * sig_TS_TV[:, np.newaxis]
+        T_U = T_D + MC_ATM[:, 6] + MC_ATM[:, 7] * V_col
+        A_0 = MC_ATM[:, 8] + MC_ATM[:, 9] * (T_D - 270.0)
+        A_V = MC_ATM[:, 10] * V_col + MC_ATM[:, 11] * V_SQ
+        A_L_coeff = MC_ABS[:, 0] * (1.0 - MC_ABS[:, 1] * (T_L_col - 283.0))
+        A_L = A_L_coeff * L_col
+
+        cos_theta_r = context[:, CTX_COS_THETA, np.newaxis]
+        tau = np.exp((-1.0 / cos_theta_r) * (A_0 + A_V + A_L))
+        T_BU = T_U * (1.0 - tau)
+
+        # --------------------------------
+        # Dielectric Constant of Sea-water
+        # --------------------------------
+        dT_o_col = dT_o[:, np.newaxis]
+        if with_jacobian:
+            [epsilon, sqrt_eps_thet, depsilon, dsqrt_eps_thet] = self.calc_dielectric(T_ow, sss, context, with_derivative=True)
+            depsilon = depsilon * dT_o_col
+            dsqrt_eps_thet = dsqrt_eps_thet * dT_o_col
+        elif dielectric is None:
+            [epsilon, sqrt_eps_thet] = self.calc_dielectric(T_ow, sss, context)
+        else:
+            [epsilon, sqrt_eps_thet] = dielectric
+
+        t_ow = T_ow - 273.15
+        t_ow_sq = t_ow * t_ow
+
+        # --------------------------------------------------
+        # Atmospheric Radiation Scattered by the Sea Surface
+        # --------------------------------------------------
+        W_col = W[:, np.newaxis]
+        Delta_S2 = DELTA_S2_SLOPE * W_col
+        dDelta_S2 = np.where(Delta_S2 <= 0.069, DELTA_S2_SLOPE, 0.0)
+        Delta_S2 = np.minimum(Delta_S2, 0.069)
+        term_62 = Delta_S2 - 70 * np.power(Delta_S2, 3)
+
+        atmosphere = [T_D, tau, T_BU, term_62]
+        surface = [C_FY[:, np.newaxis], C_MY[:, np.newaxis], C_ow[:, np.newaxis], T_is[:, np.newaxis], T_ow[:, np.newaxis], W_col, theta_d[:, np.newaxis]]
+        derivatives = None
+        if with_jacobian:
+            dT_S_mix = C_is * dT_is + C_ow * dT_o
+            dT_L = (dT_S_mix * 0.5)[:, np.newaxis]
+            dT_V = np.where(V <= 48.0, 0.8337 - 3.33 * 3.029e-5 * np.power(V, 2.33), 0.0)
+            dsig = np.where(np.abs(delta) <= 20.0, 1.05 * (1.0 - (delta * delta) / 400), 0.0)
+            dsig_dV = (-dsig * dT_V)[:, np.newaxis]
+            dsig_dT = (dsig * dT_S_mix)[:, np.newaxis]
+
+            dT_D_dV = MC_ATM[:, 1] + 2.0 * MC_ATM[:, 2] * V_col + 3.0 * MC_ATM[:, 3] * V_SQ + 4.0 * MC_ATM[:, 4] * V_SQ * V_col + MC_ATM[:, 5] * dsig_dV
+            dT_D_dT = MC_ATM[:, 5] * dsig_dT
+            dT_U_dV = dT_D_dV + MC_ATM[:, 7]
+            dT_U_dT = dT_D_dT
+
+            dtau_factor = -tau / cos_theta_r
+            dtau_dV = dtau_factor * (MC_ATM[:, 9] * dT_D_dV + MC_ATM[:, 10] + 2.0 * MC_ATM[:, 11] * V_col)
+            dtau_dL = dtau_factor * A_L_coeff
+            dtau_dT = dtau_factor * (MC_ATM[:, 9] * dT_D_dT - MC_ABS[:, 0] * MC_ABS[:, 1] * dT_L * L_col)
+
+            dT_BU_dV = dT_U_dV * (1.0 - tau) - T_U * dtau_dV
+            dT_BU_dL = -T_U * dtau_dL
+            dT_BU_dT = dT_U_dT * (1.0 - tau) - T_U * dtau_dT
+            dterm_62 = (1.0 - 210.0 * Delta_S2 * Delta_S2) * dDelta_S2
+
+            derivatives = [dT_D_dV, dT_D_dT, dtau_dV, dtau_dL, dtau_dT, dT_BU_dV, dT_BU_dL, dT_BU_dT, dterm_62, dT_is[:, np.newaxis], dT_o_col]
+
+        # ---------------------------------------------------------------------------------------------
+        # ----- HORIZONTAL ----------------------------------------------------------------------------
+        # ---------------------------------------------------------------------------------------------
+        rho_H = (cos_theta_r - sqrt_eps_thet) / (cos_theta_r + sqrt_eps_thet)
+        R_0H = np.abs(rho_H) * np.abs(rho_H)
+        dR_0H = None
+        if with_jacobian:
+            drho_H = -2.0 * cos_theta_r * dsqrt_eps_thet / np.square(cos_theta_r + sqrt_eps_thet)
+            dR_0H = 2.0 * np.real(np.conj(rho_H) * drho_H)
+        [T_BH, dT_BH] = _polarised_bt(R_0H, dR_0H, MC_GEO[:, 1], MC_GEO[:, 3], MC_GEO[:, 5], MC_GEO[:, 7], 7.0, MC_M[:, 1], MC_M[:, 3], OMEGA_H_COEFF, 2.0, EMISSIVITY_FY_H,
+                                      EMISSIVITY_MY_H, atmosphere, surface, derivatives)
+
+        # ---------------------------------------------------------------------------------------------
+        # ----- VERTICAL ------------------------------------------------------------------------------
+        # ---------------------------------------------------------------------------------------------
+        eps_cos = epsilon * cos_theta_r
+        rho_V = (eps_cos - sqrt_eps_thet) / (eps_cos + sqrt_eps_thet)
+        T_ow_col = T_ow[:, np.newaxis]
+        R_0V = np.abs(rho_V) * np.abs(rho_V) + (4.887E-8 - 6.108E-8 * np.power(T_ow_col - 273.0, 3.0))
+        dR_0V = None
+        if with_jacobian:
+            drho_V = 2.0 * cos_theta_r * (depsilon * sqrt_eps_thet - epsilon * dsqrt_eps_thet) / np.square(eps_cos + sqrt_eps_thet)
+            dR_0V = 2.0 * np.real(np.conj(rho_V) * drho_V) - 3.0 * 6.108E-8 * np.power(T_ow_col - 273.0, 2.0) * dT_o_col
+        [T_BV, dT_BV] = _polarised_bt(R_0V, dR_0V, MC_GEO[:, 0], MC_GEO[:, 2], MC_GEO[:, 4], MC_GEO[:, 6], 3.0, MC_M[:, 0], MC_M[:, 2], OMEGA_V_COEFF, 3.4, EMISSIVITY_FY_V,
+                                      EMISSIVITY_MY_V, atmosphere, surface, derivatives)
+
+        # ------------------------------
+        # sort output (exclude 53+89GHz)
+        # ------------------------------
+        T_B = np.empty([len(W), 10], dtype=np.float64)
+        T_B[:, 0::2] = T_BV
+        T_B[:, 1::2] = T_BH
+
+        # -----------------------------
+        # Forward model bias correction
+        # -----------------------------
+        T_B = bias_correction_batch(T_B, W, context[:, CTX_BIAS_TRIG:], t_ow, t_ow_sq)
+        if not with_jacobian:
+            return [T_B, None]
+
+        K = np.empty([len(W), 10, 4], dtype=np.float64)
+        K[:, 0::2, :] = dT_BV
+        K[:, 1::2, :] = dT_BH
+        K[:, :, 0] -= COEFFS[:, 3] + 2.0 * COEFFS[:, 4] * W_col
+        K[:, :, 3] -= (COEFFS[:, 1] + 2.0 * COEFFS[:, 2] * t_ow[:, np.newaxis]) * dT_o_col
+        return [T_B, K]
+
+
+def _polarised_bt(R_0, dR_0_dT, geo_0, geo_1, geo_2, geo_3, W_1, m_1, m_2, omega_coeff, tau_exponent, emissivity_FY, emissivity_MY, atmosphere, surface, derivatives):
+    """
+    Brightness temperatures of one polarisation for arrays of matchups, equations (8), (10), (49), (61) and (62).
+    The derivatives of the atmosphere and surface terms are given if the Jacobian is calculated, otherwise None.
+    :return: [T_BP, dT_BP] of shape (N, 5) and (N, 5, 4), dT_BP is None without derivatives
+    """
+    [T_D, tau, T_BU, term_62] = atmosphere
+    [C_FY, C_MY, C_ow, T_is, T_ow, W, theta_d] = surface
+
+    # wind-roughened sea surface, equation (49)
+    geo = geo_0 + geo_1 * (theta_d - 53.0) + geo_2 * (T_ow - 288.0) + geo_3 * (theta_d - 53.0) * (T_ow - 288.0)
+    R_geo = R_0 - geo * W
+    F = _calc_F_batch(W, W_1, m_1, m_2)
+    R = (1.0 - F) * R_geo
+    E = 1.0 - R
+
+    # mixed surface, equation (61) and (62)
+    R_eff = 1.0 - (C_ow * E + C_FY * emissivity_FY + C_MY * emissivity_MY)
+
+    tau_pow = np.power(tau, tau_exponent)
+    Omega = omega_coeff * term_62 * tau_pow
+    T_D_C = T_D - T_C
+    G = (1.0 + Omega) * (1.0 - tau) * T_D_C + T_C
+    T_BOmega = G * R_eff
+
+    surface_bt = C_ow * E * T_ow + (C_FY * emissivity_FY + C_MY * emissivity_MY) * T_is
+
+    # equation (10)
+    T_BP = T_BU + tau * (surface_bt + T_BOmega)
+    if derivatives is None:
+        return [T_BP, None]
+
+    [dT_D_dV, dT_D_dT, dtau_dV, dtau_dL, dtau_dT, dT_BU_dV, dT_BU_dL, dT_BU_dT, dterm_62, dT_is, dT_o] = derivatives
+
+    dR_geo_dW = -geo
+    dR_geo_dT = dR_0_dT - (geo_2 + geo_3 * (theta_d - 53.0)) * dT_o * W
+    dF_dW = _calc_F_batch_derivative(W, W_1, m_1, m_2)
+    dR_dW = -dF_dW * R_geo + (1.0 - F) * dR_geo_dW
+    dR_dT = (1.0 - F) * dR_geo_dT
+
+    dtau_pow = tau_exponent * np.power(tau, tau_exponent - 1.0)
+    dOmega_dW = omega_coeff * dterm_62 * tau_pow
+    dOmega_dV = omega_coeff * term_62 * dtau_pow * dtau_dV
+    dOmega_dL = omega_coeff * term_62 * dtau_pow * dtau_dL
+    dOmega_dT = omega_coeff * term_62 * dtau_pow * dtau_dT
+
+    dG_dW = dOmega_dW * (1.0 - tau) * T_D_C
+    dG_dV = dOmega_dV * (1.0 - tau) * T_D_C - (1.0 + Omega) * dtau_dV * T_D_C + (1.0 + Omega) * (1.0 - tau) * dT_D_dV
+    dG_dL = dOmega_dL * (1.0 - tau) * T_D_C - (1.0 + Omega) * dtau_dL * T_D_C
+    dG_dT = dOmega_dT * (1.0 - tau) * T_D_C - (1.0 + Omega) * dtau_dT * T_D_C + (1.0 + Omega) * (1.0 - tau) * dT_D_dT
+
+    dT_BOmega_dW = dG_dW * R_eff + G * C_ow * dR_dW
+    dT_BOmega_dV = dG_dV * R_eff
+    dT_BOmega_dL = dG_dL * R_eff
+    dT_BOmega_dT = dG_dT * R_eff + G * C_ow * dR_dT
+
+    dsurface_bt_dW = -C_ow * dR_dW * T_ow
+    dsurface_bt_dT = C_ow * (E * dT_o - dR_dT * T_ow) + (C_FY * emissivity_FY + C_MY * emissivity_MY) * dT_is
+
+    dT_BP = np.empty(T_BP.shape + (4,), dtype=np.float64)
+    dT_BP[..., 0] = tau * (dsurface_bt_dW + dT_BOmega_dW)
+    dT_BP[..., 1] = dT_BU_dV + dtau_dV * (surface_bt + T_BOmega) + tau * dT_BOmega_dV
+    dT_BP[..., 2] = dT_BU_dL + dtau_dL * (surface_bt + T_BOmega) + tau * dT_BOmega_dL
+    dT_BP[..., 3] = dT_BU_dT + dtau_dT * (surface_bt + T_BOmega) + tau * (dsurface_bt_dT + dT_BOmega_dT)
+    return [T_BP, dT_BP]
+
+
+def _calc_F_batch(W, W_1, m_1, m_2):
+    """
+    Vectorised calc_F_horizontal and calc_F_vertical, W of shape (N, 1). The transition ends at W_2 = 12 m/s for
+    both polarisations.
+    """
+    W_2 = 12.0
+    F_low = m_1 * W
+    F_mid = m_1 * W + 0.5 * (m_2 - m_1) * (W - W_1) * (W - W_1) / (W_2 - W_1)
+    F_high = m_2 * W - 0.5 * (m_2 - m_1) * (W_2 + W_1)
+    return np.where(W < W_1, F_low, np.where(W <= W_2, F_mid, F_high))
+
+
+def _calc_F_batch_derivative(W, W_1, m_1, m_2):
+    """
+    Derivative of _calc_F_batch with respect to W, W of shape (N, 1).
+    """
+    W_2 = 12.0
+    dF_mid = m_1 + (m_2 - m_1) * (W - W_1) / (W_2 - W_1)
+    return np.where(W < W_1, m_1, np.where(W <= W_2, dF_mid, m_2))
+
+
+def bias_correction_batch(T_B, W, bias_trig, t_ow, t_ow_sq):
+    """
+    Vectorised bias_correction, T_B of shape (N, 10), bias_trig of shape (N, 8) and all other parameters of shape (N).
+    """
+    regressors = np.concatenate([np.stack([np.ones(len(W)), t_ow, t_ow_sq, W, W * W], axis=1), bias_trig], axis=1)
+    return T_B - np.matmul(regressors, COEFFS.transpose())
+
 
-@jit('float64[:](float64[:], float64, float64, float64, float64)', nopython=True, parallel=True)
-def bias_correction(T_B, W, phi_rr, t_ow, t_ow_sq):
-    for i in prange(0, 10):
-        T_B[i] = T_B[i] - COEFFS[i, 0] - COEFFS[i, 1] * t_ow - COEFFS[i, 2] * t_ow_sq - COEFFS[i, 3] * W - COEFFS[i, 4] * W * W - COEFFS[i, 5] * np.cos(phi_rr) - COEFFS[i, 6] * np.sin(phi_rr) - \
-                 COEFFS[i, 7] * np.cos(phi_rr * 0.5) - COEFFS[i, 8] * np.sin(phi_rr * 0.5) - COEFFS[i, 9] * np.cos(phi_rr / 3.0) - COEFFS[i, 10] * np.sin(phi_rr / 3.0) - COEFFS[i, 11] * np.cos(
-            phi_rr * 0.25) - COEFFS[i, 12] * np.sin(phi_rr * 0.25)
+@jit('float64[:](float64[:], float64, float64[:], float64, float64)', nopython=True, cache=True)
+def bias_correction(T_B, W, bias_trig, t_ow, t_ow_sq):
+    # bias_trig are the relative wind direction terms of the geometry context
+    for i in range(0, 10):
+        T_B[i] = T_B[i] - COEFFS[i, 0] - COEFFS[i, 1] * t_ow - COEFFS[i, 2] * t_ow_sq - COEFFS[i, 3] * W - COEFFS[i, 4] * W * W - COEFFS[i, 5] * bias_trig[0] - COEFFS[i, 6] * bias_trig[1] - \
+                 COEFFS[i, 7] * bias_trig[2] - COEFFS[i, 8] * bias_trig[3] - COEFFS[i, 9] * bias_trig[4] - COEFFS[i, 10] * bias_trig[5] - COEFFS[i, 11] * bias_trig[6] - COEFFS[i, 12] * bias_trig[7]
 
     return T_B
 
 
-@jit('float64(float64)', nopython=True)
+@jit('float64(float64)', nopython=True, cache=True)
 def clamp_to_0_1(param):
     if param < 0.0:
         return np.float64(0.0)
@@ -197,7 +534,7 @@ def clamp_to_0_1(param):
     return param
 
 
-@jit('float64(float64)', nopython=True)
+@jit('float64(float64)', nopython=True, cache=True)
 def calc_ice_temp(T_ow):
     if T_ow > 273.15:
         return np.float64(273.15)
@@ -205,7 +542,7 @@ def calc_ice_temp(T_ow):
         return 0.4 * T_ow + 163.2  # 0.6 * 272 = 163.2
 
 
-@jit('float64(float64, float64)', nopython=True)
+@jit('float64(float64, float64)', nopython=True, cache=True)
 def calc_open_water_temp(C_is, T_ow):
     if C_is > 0.05:
         return np.float64(273.15)
@@ -213,7 +550,7 @@ def calc_open_water_temp(C_is, T_ow):
         return T_ow
 
 
-@jit('float64(float64)', nopython=True)
+@jit('float64(float64)', nopython=True, cache=True)
 def calc_T_V(V):
     if V <= 48.0:
         # equation (27a)
@@ -223,7 +560,7 @@ def calc_T_V(V):
         return np.float64(301.16)
 
 
-@jit('float64(float64, float64)', nopython=True)
+@jit('float64(float64, float64)', nopython=True, cache=True)
 def calc_sig_TS_TV(T_S_mix, T_V):
     delta = T_S_mix - T_V
     abs_delta = np.abs(delta)
@@ -235,7 +572,7 @@ def calc_sig_TS_TV(T_S_mix, T_V):
         return np.sign(delta) * 14.0
 
 
-@jit('float64[:](float64)', nopython=True)
+@jit('float64[:](float64)', nopython=True, cache=True)
 def calc_F_horizontal(W):
     W_1 = 7.0
     W_2 = 12.0
@@ -248,7 +585,7 @@ def calc_F_horizontal(W):
         return MC_M[:, 3] * W - 0.5 * (MC_M[:, 3] - MC_M[:, 1]) * (W_2 + W_1)  # equation (60c)
 
 
-@jit('float64[:](float64)', nopython=True)
+@jit('float64[:](float64)', nopython=True, cache=True)
 def calc_F_vertical(W):
     W_1 = 3.0
     W_2 = 12.0
@@ -261,23 +598,23 @@ def calc_F_vertical(W):
         return MC_M[:, 2] * W - 0.5 * (MC_M[:, 2] - MC_M[:, 0]) * (W_2 + W_1)  # equation (60c)
 
 
-@jit('float64[:](float64)', nopython=True, parallel=True)
+@jit('float64[:](float64)', nopython=True, cache=True)
 def create_Delta_S2(W):
     delta_S2 = np.zeros((5), dtype=np.float64)
 
-    for i in prange(0, 4):
+    for i in range(0, 4):
         delta_S2[i] = 5.22e-3 * (1.0 - 0.00748 * (np.power(37.0 - FREQ[i], 1.3))) * W
 
     delta_S2[4] = 5.22e-3 * W
 
-    for i in prange(0, 5):
+    for i in range(0, 5):
         if delta_S2[i] > 0.069:
             delta_S2[i] = 0.069
 
     return delta_S2
 
 
-@jit('float64[:](float64, float64, float64, float64[:], float64[:], float64, float64, float64, float64, complex128[:], float64[:], float64[:], float64 )', nopython=True)
+@jit('float64[:](float64, float64, float64, float64[:], float64[:], float64, float64, float64, float64, complex128[:], float64[:], float64[:], float64 )', nopython=True, cache=True)
 def calc_horizontal_polarised_BT(C_FY, C_MY, C_ow, T_BU, T_D, T_is, T_ow, W, cos_theta_r, sqrt_eps_thet, tau, term_62, theta_d):
     T_BH_FY = T_is * EMISSIVITY_FY_H  # brightness temperature from FY is (horizontal pol)
     T_BH_MY = T_is * EMISSIVITY_MY_H  # brightness temperature from MY is (horizontal pol)
@@ -316,7 +653,7 @@ def calc_horizontal_polarised_BT(C_FY, C_MY, C_ow, T_BU, T_D, T_is, T_ow, W, cos
     return T_BH
 
 
-@jit('float64[:](float64, float64, float64, float64[:], float64[:], float64, float64, float64, float64, complex128[:], complex128[:], float64[:], float64[:], float64 )', nopython=True)
+@jit('float64[:](float64, float64, float64, float64[:], float64[:], float64, float64, float64, float64, complex128[:], complex128[:], float64[:], float64[:], float64 )', nopython=True, cache=True)
 def calc_vertical_polarised_BT(C_FY, C_MY, C_ow, T_BU, T_D, T_is, T_ow, W, cos_theta_r, epsilon, sqrt_eps_thet, tau, term_62, theta_d):
     T_BV_FY = T_is * EMISSIVITY_FY_V  # brightness temperature from FY is (vertical pol)
     T_BV_MY = T_is * EMISSIVITY_MY_V  # brightness temperature from MY is (vertical pol)
@@ -0,0 +1,129 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from dmi.sst.mw_oe.constants import FW_CACHE_TOLERANCE
+from dmi.sst.mw_oe.fw_model import CTX_BIAS_TRIG
+
+RAD_TO_DEG = 180.0 / math.pi
+
+# upper bounds of |dT_B/dx| for open water over W [m/s], V [mm], L [mm], T_ow [K], theta_d [deg] and phi_rd [deg],
+# sampled from FwModel over 0..30 m/s, 0..75 mm, -0.2..0.6 mm, 268..312 K, 50..60 deg and 0..360 deg with margin,
+# verified by fw_model_cache_test
+SENSITIVITY = np.array([2.5, 4.0, 200.0, 1.0, 4.0, 0.01], dtype=np.float64)
+
+# upper bound of the brightness temperature step [K] of the open water model at V = 48 mm, where the vapour
+# temperature switches to a constant. A cell containing the switch differs by at most this step in addition
+DISCONTINUITY = 2e-4
+
+DEFAULT_MAX_SIZE = 100000
+
+
+class FwModelCache:
+    """
+    Bounded least recently used cache in front of a forward model, keyed on the quantized state and geometry
+    (W, V, L, T_ow, theta_d, phi_rd) and the exact salinity. A miss evaluates the wrapped model at the requested point,
+    a hit returns the result of an earlier point in the same quantization cell. Its brightness temperatures differ by at
+    most error_bound = sum(SENSITIVITY * steps) + DISCONTINUITY, which must not exceed the tolerance [K].
+
+    The sensitivities hold for open water only, points with ice (C_is or F_MY not zero) are passed to the wrapped
+    model. Jacobians are not cached either, a hit would return the derivatives of a different point without a bound.
+    Finite difference Jacobians over cached brightness temperatures with the step eps_j deviate by at most
+    2 * error_bound / eps_j.
+    """
+    fw_model = None
+    max_size = None
+    tolerance = None
+    steps = None
+    error_bound = None
+    entries = None
+    hits = None
+    misses = None
+
+    def __init__(self, fw_model, max_size=DEFAULT_MAX_SIZE, tolerance=FW_CACHE_TOLERANCE, steps=None):
+        if max_size < 1:
+            raise ValueError("forward model cache size must be positive: " + str(max_size))
+        if tolerance <= DISCONTINUITY:
+            raise ValueError("forward model cache tolerance must exceed " + str(DISCONTINUITY) + " K: " + str(tolerance))
+        if steps is None:
+            # the tolerance is shared equally by the six quantized parameters
+            steps = (tolerance - DISCONTINUITY) / (len(SENSITIVITY) * SENSITIVITY)
+
+        steps = np.asarray(steps, dtype=np.float64)
+        if steps.shape != SENSITIVITY.shape or np.any(steps <= 0.0):
+            raise ValueError("forward model cache requires six positive quantization steps")
+        error_bound = float(np.sum(SENSITIVITY * steps)) + DISCONTINUITY
+        if error_bound > tolerance * (1.0 + 1e-9):
+            raise ValueError("forward model cache quantization error bound of " + str(error_bound) + " K exceeds the tolerance of " + str(tolerance) + " K")
+
+        self.fw_model = fw_model
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.steps = steps
+        self.error_bound = error_bound
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric_cache=None):
+        if C_is != 0.0 or F_MY != 0.0:
+            return self.fw_model.run(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=context, dielectric_cache=dielectric_cache)
+
+        key = self._get_key(W, V, L, T_ow, theta_d, sss, phi_rd, context)
+        T_B = self._lookup(key)
+        if T_B is None:
+            T_B = self.fw_model.run(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=context, dielectric_cache=dielectric_cache)
+            self._store(key, np.copy(T_B))
+            return T_B
+
+        return np.copy(T_B)
+
+    def run_with_jacobian(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None):
+        return self.fw_model.run_with_jacobian(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=context)
+
+    def calc_dielectric(self, T_ow, sss, context):
+        return self.fw_model.calc_dielectric(T_ow, sss, context)
+
+    def clear(self):
+        self.entries.clear()
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, entry):
+        if len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+        self.entries[key] = entry
+
+    def _get_key(self, W, V, L, T_ow, theta_d, sss, phi_rd, context):
+        # callers passing a geometry context may leave the relative angle undefined, it is recovered from the bias
+        # correction terms cos(phi / 4) and sin(phi / 4), which are unique for angles within (-360, 360) degrees
+        if math.isnan(phi_rd) and context is not None:
+            phi_rd = math.atan2(context[CTX_BIAS_TRIG + 7], context[CTX_BIAS_TRIG + 6]) * 4.0 * RAD_TO_DEG
+        cells = tuple(_quantize(value, step) for value, step in zip([W, V, L, T_ow, theta_d, phi_rd], self.steps))
+        return cells + (_exact(sss),)
+
+
+def _quantize(value, step):
+    # invalid parameters share one cell, the forward model returns NaN for them
+    if not math.isfinite(value / step):
+        return None
+
+    return math.floor(value / step)
+
+
+def _exact(value):
+    # NaN never compares equal to itself, invalid parameters share one key
+    value = float(value)
+    if math.isnan(value):
+        return None
+
+    return value
@@ -0,0 +1,147 @@
+import numpy as np
+from numba import jit
+
+from dmi.sst.mw_oe.fw_model import FREQ, MC_ATM, MC_ABS, MC_GEO, MC_M, COEFFS, T_C, DELTA_S2_SLOPE, OMEGA_H_COEFF, OMEGA_V_COEFF, CTX_COS_THETA, CTX_SIN_THETA_SQ, CTX_EPSILON_S_SSS, \
+    CTX_SIGMA_SSS, CTX_BIAS_TRIG, calc_T_V, calc_sig_TS_TV
+
+# Fused nopython forward model for open water (C_is = F_MY = 0). All functions work on scalars and caller provided
+# buffers, the complex dielectric constant is carried as real and imaginary parts. It shares the coefficients with
+# FwModel but restates its equations in real arithmetic, fw_model_kernel_test keeps both in agreement.
+
+LIGHT_SPEED = 3.00E10  # Speed of light, [cm/s]
+LAMBA = LIGHT_SPEED / (FREQ * 1E9)
+
+NUM_FREQ = 5
+NUM_BT = 10
+
+EPSILON_R = 4.44  # Dielectric constant at inf. freq.
+NY = 0.012  # Spread factor
+
+# (i x)^(1 - ny) = x^(1 - ny) (cos + i sin)(pi / 2 (1 - ny)) for the positive relaxation ratio x
+RELAX_COS = np.cos(0.5 * np.pi * (1.0 - NY))
+RELAX_SIN = np.sin(0.5 * np.pi * (1.0 - NY))
+
+# layout of the dielectric buffer (4, NUM_FREQ)
+DIELECTRIC_EPSILON_RE = 0
+DIELECTRIC_EPSILON_IM = 1
+DIELECTRIC_SQRT_RE = 2
+DIELECTRIC_SQRT_IM = 3
+
+
+def create_dielectric_buffer():
+    return np.empty([4, NUM_FREQ], dtype=np.float64)
+
+
+@jit(nopython=True, cache=True)
+def run_open_water(W, V, L, T_ow, theta_d, sss, context, dielectric, T_B):
+    # full forward model run, dielectric is used as workspace and T_B receives the ten brightness temperatures
+    open_water_dielectric(T_ow, sss, context, dielectric)
+    open_water_brightness(W, V, L, T_ow, theta_d, context, dielectric, T_B)
+
+
+@jit(nopython=True, cache=True)
+def open_water_dielectric(T_ow, sss, context, dielectric):
+    # dielectric constant of sea-water and sqrt(epsilon - sin^2(theta)) per frequency, equations (35) to (44)
+    t_ow = T_ow - 273.15
+    epsilon_S = 87.9 * np.exp(-0.004585 * t_ow) * context[CTX_EPSILON_S_SSS] * np.exp(1.36E-5 * sss * t_ow)
+    t_ow_sq = t_ow * t_ow
+    lambda_R = (3.3 * np.exp(-0.0346 * t_ow + 0.00017 * t_ow_sq)) - (6.54E-3 * (1 - 3.06E-2 * t_ow + 2.0E-4 * t_ow_sq) * sss)
+    C = 0.5536 * sss
+    delta_t = 25.0 - t_ow
+    delta_t_sq = delta_t * delta_t
+    qsi = 2.03E-2 + 1.27E-4 * delta_t + 2.46E-6 * delta_t_sq - C * (3.34E-5 - 4.60E-7 * delta_t + 4.60E-8 * delta_t_sq)
+    sigma = context[CTX_SIGMA_SSS] * np.exp(-delta_t * qsi)
+    sin_theta_sq = context[CTX_SIN_THETA_SQ]
+
+    for f in range(NUM_FREQ):
+        relax = np.power(lambda_R / LAMBA[f], 1.0 - NY)
+        denominator_re = 1.0 + relax * RELAX_COS
+        denominator_im = relax * RELAX_SIN
+        scale = (epsilon_S - EPSILON_R) / (denominator_re * denominator_re + denominator_im * denominator_im)
+        epsilon_re = EPSILON_R + scale * denominator_re
+        epsilon_im = -scale * denominator_im - 2.0 * sigma * LAMBA[f] / LIGHT_SPEED
+
+        # principal square root
+        z_re = epsilon_re - sin_theta_sq
+        modulus = np.sqrt(z_re * z_re + epsilon_im * epsilon_im)
+        sqrt_im = np.sqrt(0.5 * (modulus - z_re))
+        if epsilon_im < 0.0:
+            sqrt_im = -sqrt_im
+
+        dielectric[DIELECTRIC_EPSILON_RE, f] = epsilon_re
+        dielectric[DIELECTRIC_EPSILON_IM, f] = epsilon_im
+        dielectric[DIELECTRIC_SQRT_RE, f] = np.sqrt(0.5 * (modulus + z_re))
+        dielectric[DIELECTRIC_SQRT_IM, f] = sqrt_im
+
+
+@jit(nopython=True, cache=True)
+def open_water_brightness(W, V, L, T_ow, theta_d, context, dielectric, T_B):
+    # everything but the dielectric stage of FwModel.run for open water, including the bias correction
+    T_L = (T_ow + 273.0) * 0.5
+    T_V = calc_T_V(V)
+    sig_TS_TV = calc_sig_TS_TV(T_ow, T_V)
+    V_SQ = V * V
+
+    cos_theta_r = context[CTX_COS_THETA]
+    theta_dev = theta_d - 53.0
+    T_ow_dev = T_ow - 288.0
+    R_0V_correction = 4.887E-8 - 6.108E-8 * np.power(T_ow - 273.0, 3.0)
+
+    t_ow = T_ow - 273.15
+    t_ow_sq = t_ow * t_ow
+
+    for f in range(NUM_FREQ):
+        # atmosphere, equations (22) to (33)
+        T_D = MC_ATM[f, 0] + MC_ATM[f, 1] * V + MC_ATM[f, 2] * V_SQ + MC_ATM[f, 3] * V_SQ * V + MC_ATM[f, 4] * V_SQ * V_SQ + MC_ATM[f, 5] * sig_TS_TV
+        T_U = T_D + MC_ATM[f, 6] + MC_ATM[f, 7] * V
+        A_0 = MC_ATM[f, 8] + MC_ATM[f, 9] * (T_D - 270.0)
+        A_V = MC_ATM[f, 10] * V + MC_ATM[f, 11] * V_SQ
+        A_L = MC_ABS[f, 0] * (1.0 - MC_ABS[f, 1] * (T_L - 283.0)) * L
+        tau = np.exp((-1.0 / cos_theta_r) * (A_0 + A_V + A_L))
+        T_BU = T_U * (1.0 - tau)
+        T_D_C = T_D - T_C
+
+        Delta_S2 = min(DELTA_S2_SLOPE[f] * W, 0.069)
+        term_62 = Delta_S2 - 70 * Delta_S2 * Delta_S2 * Delta_S2
+
+        # power reflectivities |rho|^2 of equations (45) and (46)
+        sqrt_re = dielectric[DIELECTRIC_SQRT_RE, f]
+        sqrt_im = dielectric[DIELECTRIC_SQRT_IM, f]
+        R_0H = ((cos_theta_r - sqrt_re) ** 2 + sqrt_im * sqrt_im) / ((cos_theta_r + sqrt_re) ** 2 + sqrt_im * sqrt_im)
+
+        eps_cos_re = dielectric[DIELECTRIC_EPSILON_RE, f] * cos_theta_r
+        eps_cos_im = dielectric[DIELECTRIC_EPSILON_IM, f] * cos_theta_r
+        R_0V = ((eps_cos_re - sqrt_re) ** 2 + (eps_cos_im - sqrt_im) ** 2) / ((eps_cos_re + sqrt_re) ** 2 + (eps_cos_im + sqrt_im) ** 2) + R_0V_correction
+
+        # horizontal polarisation
+        R_geoH = R_0H - (MC_GEO[f, 1] + MC_GEO[f, 3] * theta_dev + MC_GEO[f, 5] * T_ow_dev + MC_GEO[f, 7] * theta_dev * T_ow_dev) * W
+        E_H = 1.0 - (1.0 - _calc_F(W, 7.0, MC_M[f, 1], MC_M[f, 3])) * R_geoH
+        OmegaH = OMEGA_H_COEFF[f] * term_62 * tau * tau
+        T_BOmegaH = ((1.0 + OmegaH) * (1.0 - tau) * T_D_C + T_C) * (1.0 - E_H)
+        T_B[2 * f + 1] = T_BU + tau * (E_H * T_ow + T_BOmegaH)
+
+        # vertical polarisation
+        R_geoV = R_0V - (MC_GEO[f, 0] + MC_GEO[f, 2] * theta_dev + MC_GEO[f, 4] * T_ow_dev + MC_GEO[f, 6] * theta_dev * T_ow_dev) * W
+        E_V = 1.0 - (1.0 - _calc_F(W, 3.0, MC_M[f, 0], MC_M[f, 2])) * R_geoV
+        OmegaV = OMEGA_V_COEFF[f] * term_62 * np.power(tau, 3.4)
+        T_BOmegaV = ((1.0 + OmegaV) * (1.0 - tau) * T_D_C + T_C) * (1.0 - E_V)
+        T_B[2 * f] = T_BU + tau * (E_V * T_ow + T_BOmegaV)
+
+    # forward model bias correction
+    for i in range(NUM_BT):
+        correction = COEFFS[i, 0] + COEFFS[i, 1] * t_ow + COEFFS[i, 2] * t_ow_sq + COEFFS[i, 3] * W + COEFFS[i, 4] * W * W
+        for k in range(8):
+            correction += COEFFS[i, 5 + k] * context[CTX_BIAS_TRIG + k]
+        T_B[i] -= correction
+
+
+@jit(nopython=True, cache=True)
+def _calc_F(W, W_1, m_1, m_2):
+    # scalar calc_F_horizontal and calc_F_vertical for one frequency, equation (60)
+    W_2 = 12.0
+    if W < W_1:
+        return m_1 * W
+    elif W <= W_2:
+        return m_1 * W + 0.5 * (m_2 - m_1) * (W - W_1) * (W - W_1) / (W_2 - W_1)
+    else:
+        return m_2 * W - 0.5 * (m_2 - m_1) * (W_2 + W_1)
@@ -0,0 +1,239 @@
+import os
+import tempfile
+
+import numpy as np
+from numba import jit
+
+from dmi.sst.mw_oe.fw_model import FwModel, COEFFS, CTX_BIAS_TRIG, create_geometry_context, bias_correction_batch
+
+NUM_BT = 10
+NUM_STATE = 4
+
+# regular table grid (start, stop, number of nodes) of W [m/s], V [mm], L [mm], T_ow [K] and theta_d [deg]; the
+# switches of the forward model at W = 3, 7, 12 m/s and V = 48 mm are grid nodes
+GRID = np.array([[0.0, 30.0, 31], [0.0, 75.0, 26], [-0.2, 0.6, 17], [268.0, 312.0, 23], [54.5, 56.0, 4]], dtype=np.float64)
+
+BUILD_CHUNK_SIZE = 100000
+
+
+class FwModelLut:
+    """
+    Lookup table emulator of FwModel for open water (C_is = F_MY = 0) and a fixed sea surface salinity. The table
+    holds the brightness temperatures before the forward model bias correction over (W, V, L, T_ow, theta_d) and is
+    interpolated multilinearly. The relative wind direction enters the model through the bias correction only, which
+    is applied exactly, so it is not a table dimension.
+    """
+    table = None
+    origin = None
+    step = None
+    sss = None
+
+    def __init__(self, table, origin, step, sss):
+        self.table = np.asarray(table)
+        self.origin = np.ascontiguousarray(origin, dtype=np.float64)
+        self.step = np.ascontiguousarray(step, dtype=np.float64)
+        self.sss = np.float64(sss)
+
+    @staticmethod
+    def build(grid=GRID, sss=35.0):
+        axes = [np.linspace(start, stop, int(num)) for [start, stop, num] in grid]
+        nodes = np.stack([axis.ravel() for axis in np.meshgrid(*axes, indexing="ij")], axis=1)
+
+        fw_model = FwModel()
+        table = np.empty([len(nodes), NUM_BT], dtype=np.float32)
+        for start in range(0, len(nodes), BUILD_CHUNK_SIZE):
+            chunk = nodes[start:start + BUILD_CHUNK_SIZE]
+            table[start:start + len(chunk)] = FwModelLut._run_uncorrected(fw_model, chunk, sss)
+
+        origin = grid[:, 0]
+        step = (grid[:, 1] - grid[:, 0]) / (grid[:, 2] - 1)
+        return FwModelLut(table.reshape([len(axis) for axis in axes] + [NUM_BT]), origin, step, sss)
+
+    @staticmethod
+    def load(path):
+        table = np.load(path, mmap_mode="r")
+        grid_file = np.load(FwModelLut._get_grid_path(path))
+        return FwModelLut(table, grid_file["origin"], grid_file["step"], grid_file["sss"])
+
+    @staticmethod
+    def load_or_build(path, sss=35.0):
+        if os.path.isfile(path) and os.path.isfile(FwModelLut._get_grid_path(path)):
+            print(" ... loading forward model lookup table " + path)
+            lut = FwModelLut.load(path)
+            if lut.sss == np.float64(sss):
+                return lut
+
+        print(" ... building forward model lookup table " + path)
+        lut = FwModelLut.build(sss=sss)
+        lut.print_accuracy_report(lut.accuracy_report())
+        lut.save(path)
+        return FwModelLut.load(path)
+
+    def save(self, path):
+        # the files are written through file handles, numpy appends its suffix to paths only. Each file is written to a
+        # temporary file and moved into place, concurrent jobs never load a partially written table
+        FwModelLut._write_atomic(FwModelLut._get_grid_path(path), lambda file: np.savez(file, origin=self.origin, step=self.step, sss=self.sss))
+        FwModelLut._write_atomic(path, lambda file: np.save(file, self.table))
+
+    def run(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric_cache=None):
+        # ice parameters and the dielectric cache are accepted for compatibility with FwModel and ignored
+        [T_B, _] = self._evaluate_point(W, V, L, T_ow, theta_d, sss, phi_rd, context, False)
+        return T_B
+
+    def run_with_jacobian(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None):
+        return self._evaluate_point(W, V, L, T_ow, theta_d, sss, phi_rd, context, True)
+
+    def run_batch(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric=None):
+        [T_B, _] = self._evaluate_batch(W, V, L, T_ow, theta_d, sss, phi_rd, context, False)
+        return T_B
+
+    def run_batch_with_jacobian(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None):
+        """
+        :return: [T_B, K] with T_B of shape (N, 10) and K the (N, 10, 4) Jacobian dT_B/d(W, V, L, T_ow) of the interpolant
+        """
+        return self._evaluate_batch(W, V, L, T_ow, theta_d, sss, phi_rd, context, True)
+
+    def accuracy_report(self, num_points=2000, seed=42):
+        """
+        Compares the emulator to FwModel.run_batch at random points inside the table grid.
+        :return: dict with the maximum and root mean square absolute brightness temperature errors per channel [K]
+        """
+        random = np.random.RandomState(seed)
+        upper = self.origin + self.step * (np.array(self.table.shape[:-1]) - 1)
+        points = self.origin + random.random_sample([num_points, len(self.origin)]) * (upper - self.origin)
+        phi_rd = random.random_sample(num_points) * 360.0
+
+        exact = FwModel().run_batch(points[:, 0], points[:, 1], points[:, 2], points[:, 3], 0.0, 0.0, points[:, 4], self.sss, phi_rd)
+        emulated = self.run_batch(points[:, 0], points[:, 1], points[:, 2], points[:, 3], 0.0, 0.0, points[:, 4], self.sss, phi_rd)
+        errors = np.abs(emulated - exact)
+        return {"max_error": np.max(errors, axis=0), "rms_error": np.sqrt(np.mean(errors * errors, axis=0)), "num_points": num_points}
+
+    @staticmethod
+    def print_accuracy_report(report):
+        print(" ... lookup table accuracy at " + str(report["num_points"]) + " points [K]")
+        print(" ... max error: " + ", ".join("%.4f" % error for error in report["max_error"]))
+        print(" ... rms error: " + ", ".join("%.4f" % error for error in report["rms_error"]))
+
+    def _evaluate_point(self, W, V, L, T_ow, theta_d, sss, phi_rd, context, with_jacobian):
+        if sss != self.sss:
+            self._raise_salinity_error()
+        if context is None:
+            context = create_geometry_context(theta_d, sss, phi_rd)
+
+        points = np.array([[W, V, L, T_ow, theta_d]], dtype=np.float64)
+        T_B = np.empty([1, NUM_BT], dtype=np.float64)
+        K = np.empty([1 if with_jacobian else 0, NUM_BT, NUM_STATE], dtype=np.float64)
+        interpolate(self.table, self.origin, self.step, points, context[np.newaxis, CTX_BIAS_TRIG:], with_jacobian, T_B, K)
+        return [T_B[0], K[0] if with_jacobian else None]
+
+    def _evaluate_batch(self, W, V, L, T_ow, theta_d, sss, phi_rd, context, with_jacobian):
+        [W, V, L, T_ow, theta_d, sss, phi_rd] = np.broadcast_arrays(*[np.atleast_1d(np.asarray(param, dtype=np.float64)) for param in [W, V, L, T_ow, theta_d, sss, phi_rd]])
+        if np.any(sss != self.sss):
+            self._raise_salinity_error()
+        if context is None:
+            context = create_geometry_context(theta_d, sss, phi_rd)
+
+        points = np.ascontiguousarray(np.stack([W, V, L, T_ow, theta_d], axis=1))
+        T_B = np.empty([len(points), NUM_BT], dtype=np.float64)
+        K = np.empty([len(points) if with_jacobian else 0, NUM_BT, NUM_STATE], dtype=np.float64)
+        interpolate(self.table, self.origin, self.step, points, np.ascontiguousarray(context[:, CTX_BIAS_TRIG:]), with_jacobian, T_B, K)
+        return [T_B, K if with_jacobian else None]
+
+    def _raise_salinity_error(self):
+        raise ValueError("lookup table built for a sea surface salinity of " + str(self.sss))
+
+    @staticmethod
+    def _run_uncorrected(fw_model, nodes, sss):
+        # forward model without the bias correction, which depends on W, T_ow and the relative wind direction only
+        W = nodes[:, 0]
+        T_ow = nodes[:, 3]
+        context = create_geometry_context(nodes[:, 4], sss, 0.0)
+        T_B = fw_model.run_batch(W, nodes[:, 1], nodes[:, 2], T_ow, 0.0, 0.0, nodes[:, 4], sss, 0.0, context=context)
+        t_ow = T_ow - 273.15
+        return T_B - bias_correction_batch(np.zeros_like(T_B), W, context[:, CTX_BIAS_TRIG:], t_ow, t_ow * t_ow)
+
+    @staticmethod
+    def _get_grid_path(path):
+        return os.path.splitext(path)[0] + "_grid.npz"
+
+    @staticmethod
+    def _write_atomic(path, write):
+        [handle, temp_path] = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+@jit(nopython=True, cache=True)
+def interpolate(table, origin, step, points, bias_trig, with_jacobian, T_B, K):
+    # multilinear interpolation in the five dimensional table, linear extrapolation outside the grid, followed by the
+    # forward model bias correction. K receives the derivatives with respect to (W, V, L, T_ow) if requested
+    num_dims = points.shape[1]
+    num_corners = 2 ** num_dims
+    values = table.reshape(-1)
+
+    # offsets of the corners of a grid cell in the flattened table
+    stride = np.empty(num_dims, dtype=np.int64)
+    stride[num_dims - 1] = NUM_BT
+    for d in range(num_dims - 2, -1, -1):
+        stride[d] = stride[d + 1] * table.shape[d + 1]
+    corner_offset = np.zeros(num_corners, dtype=np.int64)
+    for corner in range(num_corners):
+        for d in range(num_dims):
+            if (corner >> d) & 1 == 1:
+                corner_offset[corner] += stride[d]
+
+    frac = np.empty(num_dims, dtype=np.float64)
+    weight = np.empty(num_corners, dtype=np.float64)
+    for n in range(points.shape[0]):
+        base = 0
+        for d in range(num_dims):
+            position = (points[n, d] - origin[d]) / step[d]
+            index = min(max(int(np.floor(position)), 0), table.shape[d] - 2)
+            frac[d] = position - index
+            base += index * stride[d]
+
+        weight[0] = 1.0
+        for d in range(num_dims):
+            size = 1 << d
+            for corner in range(size):
+                weight[corner + size] = weight[corner] * frac[d]
+                weight[corner] *= 1.0 - frac[d]
+
+        for b in range(NUM_BT):
+            T_B[n, b] = 0.0
+        for corner in range(num_corners):
+            offset = base + corner_offset[corner]
+            for b in range(NUM_BT):
+                T_B[n, b] += weight[corner] * values[offset + b]
+
+        W = points[n, 0]
+        t_ow = points[n, 3] - 273.15
+        for b in range(NUM_BT):
+            correction = COEFFS[b, 0] + COEFFS[b, 1] * t_ow + COEFFS[b, 2] * t_ow * t_ow + COEFFS[b, 3] * W + COEFFS[b, 4] * W * W
+            for k in range(8):
+                correction += COEFFS[b, 5 + k] * bias_trig[n, k]
+            T_B[n, b] -= correction
+
+        if not with_jacobian:
+            continue
+
+        for s in range(NUM_STATE):
+            for b in range(NUM_BT):
+                K[n, b, s] = 0.0
+            for corner in range(num_corners):
+                derivative = 1.0 / step[s] if (corner >> s) & 1 == 1 else -1.0 / step[s]
+                for d in range(num_dims):
+                    if d != s:
+                        derivative *= frac[d] if (corner >> d) & 1 == 1 else 1.0 - frac[d]
+                offset = base + corner_offset[corner]
+                for b in range(NUM_BT):
+                    K[n, b, s] += derivative * values[offset + b]
+
+        for b in range(NUM_BT):
+            K[n, b, 0] -= COEFFS[b, 3] + 2.0 * COEFFS[b, 4] * W
+            K[n, b, 3] -= COEFFS[b, 1] + 2.0 * COEFFS[b, 2] * t_ow
@@ -0,0 +1,81 @@
+import queue
+import threading
+
+from dmi.sst.mw_oe.mmd_reader import MmdReader, FILE_LOCK
+
+IN_FLIGHT_FILES = 2
+
+
+class MmdPrefetcher:
+    """
+    Iterates over a list of MMD files, reading the next file in a background thread while the current one is processed.
+    Each file is read completely by MmdReader.read, so file access and decompression overlap with the computation of the
+    consumer. At most two files are in memory, the one handed out and the one read ahead.
+
+    The reader thread holds FILE_LOCK for the whole read of a file, opening, reading and decompressing all variables.
+    netCDF writes and closes of the consumer, which take FILE_LOCK as well, wait until that read is complete; only the
+    computation of the consumer overlaps with the read, its file output does not.
+    """
+    input_files = None
+    footprints = None
+    packed = None
+    workers = None
+    executor = None
+
+    def __init__(self, input_files, footprints=None, packed=False, workers=0, executor=None):
+        self.input_files = list(input_files)
+        self.footprints = footprints
+        self.packed = packed
+        self.workers = workers
+        self.executor = executor
+
+    def __iter__(self):
+        # yields (input_file, mmd_data); errors of the reader are raised when the failed file is next in turn
+        read_files = queue.Queue()
+        free_slots = threading.Semaphore(IN_FLIGHT_FILES)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._read_files, args=(read_files, free_slots, stop), daemon=True)
+        thread.start()
+
+        try:
+            for _ in range(len(self.input_files)):
+                [input_file, mmd_reader, mmd_data, error] = read_files.get()
+                if error is not None:
+                    raise error
+
+                try:
+                    yield input_file, mmd_data
+                finally:
+                    with FILE_LOCK:
+                        mmd_reader.close()
+                    free_slots.release()
+        finally:
+            # an abandoned iteration stops the reader thread, files read ahead are closed
+            stop.set()
+            free_slots.release()
+            thread.join()
+            while not read_files.empty():
+                mmd_reader = read_files.get()[1]
+                if mmd_reader is not None:
+                    with FILE_LOCK:
+                        mmd_reader.close()
+
+    def _read_files(self, read_files, free_slots, stop):
+        for input_file in self.input_files:
+            free_slots.acquire()
+            if stop.is_set():
+                return
+
+            mmd_reader = MmdReader()
+            try:
+                # the consumer keeps computing, its netCDF writes wait for the end of the read
+                with FILE_LOCK:
+                    mmd_data = mmd_reader.read(input_file, footprints=self.footprints, packed=self.packed, workers=self.workers, executor=self.executor)
+                    mmd_data.load()
+                read_files.put([input_file, mmd_reader, mmd_data, None])
+            except Exception as error:
+                with FILE_LOCK:
+                    if mmd_reader.input_data is not None:
+                        mmd_reader.close()
+                read_files.put([input_file, None, None, error])
+                return
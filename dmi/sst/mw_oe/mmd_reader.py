@@ -1,3 +1,8 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import xarray as xr
 
 from dmi.sst.mw_oe.constants import INPUT_VARIABLES
@@ -5,37 +10,158 @@ from dmi.sst.util.default_data import DefaultData
 
 OFFSET = "OFFSET"
 SCALE_FACTOR = "SCALE_FACTOR"
+MATCHUP_DIMENSION = "matchup_count"
+
+# the HDF5 library is not thread safe, netCDF files are opened, read, written and closed by one thread at a time
+FILE_LOCK = threading.RLock()
 
 
 class MmdReader:
+    input_file = None
     input_data = None
 
-    def read(self, input_file):
+    def read(self, input_file, footprints=None, packed=False, workers=0, executor=None):
+        # footprints: optional dictionary of the centred window length [pixel] per target variable name, only these windows
+        # of the subsets are read from the file. Variables without footprint are read completely.
+        # packed: integer variables with SCALE_FACTOR or OFFSET keep their packed values, the fill value is given in the
+        # integer domain. The preprocessor scales the values reduced per matchup.
+        # workers: number of processes reading and decompressing the variables in parallel, 0 reads in this process
+        # executor: optional pool of the worker processes created by create_read_executor(workers) and shut down by the
+        # caller, shared by the reads of several files. Without it, a pool is started for this read
         # xarray can not handle the TAI 1993 time coding @todo 3 tb/th adapt if possible
-        self.input_data = xr.open_dataset(input_file, decode_times=False)
+        [executor, own_executor] = MmdReader._get_executor(workers, executor)
+        try:
+            self.input_file = input_file
+            self.input_data = xr.open_dataset(input_file, decode_times=False)
+
+            return self._create_subset(None, footprints, packed, executor, workers)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    def iter_chunks(self, input_file, chunk_size, footprints=None, packed=False, workers=0, executor=None):
+        # yields the input variables of consecutive blocks of at most chunk_size matchups. Each block is read from the
+        # file when it is requested, memory is bounded by the block size. A file without matchups yields one empty block
+        if chunk_size < 1:
+            raise ValueError("chunk size must be positive: " + str(chunk_size))
+
+        [executor, own_executor] = MmdReader._get_executor(workers, executor)
+        try:
+            self.input_file = input_file
+            self.input_data = xr.open_dataset(input_file, decode_times=False)
+
+            num_matchups = self.input_data.dims[MATCHUP_DIMENSION]
+            for start in range(0, max(num_matchups, 1), chunk_size):
+                yield self._create_subset(slice(start, min(start + chunk_size, num_matchups)), footprints, packed, executor, workers)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    @staticmethod
+    def create_read_executor(workers):
+        # the workers are started with "spawn": forking copies the open HDF5 state of this process and may happen while
+        # other threads run the retrieval or hold library locks, neither HDF5 nor numba's thread pool are fork safe
+        if workers < 0:
+            raise ValueError("number of read workers must not be negative: " + str(workers))
+        if workers == 0:
+            return None
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _create_subset(self, matchups, footprints, packed, executor=None, workers=0):
+        variable_names = self._get_variable_names()
+        variables = [MmdReader._select_variable(self.input_data.variables[variable_name], target_variable_name, matchups, footprints) for variable_name, target_variable_name in variable_names]
+        if executor is not None:
+            variables = self._read_parallel(variable_names, variables, matchups, footprints, executor, workers)
 
         subset_data = xr.Dataset()
+        for [variable_name, target_variable_name], variable in zip(variable_names, variables):
+            keep_packed = packed and MmdReader.is_packed(variable)
+            if (SCALE_FACTOR in variable.attrs or OFFSET in variable.attrs) and not keep_packed:
+                MmdReader._scale_data(variable)
+
+            MmdReader._add_fill_value_attributes(variable, target_variable_name, keep_packed)
 
+            subset_data[target_variable_name] = variable
+
+        return subset_data
+
+    def _get_variable_names(self):
+        # pairs of the variable name in the file and in the subset, the in-situ variables lose their sensor prefix
+        variable_names = []
         for variable_name in INPUT_VARIABLES:
             target_variable_name = variable_name
             if "{IS_SENSOR}" in variable_name:
                 in_situ_sensor = self._get_insitu_sensor(self.input_data)
                 variable_name = variable_name.replace("{IS_SENSOR}", in_situ_sensor)
                 target_variable_name = variable_name[len(in_situ_sensor) + 1: len(variable_name)]
-            variable = self.input_data.variables[variable_name]
+            variable_names.append([variable_name, target_variable_name])
+        return variable_names
+
+    def _read_parallel(self, variable_names, variables, matchups, footprints, executor, workers):
+        # HDF5 decompresses one variable at a time per process, the worker processes open the file on their own. The
+        # variables are distributed largest first to the worker with the least values to read
+        groups = [[] for _ in range(workers)]
+        group_sizes = np.zeros(workers, dtype=np.int64)
+        for index in sorted(range(len(variables)), key=lambda i: variables[i].size, reverse=True):
+            worker = int(np.argmin(group_sizes))
+            groups[worker].append(variable_names[index])
+            group_sizes[worker] += variables[index].size
+
+        futures = [executor.submit(_read_variables, self.input_file, group, matchups, footprints) for group in groups if len(group) > 0]
+        read_variables = {}
+        for future in futures:
+            read_variables.update(future.result())
+        return [read_variables[variable_name] for variable_name, _ in variable_names]
 
-            if SCALE_FACTOR in variable.attrs or OFFSET in variable.attrs:
-                MmdReader._scale_data(variable)
+    @staticmethod
+    def _get_executor(workers, executor):
+        # returns the executor to read with and whether it is owned by the read
+        if executor is None:
+            executor = MmdReader.create_read_executor(workers)
+            return [executor, executor is not None]
 
-            MmdReader._add_fill_value_attributes(variable, target_variable_name)
+        if workers < 1:
+            raise ValueError("a shared read executor requires a positive number of read workers: " + str(workers))
+        return [executor, False]
 
-            subset_data[target_variable_name] = variable
-
-        return subset_data
+    @staticmethod
+    def _select_variable(variable, target_variable_name, matchups, footprints):
+        if matchups is not None:
+            variable = variable.isel({MATCHUP_DIMENSION: matchups}, missing_dims="ignore")
+        if footprints is not None and target_variable_name in footprints:
+            variable = MmdReader._select_footprint(variable, footprints[target_variable_name])
+        return variable
 
     def close(self):
         self.input_data.close()
 
+    @staticmethod
+    def _select_footprint(variable, length):
+        if length < 1 or length % 2 == 0:
+            raise ValueError("footprint length must be a positive odd number: " + str(length))
+        if len(variable.dims) < 3:
+            return variable
+
+        # centred window of the trailing (y, x) dimensions, the variable stays lazy and only the hyperslab is read on
+        # first data access. Clipped dimensions are renamed, the full subsets of other variables keep the original name
+        indexers = {}
+        dims = list(variable.dims)
+        for axis in [len(dims) - 2, len(dims) - 1]:
+            size = variable.shape[axis]
+            if length >= size:
+                continue
+
+            center = int(np.floor(size / 2))
+            indexers[dims[axis]] = slice(center - length // 2, center + length // 2 + 1)
+            dims[axis] = dims[axis] + "_" + str(length)
+
+        if len(indexers) == 0:
+            return variable
+
+        footprint = variable.isel(indexers)
+        footprint.dims = tuple(dims)
+        return footprint
+
     @staticmethod
     def _scale_data(variable):
         scale_factor, offset = MmdReader.get_scale_and_offset(variable)
@@ -43,6 +169,11 @@ class MmdReader:
             scaled_data = variable.data * scale_factor + offset
             variable.data = scaled_data
 
+    @staticmethod
+    def is_packed(variable):
+        # integer data with scaling attributes, as long as it is not scaled to physical units
+        return variable.dtype.kind in "iu" and (SCALE_FACTOR in variable.attrs or OFFSET in variable.attrs)
+
     @staticmethod
     def get_scale_and_offset(variable):
         scale_factor = 1.0
@@ -81,7 +212,11 @@ class MmdReader:
         raise IOError("unsupported data format")
 
     @staticmethod
-    def _add_fill_value_attributes(variable, target_variable_name):
+    def _add_fill_value_attributes(variable, target_variable_name, packed=False):
+        if "brightness_temperature" in target_variable_name and packed:
+            variable.attrs["_FillValue"] = -32768
+            return
+
         if "brightness_temperature" in target_variable_name:
             offset = variable.attrs["OFFSET"]
             scale_factor = variable.attrs["SCALE_FACTOR"]
@@ -99,8 +234,18 @@ class MmdReader:
         if not "FillValue" in variable.attrs:
             default_fill = DefaultData.get_default_fill_value(variable.dtype)
             scale_factor, offset = MmdReader.get_scale_and_offset(variable)
-            if scale_factor != 1.0 or offset != 0.0:
+            if (scale_factor != 1.0 or offset != 0.0) and not packed:
                 variable.attrs["_FillValue"] = default_fill * scale_factor + offset
             else:
                 variable.attrs["_FillValue"] = default_fill
             return
+
+
+def _read_variables(input_file, variable_names, matchups, footprints):
+    # runs in a worker process of MmdReader._read_parallel, returns the selected windows of the variables as loaded data
+    read_variables = {}
+    with xr.open_dataset(input_file, decode_times=False) as input_data:
+        for variable_name, target_variable_name in variable_names:
+            variable = MmdReader._select_variable(input_data.variables[variable_name], target_variable_name, matchups, footprints)
+            read_variables[variable_name] = variable.load()
+    return read_variables
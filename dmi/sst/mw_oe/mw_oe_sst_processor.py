@@ -1,48 +1,121 @@
 import argparse
+import glob
 import os
 import time
 
+import netCDF4
 import numpy as np
 import xarray as xr
 from xarray import Variable
 
 from dmi.sst.mw_oe.bt_bias_correction import BtBiasCorrection
+from dmi.sst.mw_oe.constants import ENGINES, JACOBIANS, JACOBIAN_UPDATES, UPDATES, FW_MODELS, FW_CACHE_TOLERANCE
 from dmi.sst.mw_oe.flag_coding import FlagCoding
-from dmi.sst.mw_oe.mmd_reader import MmdReader
+from dmi.sst.mw_oe.mmd_prefetcher import MmdPrefetcher
+from dmi.sst.mw_oe.mmd_reader import MmdReader, FILE_LOCK
 from dmi.sst.mw_oe.preprocessor import Preprocessor
 from dmi.sst.mw_oe.qa_processor import QaProcessor
-from dmi.sst.mw_oe.retrieval import Retrieval
 from dmi.sst.util.default_data import DefaultData
 
 NUM_BT = 10
 MAX_ITERATIONS = 10
+DIAGNOSTICS = ["minimal", "standard", "full"]
+LUT_FILE_NAME = "fw_model_lut.npy"
 
 
 class MwOeSstProcessor:
-    _version = "0.1.2"
+    _version = "0.1.3"
 
     KERNEL_SIZE = 4
 
     input_file = None
+    input_files = None
     output_directory = None
+    engine = None
+    jacobian = None
+    jacobian_update = None
+    update = None
+    divergence_guard = None
+    diagnostics = None
+    fw_model = None
+    lut_file = None
+    fw_cache_size = None
+    fw_cache_tolerance = None
+    fw_cache_steps = None
+    averaging_length = None
+    stddev_length = None
+    chunk_size = None
+    packed = None
+    read_workers = None
 
     def run(self, args):
         self.parse_cmd_line(args)
 
-        print("reading input file: " + self.input_file)
+        # the retrieval module holding the numba kernels is imported on demand, the kernels are compiled or loaded from
+        # the numba cache on first use and command line parsing stays fast
+        from dmi.sst.mw_oe.retrieval import Retrieval
+
+        preprocessor = Preprocessor(averaging_length=self.averaging_length, stddev_length=self.stddev_length)
+        retrieval = Retrieval(engine=self.engine, jacobian=self.jacobian, jacobian_update=self.jacobian_update, update=self.update, divergence_guard=self.divergence_guard,
+                              fw_model=self.fw_model, lut_file=self.lut_file, fw_cache_size=self.fw_cache_size, fw_cache_tolerance=self.fw_cache_tolerance, fw_cache_steps=self.fw_cache_steps)
+
+        # the read worker processes are started once and shared by all input files
+        read_executor = MmdReader.create_read_executor(self.read_workers)
+        try:
+            if self.chunk_size > 0:
+                for input_file in self.input_files:
+                    self._run_chunked(input_file, preprocessor, retrieval, read_executor)
+                    print("... success")
+                return
+
+            # the next input file is read in the background while the current one is processed
+            for input_file, mmd_data in MmdPrefetcher(self.input_files, footprints=preprocessor.get_footprints(), packed=self.packed, workers=self.read_workers, executor=read_executor):
+                print("processing input file: " + input_file)
+                start_time = time.time()
+
+                results = self._process_matchups(mmd_data, preprocessor, retrieval)
+
+                print("--- %s seconds ---" % (time.time() - start_time))
+
+                self._write_result_data(self.output_directory, input_file, results)
+                print("... success")
+        finally:
+            if read_executor is not None:
+                read_executor.shutdown()
+
+    def _run_chunked(self, input_file, preprocessor, retrieval, read_executor=None):
+        # blocks of matchups are read, processed and appended to the result file one after the other, memory use does not
+        # grow with the number of matchups of the input file
+        print("reading input file in chunks of " + str(self.chunk_size) + " matchups: " + input_file)
+        start_time = time.time()
+
+        target_path = os.path.join(self.output_directory, self._create_target_file_name(input_file))
         mmd_reader = MmdReader()
-        mmd_data = mmd_reader.read(self.input_file)
-        print("... success")
+        forward_model_evaluations = 0
+        num_matchups = 0
+        for mmd_data in mmd_reader.iter_chunks(input_file, self.chunk_size, footprints=preprocessor.get_footprints(), packed=self.packed, workers=self.read_workers, executor=read_executor):
+            print("processing matchups " + str(num_matchups) + " to " + str(num_matchups + mmd_data.dims["matchup_count"]))
+            results = self._process_matchups(mmd_data, preprocessor, retrieval)
+            forward_model_evaluations += int(results.attrs["forward_model_evaluations"])
+
+            if num_matchups == 0:
+                self._write_result_data(self.output_directory, input_file, results, unlimited_dims=["matchup"])
+            else:
+                self._append_result_data(target_path, results)
+            num_matchups += mmd_data.dims["matchup_count"]
 
-        start_time = time.time()
+        mmd_reader.close()
 
+        self._set_global_attribute(target_path, "forward_model_evaluations", np.int64(forward_model_evaluations))
+        print("--- %s seconds ---" % (time.time() - start_time))
+
+    def _process_matchups(self, mmd_data, preprocessor, retrieval):
         matchup_count = mmd_data.dims["matchup_count"]
         print(matchup_count, " matches")
 
         flag_coding = FlagCoding(matchup_count)
 
         print("running preprocessing ...")
-        preprocessor = Preprocessor()
         pre_proc_mmd_data = preprocessor.run(mmd_data, flag_coding)
         print("... success")
 
@@ -57,33 +130,48 @@ class MwOeSstProcessor:
         print("... success")
 
         print("preparing output file ...")
-        results = self._create_result_structure(matchup_count, MAX_ITERATIONS, NUM_BT)
+        results = self._create_result_structure(matchup_count, MAX_ITERATIONS, NUM_BT, diagnostics=self.diagnostics)
         print("... success")
 
         print("running retrieval ...")
-        retrieval = Retrieval()
         results = retrieval.run(pre_proc_mmd_data, results, flag_coding)
         print("... success")
 
         print("writing ")
         self.add_flags_variable(flag_coding, results)
-
-        print("--- %s seconds ---" % (time.time() - start_time))
-
-        self._write_result_data(self.output_directory, self.input_file, results)
-        mmd_reader.close()
-        print("... success")
+        return results
 
     def parse_cmd_line(self, args):
         parser = self._create_cmd_line_parser()
         cmd_line_args = parser.parse_args(args)
-        self.input_file = cmd_line_args.input_file
+        self.input_files = self._expand_input_files(parser, cmd_line_args.input_files)
+        self.input_file = self.input_files[0]
         if cmd_line_args.o is None:
             print("no output directory supplied - write to input directory")
             self.output_directory = os.path.dirname(self.input_file)
         else:
             self.output_directory = cmd_line_args.o[0]
 
+        self.engine = cmd_line_args.engine
+        self.jacobian = cmd_line_args.jacobian
+        self.jacobian_update = cmd_line_args.jacobian_update
+        self.update = cmd_line_args.update
+        self.divergence_guard = cmd_line_args.divergence_guard
+        self.diagnostics = cmd_line_args.diagnostics
+        self.fw_model = cmd_line_args.fw_model
+        if cmd_line_args.lut_file is None:
+            self.lut_file = os.path.join(self.output_directory, LUT_FILE_NAME)
+        else:
+            self.lut_file = cmd_line_args.lut_file
+        self.fw_cache_size = cmd_line_args.fw_cache_size
+        self.fw_cache_tolerance = cmd_line_args.fw_cache_tolerance
+        self.fw_cache_steps = cmd_line_args.fw_cache_steps
+        self.averaging_length = cmd_line_args.averaging_length
+        self.stddev_length = cmd_line_args.stddev_length
+        self.chunk_size = cmd_line_args.chunk_size
+        self.packed = cmd_line_args.packed
+        self.read_workers = cmd_line_args.read_workers
+
     def add_flags_variable(self, flag_coding, results):
         flags = flag_coding.get_flags()
         variable = Variable(["matchup"], flags)
@@ -91,7 +179,7 @@ class MwOeSstProcessor:
         variable.attrs["flag_meanings"] = flag_coding.get_flag_meanings()
         results["flags"] = variable
 
-    def _write_result_data(self, output_dir, input_file, results):
+    def _write_result_data(self, output_dir, input_file, results, unlimited_dims=None):
         target_file_name = self._create_target_file_name(input_file)
         target_path = os.path.join(output_dir, target_file_name)
 
@@ -102,59 +190,89 @@ class MwOeSstProcessor:
             var_encoding.update(results[var_name].encoding)
             encoding.update({var_name: var_encoding})
 
-        results.to_netcdf(target_path, format='netCDF4', engine='netcdf4', encoding=encoding)
+        # waits while the next input file is read in the background
+        with FILE_LOCK:
+            results.to_netcdf(target_path, format='netCDF4', engine='netcdf4', encoding=encoding, unlimited_dims=unlimited_dims)
+
+    @staticmethod
+    def _append_result_data(target_path, results):
+        # the result file is written with an unlimited matchup dimension, the matchups of results are appended to it
+        with netCDF4.Dataset(target_path, "a") as target_file:
+            start = len(target_file.dimensions["matchup"])
+            end = start + results.dims["matchup"]
+            for var_name in results.data_vars:
+                target_file.variables[var_name][start:end] = results[var_name].values
 
     @staticmethod
-    def _create_result_structure(num_matchups, max_iterations, num_bt):
+    def _set_global_attribute(target_path, name, value):
+        with netCDF4.Dataset(target_path, "a") as target_file:
+            target_file.setncattr(name, value)
+
+    @staticmethod
+    def _create_result_structure(num_matchups, max_iterations, num_bt, diagnostics="full"):
         dataset = xr.Dataset()
 
-        # j
-        variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
-        dataset["j"] = variable # todo 1 tb/tb remove 2018-05-24
+        # per-iteration and intermediate retrieval diagnostics are only allocated on request
+        standard_diagnostics = diagnostics != "minimal"
+        full_diagnostics = diagnostics == "full"
 
-        # tb_rmse_ite
-        variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
-        dataset["tb_rmse_ite"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # j
+            variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
+            dataset["j"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # tb_rmse_ite0
-        variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
-        dataset["tb_rmse_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # tb_rmse_ite
+            variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
+            dataset["tb_rmse_ite"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # tb_chi_ite
-        variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
-        dataset["tb_chi_ite"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # tb_rmse_ite0
+            variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
+            dataset["tb_rmse_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # convergence_passed_flag
-        variable = MwOeSstProcessor._create_vector_uint8_variable(num_matchups)
-        dataset["convergence_passed_flag"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # tb_chi_ite
+            variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
+            dataset["tb_chi_ite"] = variable # todo 1 tb/tb remove 2018-05-24
+
+        if standard_diagnostics:
+            # convergence_passed_flag
+            variable = MwOeSstProcessor._create_vector_uint8_variable(num_matchups)
+            dataset["convergence_passed_flag"] = variable # todo 1 tb/tb remove 2018-05-24
 
         # i - number of iterations
         variable = MwOeSstProcessor._create_vector_uint8_variable(num_matchups)
         dataset["i"] = variable
 
-        # di2
-        variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
-        dataset["di2"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # di2
+            variable = MwOeSstProcessor._create_2d_float_variable(max_iterations, num_matchups)
+            dataset["di2"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # dtb_ite0
-        variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
-        dataset["dtb_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # dtb_ite0
+            variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
+            dataset["dtb_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # TA0_ite0
-        variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
-        dataset["TA0_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # TA0_ite0
+            variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
+            dataset["TA0_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # j_ite0
-        variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
-        dataset["j_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # j_ite0
+            variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
+            dataset["j_ite0"] = variable # todo 1 tb/tb remove 2018-05-24
 
         # A
         variable = MwOeSstProcessor._create_2d_float_variable(MwOeSstProcessor.KERNEL_SIZE, num_matchups, dims_names=["matchup", "kernel_size"])
         dataset["A"] = variable
 
-        # chisq
-        variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
-        dataset["chisq"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # chisq
+            variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
+            dataset["chisq"] = variable # todo 1 tb/tb remove 2018-05-24
 
         # mu_sst
         variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
@@ -168,9 +286,10 @@ class MwOeSstProcessor:
         variable = MwOeSstProcessor._create_2d_float_variable(MwOeSstProcessor.KERNEL_SIZE, num_matchups, dims_names=["matchup", "kernel_size"])
         dataset["p0"] = variable
 
-        # S
-        variable = MwOeSstProcessor._create_2d_float_variable(MwOeSstProcessor.KERNEL_SIZE, num_matchups, dims_names=["matchup", "kernel_size"])
-        dataset["S"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # S
+            variable = MwOeSstProcessor._create_2d_float_variable(MwOeSstProcessor.KERNEL_SIZE, num_matchups, dims_names=["matchup", "kernel_size"])
+            dataset["S"] = variable # todo 1 tb/tb remove 2018-05-24
 
         # F(x) - simulated brightness temperatures from final iteration
         variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
@@ -180,33 +299,55 @@ class MwOeSstProcessor:
         variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
         dataset["y"] = variable
 
-        # dtb
-        variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
-        dataset["dtb"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # dtb
+            variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
+            dataset["dtb"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # ds
-        variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
-        dataset["ds"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # ds
+            variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
+            dataset["ds"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # dn
-        variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
-        dataset["dn"] = variable # todo 1 tb/tb remove 2018-05-24
+        if standard_diagnostics:
+            # dn
+            variable = MwOeSstProcessor._create_vector_float32_variable(num_matchups)
+            dataset["dn"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # K4
-        variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
-        dataset["K4"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # K4
+            variable = MwOeSstProcessor._create_2d_float_variable(num_bt, num_matchups, dims_names=["matchup", "num_bt"])
+            dataset["K4"] = variable # todo 1 tb/tb remove 2018-05-24
 
-        # ite_index
-        variable = MwOeSstProcessor._create_vector_uint8_variable(num_matchups)
-        dataset["ite_index"] = variable # todo 1 tb/tb remove 2018-05-24
+        if full_diagnostics:
+            # ite_index
+            variable = MwOeSstProcessor._create_vector_uint8_variable(num_matchups)
+            dataset["ite_index"] = variable # todo 1 tb/tb remove 2018-05-24
 
         return dataset
 
     @staticmethod
     def _create_cmd_line_parser():
         parser = argparse.ArgumentParser(description='Microwave OE SST retrieval')
-        parser.add_argument('input_file')
-        parser.add_argument("-o", nargs=1)
+        parser.add_argument("input_files", nargs="+", metavar="input_file", help="MMD files or glob patterns, processed in order while the next file is read in the background")
+        parser.add_argument("-o", nargs=1, help="output directory, default: directory of the first input file")
+        parser.add_argument("--engine", choices=ENGINES, default="batch", help="retrieval engine, default: batch")
+        parser.add_argument("--jacobian", choices=JACOBIANS, default="finite_difference", help="calculation of the forward model Jacobian, default: finite_difference")
+        parser.add_argument("--jacobian-update", choices=JACOBIAN_UPDATES, default="full", help="Jacobian update per iteration, default: full")
+        parser.add_argument("--update", choices=UPDATES, default="gauss_newton", help="retrieval state update, default: gauss_newton")
+        parser.add_argument("--divergence-guard", action="store_true", help="stop and flag matchups after repeated cost function increases")
+        parser.add_argument("--diagnostics", choices=DIAGNOSTICS, default="full", help="retrieval diagnostics written to the output file, default: full")
+        parser.add_argument("--fw-model", choices=FW_MODELS, default="physical", help="forward model, the lookup table emulator is built on first use, default: physical")
+        parser.add_argument("--lut-file", help="forward model lookup table file, default: " + LUT_FILE_NAME + " in the output directory")
+        parser.add_argument("--fw-cache-size", type=int, default=0, help="maximum number of entries of the forward model cache of the loop engine, default: 0 (no cache)")
+        parser.add_argument("--fw-cache-tolerance", type=float, default=FW_CACHE_TOLERANCE, help="bound of the forward model cache error [K], default: " + str(FW_CACHE_TOLERANCE))
+        parser.add_argument("--fw-cache-steps", type=float, nargs=6, metavar=("W", "V", "L", "T_OW", "THETA", "PHI"),
+                            help="forward model cache quantization steps, default: derived from the tolerance")
+        parser.add_argument("--averaging-length", type=int, default=Preprocessor.AVERAGING_LENGTH, help="size of the centred averaging window [pixel], default: " + str(Preprocessor.AVERAGING_LENGTH))
+        parser.add_argument("--stddev-length", type=int, default=Preprocessor.STDDEV_LENGTH, help="size of the centred standard deviation window [pixel], default: " + str(Preprocessor.STDDEV_LENGTH))
+        parser.add_argument("--chunk-size", type=int, default=0, help="number of matchups read and processed at once, results are appended to the output file, default: 0 (all matchups)")
+        parser.add_argument("--packed", action="store_true", help="keep packed integer brightness temperatures through the window statistics, scaled per matchup")
+        parser.add_argument("--read-workers", type=int, default=0, help="number of processes reading and decompressing the input variables in parallel, default: 0 (read in the processor)")
         return parser
 
     @staticmethod
@@ -234,6 +375,20 @@ class MwOeSstProcessor:
         variable.attrs["_FillValue"] = np.NaN
         return variable
 
+    @staticmethod
+    def _expand_input_files(parser, input_files):
+        expanded = []
+        for input_file in input_files:
+            if not any(character in input_file for character in "*?["):
+                expanded.append(input_file)
+                continue
+
+            matching_files = sorted(glob.glob(input_file))
+            if len(matching_files) == 0:
+                parser.error("no input files match: " + input_file)
+            expanded.extend(matching_files)
+        return expanded
+
     @staticmethod
     def _create_target_file_name(test_mmd):
         (head, file_name) = os.path.split(test_mmd)
@@ -1,10 +1,9 @@
 import numpy as np
 import xarray as xr
-from numba import jit, prange
 from xarray import Variable
 
+from dmi.sst.mw_oe.mmd_reader import MmdReader
 from dmi.sst.mw_oe.pressure_processor import PressureProcessor
-from dmi.sst.util.default_data import DefaultData
 
 
 DEG_TO_RAD = np.pi / np.float64(180.0)
@@ -26,11 +25,22 @@ class Preprocessor:
     NWP_SST_VARIABLES = ["amsre.nwp.sea_surface_temperature"]
     FILENAME_VARIABLES = ["amsre.l2a_filename"]
 
-    AVERAGING_LENGTH = 5  # @todo 3 tb/tb this can be a parameter to the processor 2017-11-17
-    STDDEV_LENGTH = 21  # @todo 3 tb/tb this can be a parameter to the processor 2017-12-13
+    AVERAGING_LENGTH = 5
+    STDDEV_LENGTH = 21
     INV_GRAVITY_CONST = 1.0 / 9.80665  # s^2/m
     SST_NWP_BIAS = -0.05
 
+    averaging_length = None
+    stddev_length = None
+
+    def __init__(self, averaging_length=AVERAGING_LENGTH, stddev_length=STDDEV_LENGTH):
+        for length in [averaging_length, stddev_length]:
+            if length < 1 or length % 2 == 0:
+                raise ValueError("window length must be a positive odd number: " + str(length))
+
+        self.averaging_length = averaging_length
+        self.stddev_length = stddev_length
+
     def run(self, dataset, flag_coding=None):
         preprocessed_data = xr.Dataset()
 
@@ -41,9 +51,11 @@ class Preprocessor:
                 continue
 
             if variable_name in self.TO_AVERAGE_NAMES:
+                # one pass over the subsets serves both window sizes
+                window_statistics = self.create_window_statistics(dataset, variable_name)
                 if variable_name in self.TO_STDDEV_NAMES:
-                    self.calc_std_dev(dataset, preprocessed_data, variable_name, flag_coding)
-                self.average_subset(dataset, preprocessed_data, variable_name, flag_coding)
+                    self.calc_std_dev(dataset, preprocessed_data, variable_name, flag_coding, window_statistics)
+                self.average_subset(dataset, preprocessed_data, variable_name, flag_coding, window_statistics)
                 continue
 
             if variable_name in self.TO_CENTER_EXTRACT_NAMES:
@@ -66,6 +78,17 @@ class Preprocessor:
 
         return preprocessed_data
 
+    def get_footprints(self):
+        # centred window length [pixel] of the subsets each variable needs, input for MmdReader.read
+        footprints = {}
+        for variable_name in self.TO_CENTER_EXTRACT_NAMES + self.WIND_SPEED_VARIABLES:
+            footprints[variable_name] = 1
+        for variable_name in self.TO_AVERAGE_NAMES:
+            footprints[variable_name] = self.averaging_length
+        for variable_name in self.TO_STDDEV_NAMES:
+            footprints[variable_name] = max(footprints.get(variable_name, 1), self.stddev_length)
+        return footprints
+
     def convert_temperature(self, preprocessed_data, variable_name):
         if variable_name in self.NWP_SST_VARIABLES:
             sst_data = preprocessed_data[variable_name].data
@@ -87,88 +110,62 @@ class Preprocessor:
         abs_wind_speed_data = np.sqrt(np.square(east_wind_data) + np.square(north_wind_data))
         preprocessed_data["amsre.nwp.abs_wind_speed"] = Variable(["matchup"], abs_wind_speed_data)
 
-        num_matchups = len(dataset.coords["matchup_count"])
         self.extract_center_px(dataset, preprocessed_data, "amsre.satellite_azimuth_angle")
-        target_data = DefaultData.create_default_vector(num_matchups, np.float32, fill_value=np.NaN)
         phi_sat = preprocessed_data.variables["amsre.satellite_azimuth_angle"].data
-        for i in range(0, num_matchups):
-            target_data[i] = self.calculate_relative_angle(phi_sat[i], north_wind_data[i], east_wind_data[i])
+        target_data = self.calculate_relative_angle(phi_sat, north_wind_data, east_wind_data).astype(np.float32)
 
         preprocessed_data["relative_angle"] = Variable(["matchup"], target_data)
 
-    def average_subset(self, dataset, preprocessed_data, variable_name, flag_coding=None):
-        # @todo 1 tb/tb this method needs performance boost 2018-02-20
-        num_matchups = len(dataset.coords["matchup_count"])
-        invalid_data_array = np.zeros(num_matchups, dtype=np.bool)
+    def average_subset(self, dataset, preprocessed_data, variable_name, flag_coding=None, window_statistics=None):
+        if window_statistics is None:
+            window_statistics = self.create_window_statistics(dataset, variable_name)
+
         variable = dataset.variables[variable_name]
         fill_value = variable.attrs["_FillValue"]
-        input_data = variable.values
-        target_data = DefaultData.create_default_vector(num_matchups, np.float32, fill_value)
-
-        width = variable.shape[2]
-        height = variable.shape[1]
-        center_x = int(np.floor(width / 2))
-        center_y = int(np.floor(height / 2))
-
-        offset = int(np.floor(self.AVERAGING_LENGTH / 2))
-        y_min = center_y - offset
-        y_max = center_y + offset + 1
-        x_min = center_x - offset
-        x_max = center_x + offset + 1
-
-        max_num_invalid = int(np.ceil(self.AVERAGING_LENGTH * self.AVERAGING_LENGTH * 0.1))
-
-        for i in range(0, num_matchups):
-            layer = input_data[i, y_min:y_max, x_min: x_max]
-            masked_layer = calculate_masked(layer, fill_value)
-            num_fills = count_masked(masked_layer)
-            if num_fills <= max_num_invalid:
-                target_data[i] = np.nanmean(masked_layer)
-            else:
-                target_data[i] = fill_value
-                invalid_data_array[i] = True
-
-        if flag_coding is not None:
-            flag_coding.add_avg_inv_thresh(invalid_data_array)
-
+        mean = window_statistics.get_mean(self.averaging_length)
+        if MmdReader.is_packed(variable):
+            scale_factor, offset = MmdReader.get_scale_and_offset(variable)
+            fill_value = fill_value * scale_factor + offset
+            mean = mean * scale_factor + offset
+        target_data = self._apply_invalid_threshold(mean, window_statistics, self.averaging_length, fill_value, flag_coding)
         preprocessed_data[variable_name] = Variable(["matchup"], target_data)
 
-    # @todo 2 tb/tb refactor, this method duplicates most of the normal averaging method 2017-12-13
-    def calc_std_dev(self, dataset, preprocessed_data, variable_name, flag_coding=None):
-        num_matchups = len(dataset.coords["matchup_count"])
-        invalid_data_array = np.zeros(num_matchups, dtype=np.bool)
+    def calc_std_dev(self, dataset, preprocessed_data, variable_name, flag_coding=None, window_statistics=None):
+        if window_statistics is None:
+            window_statistics = self.create_window_statistics(dataset, variable_name)
+
         variable = dataset.variables[variable_name]
         fill_value = variable.attrs["_FillValue"]
-        input_data = variable.values
-        target_data = DefaultData.create_default_vector(num_matchups, np.float32, fill_value)
-
-        width = variable.shape[2]
-        height = variable.shape[1]
-        center_x = int(np.floor(width / 2))
-        center_y = int(np.floor(height / 2))
-
-        offset = int(np.floor(self.STDDEV_LENGTH / 2))
-        y_min = center_y - offset
-        y_max = center_y + offset + 1
-        x_min = center_x - offset
-        x_max = center_x + offset + 1
-
-        max_num_invalid = int(np.ceil(self.STDDEV_LENGTH * self.STDDEV_LENGTH * 0.1))
-
-        for i in range(0, num_matchups):
-            layer = input_data[i, y_min:y_max, x_min: x_max]
-            masked_layer = calculate_masked(layer, fill_value)
-            num_fills = count_masked(masked_layer)
-            if num_fills <= max_num_invalid:
-                target_data[i] = np.nanstd(masked_layer)
-            else:
-                target_data[i] = fill_value
-                invalid_data_array[i] = True
+        if MmdReader.is_packed(variable):
+            scale_factor, offset = MmdReader.get_scale_and_offset(variable)
+            fill_value = fill_value * scale_factor + offset
+            std_dev = window_statistics.get_std_dev(self.stddev_length) * abs(scale_factor)
+        else:
+            # as np.nanstd of float data, the square root is taken of the variance rounded to the data type
+            variance = window_statistics.get_variance(self.stddev_length)
+            std_dev = np.sqrt(variance.astype(variable.dtype if np.issubdtype(variable.dtype, np.floating) else np.float64))
+        target_data = self._apply_invalid_threshold(std_dev, window_statistics, self.stddev_length, fill_value, flag_coding)
+        preprocessed_data[variable_name + "_stddev"] = Variable(["matchup"], target_data)
+
+    @staticmethod
+    def create_window_statistics(dataset, variable_name):
+        # the window statistics hold numba kernels and are imported on demand, the processor imports this module for
+        # command line parsing
+        from dmi.sst.mw_oe.window_statistics import WindowStatistics
+
+        variable = dataset.variables[variable_name]
+        return WindowStatistics(variable.values, variable.attrs["_FillValue"])
+
+    @staticmethod
+    def _apply_invalid_threshold(values, window_statistics, length, fill_value, flag_coding):
+        # windows with more than 10 percent invalid pixels are set to the fill value and flagged
+        max_num_invalid = int(np.ceil(length * length * 0.1))
+        invalid_data_array = window_statistics.get_num_invalid(length) > max_num_invalid
 
         if flag_coding is not None:
             flag_coding.add_avg_inv_thresh(invalid_data_array)
 
-        preprocessed_data[variable_name + "_stddev"] = Variable(["matchup"], target_data)
+        return np.where(invalid_data_array, np.float32(fill_value), values.astype(np.float32))
 
     def extract_center_px(self, dataset, preprocessed_data, variable_name):
         variable = dataset.variables[variable_name]
@@ -177,13 +174,24 @@ class Preprocessor:
             height = variable.shape[1]
             center_x = int(np.floor(width / 2))
             center_y = int(np.floor(height / 2))
-            preprocessed_data[variable_name] = variable[:, center_y, center_x].squeeze()
+            preprocessed_data[variable_name] = self._unpack(variable[:, center_y, center_x].squeeze())
         elif len(variable.shape) == 4:
             width = variable.shape[3]
             height = variable.shape[2]
             center_x = int(np.floor(width / 2))
             center_y = int(np.floor(height / 2))
-            preprocessed_data[variable_name] = variable[:, :, center_y, center_x].squeeze()
+            preprocessed_data[variable_name] = self._unpack(variable[:, :, center_y, center_x].squeeze())
+
+    @staticmethod
+    def _unpack(variable):
+        # packed integer values are scaled to physical units once reduced to one value per matchup
+        if not MmdReader.is_packed(variable):
+            return variable
+
+        scale_factor, offset = MmdReader.get_scale_and_offset(variable)
+        unpacked = variable.copy(data=variable.data * scale_factor + offset)
+        unpacked.attrs["_FillValue"] = variable.attrs["_FillValue"] * scale_factor + offset
+        return unpacked
 
     def squeeze_data(self, dataset, preprocessed_data, variable_name):
         preprocessed_data[variable_name] = dataset.variables[variable_name].squeeze()
@@ -191,30 +199,35 @@ class Preprocessor:
     def calculate_TCLW(self, preprocessed_data):
         surface_pressure = np.exp(preprocessed_data["amsre.nwp.log_surface_pressure"])
 
-        pressure_processor = PressureProcessor()
-        pressure_levels = pressure_processor.calculate_pressure_levels(surface_pressure)
+        clw = preprocessed_data["amsre.nwp.cloud_liquid_water"].data
 
-        clw = preprocessed_data["amsre.nwp.cloud_liquid_water"]
-
-        tclw_tmp = clw.data * pressure_levels.data
-        tclw_tmp = tclw_tmp * self.INV_GRAVITY_CONST
-        tclw = np.sum(tclw_tmp, axis=1)
+        # column integral of the level thickness weighted cloud liquid water, without the (num_matchups, 60) level array
+        pressure_processor = PressureProcessor()
+        tclw = pressure_processor.integrate_levels(surface_pressure, clw) * self.INV_GRAVITY_CONST
+        tclw = tclw.astype(np.result_type(clw.dtype, np.float32))
         preprocessed_data["amsre.nwp.total_column_liquid_water"] = Variable(["num_matchups"], tclw)
 
     def extract_ascending_descending(self, dataset, preprocessed_data, flag_coding=None):
-        num_matchups = len(dataset.coords["matchup_count"])
-        ascending_data_array = np.zeros(num_matchups, dtype=np.bool)
-        invalid_data_array = np.zeros(num_matchups, dtype=np.bool)
-
-        filename_data = dataset.variables["amsre.l2a_filename"].data
-        for i in range(0, num_matchups):
-            file_name = str(filename_data[i])
+        # matchups of an L2A file are stored in runs, each distinct file name is parsed once. Comparing neighbours
+        # first leaves only the run heads to be sorted by np.unique
+        filename_data = np.asarray(dataset.variables["amsre.l2a_filename"].data)
+        run_start = np.ones(len(filename_data), dtype=np.bool)
+        run_start[1:] = filename_data[1:] != filename_data[:-1]
+        run_index = np.cumsum(run_start) - 1
+        [file_names, file_index] = np.unique(filename_data[run_start], return_inverse=True)
+        file_index = file_index[run_index]
+
+        ascending = np.zeros(len(file_names), dtype=np.bool)
+        invalid = np.zeros(len(file_names), dtype=np.bool)
+        for i in range(0, len(file_names)):
+            file_name = str(file_names[i])
             if "_A." in file_name:
-                ascending_data_array[i] = True
-            elif "_D." in file_name:
-                ascending_data_array[i] = False
-            else:
-                invalid_data_array[i] = True
+                ascending[i] = True
+            elif "_D." not in file_name:
+                invalid[i] = True
+
+        ascending_data_array = ascending[file_index]
+        invalid_data_array = invalid[file_index]
 
         if flag_coding is not None:
             flag_coding.add_inv_filename(invalid_data_array)
@@ -222,50 +235,15 @@ class Preprocessor:
         preprocessed_data["amsre.ascending"] = Variable(["matchup"], ascending_data_array)
 
     def calculate_relative_angle(self, phi_sat, north_wind, east_wind):
-        if phi_sat < 0.0:
-            phi_sat = phi_sat + 360.0
+        # scalars or arrays, calculated in double precision. All angles are wrapped into [0, 360) by a single turn,
+        # which suffices for azimuths in [-180, 360)
+        phi_sat = np.asarray(phi_sat, dtype=np.float64)
+        phi_sat = np.where(phi_sat < 0.0, phi_sat + 360.0, phi_sat)
 
-        north_wind_rad = north_wind * DEG_TO_RAD
-        east_wind_rad = east_wind * DEG_TO_RAD
+        north_wind_rad = np.asarray(north_wind, dtype=np.float64) * DEG_TO_RAD
+        east_wind_rad = np.asarray(east_wind, dtype=np.float64) * DEG_TO_RAD
         phi_w = 90.0 - np.arctan2(north_wind_rad, east_wind_rad) * RAD_TO_DEG
-        if phi_w < 0.0:
-            phi_w = phi_w + 360.0
+        phi_w = np.where(phi_w < 0.0, phi_w + 360.0, phi_w)
 
         phi_rel = phi_sat - phi_w
-        if phi_rel < 0.0:
-            phi_rel = phi_rel + 360.0
-
-        return phi_rel
-
-
-@jit('float32[:, :](float32[:, :], float32)', nopython=True, parallel=True)
-def calculate_masked(layer, fill_value):
-    height = layer.shape[0]
-    width = layer.shape[1]
-    result = np.zeros(layer.shape, dtype=np.float32)
-
-    for y in prange(0, height):
-        for x in prange(0, width):
-            value = layer[y, x]
-            if abs(value - fill_value) < 1e-9:
-                result[y, x] = np.NaN
-            else:
-                result[y, x] = value
-
-    return result
-
-
-@jit('int32(float32[:, :])', nopython=True, parallel=True)
-def count_masked(layer):
-    height = layer.shape[0]
-    width = layer.shape[1]
-
-    result = 0
-
-    for y in prange(0, height):
-        for x in prange(0, width):
-            value = layer[y, x]
-            if np.isnan(value):
-                result += 1
-
-    return result
+        return np.where(phi_rel < 0.0, phi_rel + 360.0, phi_rel)
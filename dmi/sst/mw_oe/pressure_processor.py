@@ -1,7 +1,5 @@
 import numpy as np
 
-from dmi.sst.util.default_data import DefaultData
-
 
 class PressureProcessor:
     A_COEFFS = np.float64(
@@ -18,11 +16,18 @@ class PressureProcessor:
                   0.951822, 0.967645, 0.979663, 0.988270, 0.994019, 0.997630, 1.000000]))
 
     def calculate_pressure_levels(self, sea_level_pressure):
-        num_levels = len(self.A_COEFFS) - 1
-        num_measures = len(sea_level_pressure)
+        p_f = np.outer(np.asarray(sea_level_pressure, dtype=np.float64), self.B_COEFFS) + self.A_COEFFS
+        return (p_f[:, 1:61] - p_f[:, 0:60]).astype(np.float32)
+
+    def integrate_levels(self, sea_level_pressure, level_data):
+        # sum over the levels of level_data * (dA + p_s * dB), as two matrix-vector products without the level
+        # thickness array. The products run in the precision of level_data
+        [delta_a, delta_b] = self.get_thickness_coefficients()
+        level_data = np.asarray(level_data)
+        coefficients = np.stack([delta_a, delta_b], axis=1).astype(np.result_type(level_data.dtype, np.float32))
+        sums = np.dot(level_data, coefficients)
+        return sums[:, 0] + np.asarray(sea_level_pressure, dtype=np.float64) * sums[:, 1]
 
-        target_data = DefaultData.create_default_array(num_levels, num_measures, np.float32, fill_value=np.NaN)
-        for i in range(0, num_measures):
-            p_f = np.float64(sea_level_pressure[i]) * self.B_COEFFS + self.A_COEFFS
-            target_data[i, :] = p_f[1:61] - p_f[0:60]
-        return target_data
+    def get_thickness_coefficients(self):
+        # p_f = A + p_s * B at the 61 level interfaces, the thickness of the 60 levels is dA + p_s * dB
+        return [self.A_COEFFS[1:61] - self.A_COEFFS[0:60], self.B_COEFFS[1:61] - self.B_COEFFS[0:60]]
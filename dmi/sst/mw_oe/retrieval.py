@@ -1,7 +1,12 @@
 import numpy as np
 
-from dmi.sst.mw_oe.constants import INPUT_VARIABLES
-from dmi.sst.mw_oe.fw_model import FwModel
+from dmi.sst.mw_oe import retrieval_kernel
+from dmi.sst.mw_oe.constants import ENGINES, JACOBIANS, JACOBIAN_UPDATES, UPDATES, FW_MODELS, FW_CACHE_TOLERANCE
+from dmi.sst.mw_oe.dielectric_cache import DielectricCache
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_cache import FwModelCache
+from dmi.sst.mw_oe.fw_model_lut import FwModelLut
+from dmi.sst.mw_oe.retrieval_input import RetrievalInput
 
 
 class Retrieval:
@@ -14,33 +19,120 @@ class Retrieval:
                    dtype=np.float64)
     S_p_inv = None
     S_e_inv = None
+    S_e_whitening = None
     fw_model = None
+    fw_model_type = None
+    fw_model_cache = None
     maxit = None
+    engine = None
+    jacobian = None
+    jacobian_update = None
+    update = None
+    divergence_guard = None
+    forward_model_evaluations = None
+    run_summary = None
 
     eps = np.array([0.2, 0.1, 0.02, 0.25], dtype=np.float64)
+    # state steps smaller than this multiple of eps keep the Jacobian of the previous iteration
+    freeze_step = 1.0
+    # initial Levenberg-Marquardt damping, multiplied or divided by gamma_factor after each trial step
+    gamma_initial = 0.1
+    gamma_factor = 10.0
+    # number of consecutive cost function increases after which the divergence guard stops a matchup
+    divergence_limit = 3
+
+    def __init__(self, engine="batch", jacobian="finite_difference", jacobian_update="full", update="gauss_newton", divergence_guard=False, fw_model="physical", lut_file=None, fw_cache_size=0,
+                 fw_cache_tolerance=FW_CACHE_TOLERANCE, fw_cache_steps=None):
+        if engine not in ENGINES:
+            raise ValueError("unsupported retrieval engine: " + str(engine))
+        if jacobian not in JACOBIANS:
+            raise ValueError("unsupported jacobian calculation: " + str(jacobian))
+        if engine == "numba" and jacobian != "finite_difference":
+            raise ValueError("the numba retrieval engine supports finite difference jacobians only")
+        if jacobian_update not in JACOBIAN_UPDATES:
+            raise ValueError("unsupported jacobian update: " + str(jacobian_update))
+        if jacobian_update == "broyden" and (engine != "batch" or jacobian != "finite_difference"):
+            raise ValueError("broyden jacobian updates are supported by the batch engine with finite difference jacobians only")
+        if update not in UPDATES:
+            raise ValueError("unsupported retrieval update: " + str(update))
+        if (update != "gauss_newton" or divergence_guard) and engine != "batch":
+            raise ValueError("damped updates and the divergence guard are supported by the batch engine only")
+        if fw_model not in FW_MODELS:
+            raise ValueError("unsupported forward model: " + str(fw_model))
+        if fw_model == "lut" and engine == "numba":
+            raise ValueError("the numba retrieval engine supports the physical forward model only")
+        if fw_model == "lut" and lut_file is None:
+            raise ValueError("the lookup table forward model requires a lookup table file")
+        if fw_cache_size > 0 and engine != "loop":
+            raise ValueError("the forward model cache is supported by the loop engine only")
 
-    def __init__(self):
         self.S_p_inv = np.linalg.inv(self.S_p)
         self.S_e_inv = np.linalg.inv(self.S_e)
-
-        self.fw_model = FwModel()
+        # inverse Cholesky factor of S_e, maps brightness temperatures to a space with unit measurement covariance
+        self.S_e_whitening = np.linalg.inv(np.linalg.cholesky(self.S_e))
+
+        if fw_model == "lut":
+            self.fw_model = FwModelLut.load_or_build(lut_file)
+        else:
+            self.fw_model = FwModel()
+        self.fw_model_type = fw_model
+        if fw_cache_size > 0:
+            # kept across runs, repeated inputs of later runs are served from the cache
+            self.fw_model_cache = FwModelCache(self.fw_model, max_size=fw_cache_size, tolerance=fw_cache_tolerance, steps=fw_cache_steps)
+            self.fw_model = self.fw_model_cache
 
         self.maxit = 10
+        self.engine = engine
+        self.jacobian = jacobian
+        self.jacobian_update = jacobian_update
+        self.update = update
+        self.divergence_guard = divergence_guard
 
     def run(self, input, results, flag_coding):
-        sw = 0  # Switched off ice in forward model
-        num_matchups = len(input.coords["matchup_count"])
-
-        ws = input["amsre.nwp.abs_wind_speed"].data
-        tcwv = input["amsre.nwp.total_column_water_vapour"].data
-        tclw = input["amsre.nwp.total_column_liquid_water"].data
-        sst = input["amsre.nwp.sea_surface_temperature"].data
-        sza = input["amsre.satellite_zenith_angle"].data
-        phi_rd = input["relative_angle"].data
+        retrieval_input = RetrievalInput(input)
+        self.forward_model_evaluations = 0
+        self.run_summary = []
+
+        if self.engine == "loop":
+            results = self.run_loop(retrieval_input, results, flag_coding)
+        elif self.engine == "numba":
+            results = self.run_numba(retrieval_input, results, flag_coding)
+        else:
+            results = self.run_batch(retrieval_input, results, flag_coding)
+
+        # one summary line per run, the engines add their statistics to the run summary
+        summary = [str(self.forward_model_evaluations) + " forward model evaluations"] + self.run_summary
+        if self.fw_model_cache is not None:
+            summary.append("forward model cache: " + str(self.fw_model_cache.hits) + " hits, " + str(self.fw_model_cache.misses) + " misses")
+        print(" ... " + "; ".join(summary))
+        self._print_iterations_histogram(results.i.data)
+        results.attrs["forward_model_evaluations"] = np.int64(self.forward_model_evaluations)
+        return results
 
-        j_ite_0 = np.full([num_matchups], np.NaN, np.float64)
-        di2 = np.full([num_matchups, self.maxit], np.NaN, np.float64)
+    def run_loop(self, retrieval_input, results, flag_coding):
+        sw = 0  # Switched off ice in forward model
+        num_matchups = retrieval_input.get_num_matchups()
+
+        ws = retrieval_input.ws
+        tcwv = retrieval_input.tcwv
+        tclw = retrieval_input.tclw
+        sst = retrieval_input.sst
+        sza = retrieval_input.sza
+        phi_rd = retrieval_input.phi_rd
+        T_A = retrieval_input.T_A
+
+        # diagnostics not contained in the result structure are neither stored nor calculated
+        J = self._create_diagnostics_array(results, "j", [num_matchups, self.maxit])
+        test = self._create_diagnostics_array(results, "tb_rmse_ite", [num_matchups, self.maxit])
+        chi = self._create_diagnostics_array(results, "tb_chi_ite", [num_matchups, self.maxit])
+        di2 = self._create_diagnostics_array(results, "di2", [num_matchups, self.maxit])
+        calculate_chi = "chisq" in results or chi is not None
+        calculate_standard = "S" in results
         sss = np.float64(35.0)
+        contexts = create_geometry_context(sza, sss, phi_rd)
+        dielectric_cache = DielectricCache(self.fw_model)
+
+        analytic_jacobian = self.jacobian == "analytic"
 
         flags = flag_coding.get_flags()
         for matchup_index in range(0, num_matchups):
@@ -50,15 +142,18 @@ class Retrieval:
 
             [p, p_0] = self.prepare_first_guess(ws[matchup_index], tcwv[matchup_index], tclw[matchup_index], sst[matchup_index], self.eps)
 
-            theta_d = np.float64(sza[matchup_index])
-
-            T_A = self.create_T_A(input)
+            theta_d = sza[matchup_index]
+            context = contexts[matchup_index]
+            dielectric_cache.clear()
 
             # ------------------------------------------------------
             # Calculate brightness temps on basis of the first guess,
             # our starting point for the iteration by the forward function
             # ------------------------------------------------------
-            T_A0 = self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index])
+            if analytic_jacobian:
+                [T_A0, K_A0] = self.fw_model.run_with_jacobian(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context)
+            else:
+                T_A0 = self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)
 
             # ----------------------------------------------
             # Obs - calc, also needed to start the iteration
@@ -72,20 +167,12 @@ class Retrieval:
             dtb_ite0 = -Delta_T
             T_A0_ite0 = T_A0
             temp = np.dot(self.S_e_inv, Delta_T)
-            j_ite_0[matchup_index] = np.dot(Delta_T, temp)
-
-            len_T_A = len(T_A0)
-            ite_Std_inv = np.full([self.maxit, 4], np.NaN, np.float64)
-            ite_p = np.full([self.maxit, 4], np.NaN, np.float64)
-            ite_TA0 = np.full([self.maxit, len_T_A], np.NaN, np.float64)
-            ite_Delta_T = np.full([self.maxit, len_T_A], np.NaN, np.float64)
-            test = np.full([self.maxit], np.NaN, np.float64)
-            dsi = np.full([self.maxit], np.NaN, np.float64)
-            dni = np.full([self.maxit], np.NaN, np.float64)
-            chi = np.full([self.maxit], np.NaN, np.float64)
-            J = np.full([self.maxit], np.NaN, np.float64)
-            K = np.full([len_T_A, 4], np.NaN, np.float64)
-            AKi = np.full([self.maxit, 4, 4], np.NaN, np.float64)
+            j_ite_0 = np.dot(Delta_T, temp)
+
+            # the results are taken from the last iteration performed
+            K = np.full([len(T_A0), 4], np.NaN, np.float64)
+            J_prev = j_ite_0
+            chi_last = np.NaN
 
             # -------------------------------------------------
             # Start iteration and calculation of new p estimate
@@ -97,10 +184,13 @@ class Retrieval:
                 # -------------------
                 # Calculate Jacobians
                 # -------------------
-                K[:, 0] = (T_A0 - self.fw_model.run(p[0, 1], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index])) / (p[0, 2] - p[0, 1])
-                K[:, 1] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 1], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index])) / (p[1, 2] - p[1, 1])
-                K[:, 2] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 2], p[2, 1], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index])) / (p[2, 2] - p[2, 1])
-                K[:, 3] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 1], sw, sw, theta_d, sss, phi_rd[matchup_index])) / (p[3, 2] - p[3, 1])
+                if analytic_jacobian:
+                    K[:, :] = K_A0
+                else:
+                    K[:, 0] = (T_A0 - self.fw_model.run(p[0, 1], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)) / (p[0, 2] - p[0, 1])
+                    K[:, 1] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 1], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)) / (p[1, 2] - p[1, 1])
+                    K[:, 2] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 2], p[2, 1], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)) / (p[2, 2] - p[2, 1])
+                    K[:, 3] = (T_A0 - self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 1], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)) / (p[3, 2] - p[3, 1])
 
                 # ---------------------
                 # Calculate delta p
@@ -123,16 +213,6 @@ class Retrieval:
                 # --------------------------------------------------------------
                 AK = np.matmul(S_inv, K_Se_inv_K)
 
-                # -----------------------------
-                # Degrees of freedom for signal
-                # -----------------------------
-                ds = np.trace(AK)
-
-                # ----------------------------
-                # Degrees of freedom for noise
-                # ----------------------------
-                dn = np.trace(np.matmul(S_inv, self.S_p_inv))
-
                 # ------------------------------------
                 # Calculate update of retrieval vector
                 # per iteration
@@ -172,7 +252,10 @@ class Retrieval:
                 # atmospheric parameters in the updated retrieval vector
                 # They are calculated by using the forward model
                 # ------------------------------------------------------
-                T_A0 = self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index])
+                if analytic_jacobian:
+                    [T_A0, K_A0] = self.fw_model.run_with_jacobian(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context)
+                else:
+                    T_A0 = self.fw_model.run(p[0, 2], p[1, 2], p[2, 2], p[3, 2], sw, sw, theta_d, sss, phi_rd[matchup_index], context=context, dielectric_cache=dielectric_cache)
 
                 # --------------------------------------------
                 # How much do the updated simulated brightness
@@ -187,84 +270,476 @@ class Retrieval:
                 # if we need more iterations
                 # ---------------------------------------------
 
-                # Calculate std for members of retrieval vector
-                # This characterizes the quality of our retrieval results
-                for k in range(0, 4):
-                    ite_Std_inv[ite, k] = np.sqrt(S_inv[k, k])
-
-                # Our retrieval result for each iterations
-                ite_p[ite, :] = p[:, 2]  # collect our results per iteration
-
-                # Simulated brightness temperatures for each iteration
-                ite_TA0[ite, :] = T_A0  # collect simulations per iteration
-
-                # OBS-CALC brightness temperatures
-                ite_Delta_T[ite, :] = Delta_T  # Collect obs-calc
-
                 # TB RMSE test
-                test[ite] = np.sqrt(np.mean(Delta_T * Delta_T))  # Total "Disagreement" by Tb RMSE all channels.
+                test_last = np.sqrt(np.mean(Delta_T * Delta_T))  # Total "Disagreement" by Tb RMSE all channels.
+                if test is not None:
+                    test[matchup_index, ite] = test_last
 
                 # CHI-SQUARE calc
-                temp = np.matmul(self.S_e, Delta_T)
-                chi[ite] = np.matmul(Delta_T, temp)  # "Disagreement" measured by a chi-square test -reduced
-
-                # The total degree of freedom sums up to 4.
-                dsi[ite] = ds  # degrees of freedom for signal
-                dni[ite] = dn  # degrees of freedom for noise
-
-                # Sensitivities
-                AKi[ite, :, :] = AK
+                if calculate_chi:
+                    temp = np.matmul(self.S_e, Delta_T)
+                    chi_last = np.matmul(Delta_T, temp)  # "Disagreement" measured by a chi-square test -reduced
+                    if chi is not None:
+                        chi[matchup_index, ite] = chi_last
 
                 # Calculating the cost function for each iteration
                 delta_p = p_new - p_0
                 temp = np.matmul(self.S_p_inv, delta_p)
                 cost = np.matmul(delta_p, temp)
                 temp = np.matmul(self.S_e_inv, Delta_T)
-                J[ite] = cost + np.matmul(Delta_T, temp)
+                J_ite = cost + np.matmul(Delta_T, temp)
+                if J is not None:
+                    J[matchup_index, ite] = J_ite
 
                 # Convergence - cost function being minimized
-                if ite == 0:
-                    di2[matchup_index, ite] = j_ite_0[matchup_index] - J[ite]
-                else:
-                    di2[matchup_index, ite] = J[ite - 1] - J[ite]
+                di2_ite = J_prev - J_ite
+                J_prev = J_ite
+                if di2 is not None:
+                    di2[matchup_index, ite] = di2_ite
 
                 # convergence criterion
-                if (di2[matchup_index, ite] < 0.1) & (di2[matchup_index, ite] > 0.0):
+                if (di2_ite < 0.1) & (di2_ite > 0.0):
                     convergence_passed_flag = 1
                     # need to add one as the Matlab code counts to basis one, whereas we
                     # are in Python using zero based counting tb 2018-01-08
                     convergence_passed_idx = ite + 1
                     break
 
+            self.forward_model_evaluations += self._count_forward_evaluations(convergence_passed_idx)
+
             # collect results into structure
-            results.j.data[matchup_index, :] = J
-            results.tb_rmse_ite.data[matchup_index, :] = test
-            results.tb_rmse_ite0.data[matchup_index] = tb_rmse_ite0
-            results.tb_chi_ite.data[matchup_index, :] = chi
-            results.convergence_passed_flag.data[matchup_index] = convergence_passed_flag
-            results.i.data[matchup_index] = convergence_passed_idx
-            results.di2.data[matchup_index, :] = di2[matchup_index, :]
-            results.dtb_ite0.data[matchup_index, :] = dtb_ite0
-            results.TA0_ite0.data[matchup_index, :] = T_A0_ite0
-            results.j_ite0[matchup_index] = j_ite_0[matchup_index]
-            results.y[matchup_index, :] = T_A[matchup_index, :]
-            results.p0[matchup_index, :] = p_0[:]
-
-            last_iteration = convergence_passed_idx - 1
-            results.A[matchup_index, :] = np.diagonal(AKi[last_iteration, :, :])
-            results.chisq[matchup_index] = chi[last_iteration]
-            results.mu_sst[matchup_index] = test[last_iteration] * np.float64(0.55)
-            results.x[matchup_index, :] = ite_p[last_iteration, :]
-            results.S[matchup_index, :] = ite_Std_inv[last_iteration, :]
-            results.F[matchup_index, :] = ite_TA0[last_iteration, :]
-            results.dtb[matchup_index, :] = -ite_Delta_T[last_iteration, :]
-            results.ds[matchup_index] = dsi[last_iteration]
-            results.dn[matchup_index] = dni[last_iteration]
-            results.K4[matchup_index, :] = K[:, 3]
-            results.ite_index[matchup_index] = convergence_passed_idx
+            outputs = {"tb_rmse_ite0": tb_rmse_ite0, "convergence_passed_flag": convergence_passed_flag, "i": convergence_passed_idx, "dtb_ite0": dtb_ite0, "TA0_ite0": T_A0_ite0,
+                       "j_ite0": j_ite_0, "y": T_A[matchup_index, :], "p0": p_0[:], "A": np.diagonal(AK), "chisq": chi_last, "mu_sst": test_last * np.float64(0.55), "x": p[:, 2], "F": T_A0,
+                       "dtb": -Delta_T, "K4": K[:, 3], "ite_index": convergence_passed_idx}
+            if calculate_standard:
+                # Calculate std for members of retrieval vector and the degrees of freedom for signal and noise,
+                # the total degree of freedom sums up to 4
+                outputs.update({"S": np.sqrt(np.diagonal(S_inv)), "ds": np.trace(AK), "dn": np.trace(np.matmul(S_inv, self.S_p_inv))})
+            self._write_outputs(results, matchup_index, outputs)
+
+        # per-iteration diagnostics of the retrieved matchups
+        retrieved_indices = np.where(flags == 0)[0]
+        iteration_outputs = {"j": J, "tb_rmse_ite": test, "tb_chi_ite": chi, "di2": di2}
+        self._write_outputs(results, retrieved_indices, {variable_name: data[retrieved_indices] for variable_name, data in iteration_outputs.items() if data is not None})
+
+        self.run_summary.append("dielectric cache: " + str(dielectric_cache.hits) + " hits, " + str(dielectric_cache.misses) + " misses")
+        return results
+
+    def run_batch(self, retrieval_input, results, flag_coding):
+        ws = retrieval_input.ws
+        tcwv = retrieval_input.tcwv
+        tclw = retrieval_input.tclw
+        sst = retrieval_input.sst
+
+        # only the unflagged matchups enter the retrieval, all arrays below are indexed in this subset
+        flags = flag_coding.get_flags()
+        matchup_indices = np.where(flags == 0)[0]
+        num_matchups = len(matchup_indices)
+        if num_matchups == 0:
+            return results
+
+        T_A = retrieval_input.T_A[matchup_indices]
+        T_A_w = self._whiten(T_A)
+        theta_d = retrieval_input.sza[matchup_indices]
+        context = create_geometry_context(theta_d, np.float64(35.0), retrieval_input.phi_rd[matchup_indices])
+
+        p_0 = np.empty([num_matchups, 4], dtype=np.float64)
+        p_0[:, 0] = ws[matchup_indices]
+        p_0[:, 1] = tcwv[matchup_indices]
+        p_0[:, 2] = tclw[matchup_indices]
+        p_0[:, 3] = sst[matchup_indices] + 273.15  # covert sst back to K
+        p = np.copy(p_0)
+
+        # ------------------------------------------------------
+        # Calculate brightness temps on basis of the first guess,
+        # our starting point for the iteration by the forward function
+        # ------------------------------------------------------
+        analytic_jacobian = self.jacobian == "analytic"
+        if analytic_jacobian:
+            [T_A0, K_A0] = self._forward_batch_with_jacobian(p, theta_d, context)
+        else:
+            T_A0 = self._forward_batch(p, theta_d, context)
+        Delta_T = T_A - T_A0
+        Delta_T_w = T_A_w - self._whiten(T_A0)
+
+        # ------------------------------
+        # Results from inversion with FG
+        # ------------------------------
+        tb_rmse_ite0 = np.sqrt(np.mean(Delta_T * Delta_T, axis=1))
+        dtb_ite0 = -Delta_T
+        T_A0_ite0 = T_A0
+        j_ite_0 = np.sum(Delta_T_w * Delta_T_w, axis=1)
+
+        # diagnostics not contained in the result structure are neither stored nor calculated
+        J = self._create_diagnostics_array(results, "j", [num_matchups, self.maxit])
+        test = self._create_diagnostics_array(results, "tb_rmse_ite", [num_matchups, self.maxit])
+        chi = self._create_diagnostics_array(results, "tb_chi_ite", [num_matchups, self.maxit])
+        di2 = self._create_diagnostics_array(results, "di2", [num_matchups, self.maxit])
+        calculate_chi = "chisq" in results or chi is not None
+
+        # values of the last iteration performed per matchup
+        A_last = np.full([num_matchups, 4], np.NaN, np.float64)
+        x_last = np.full([num_matchups, 4], np.NaN, np.float64)
+        F_last = np.full([num_matchups, len(self.S_e)], np.NaN, np.float64)
+        test_last = np.full([num_matchups], np.NaN, np.float64)
+        chi_last = np.full([num_matchups], np.NaN, np.float64)
+        S_last = self._create_diagnostics_array(results, "S", [num_matchups, 4])
+        dtb_last = self._create_diagnostics_array(results, "dtb", [num_matchups, len(self.S_e)])
+        K4_last = self._create_diagnostics_array(results, "K4", [num_matchups, len(self.S_e)])
+        ds_last = self._create_diagnostics_array(results, "ds", [num_matchups])
+        dn_last = self._create_diagnostics_array(results, "dn", [num_matchups])
+
+        convergence_passed_flag = np.zeros([num_matchups], dtype=np.uint8)
+        convergence_passed_idx = np.full([num_matchups], self.maxit, dtype=np.uint8)
+
+        # ------------------------------------------------------------
+        # The active set holds the indices of all matchups that did not
+        # converge yet. All iteration arrays are compacted to this set
+        # and the results are scattered back by index.
+        # ------------------------------------------------------------
+        active = np.arange(num_matchups)
+        T_A_act = T_A
+        T_A_w_act = T_A_w
+        p_0_act = p_0
+        theta_d_act = theta_d
+        context_act = context
+        J_prev_act = j_ite_0
+
+        broyden_update = self.jacobian_update == "broyden"
+        step = None
+        delta_F = None
+        cost_increased = None
+
+        damped_update = self.update == "levenberg_marquardt"
+        gamma = np.full([num_matchups], self.gamma_initial, dtype=np.float64)
+        num_cost_increases = np.zeros([num_matchups], dtype=np.int64)
+        diverged = np.zeros([num_matchups], dtype=bool)
+
+        # -------------------------------------------------
+        # Start iteration and calculation of new p estimate
+        # -------------------------------------------------
+        active_counts = []
+        for ite in range(0, self.maxit):
+            num_active = len(active)
+            if num_active == 0:
+                break
+            active_counts.append(num_active)
+
+            # -------------------
+            # Calculate Jacobians
+            # -------------------
+            if analytic_jacobian:
+                K = K_A0
+            elif broyden_update and ite > 0:
+                K = self._broyden_jacobian(K, step, delta_F)
+                # matchups where the cost function increased fall back to a full recomputation
+                if np.any(cost_increased):
+                    K[cost_increased] = self._finite_difference_jacobian(p[cost_increased], T_A0[cost_increased], theta_d_act[cost_increased], context_act[cost_increased])
+            else:
+                K = self._finite_difference_jacobian(p, T_A0, theta_d_act, context_act)
+
+            Delta_p = p_0_act - p
+
+            # ------------------------------------------------------
+            # Retrieval Covariance matrix, set up in the whitened
+            # measurement space and factorised instead of inverted
+            # ------------------------------------------------------
+            [K_w, S, S_chol, S_inv, AK] = self._calc_retrieval_covariance(K)
+
+            # ------------------------------------
+            # Calculate update of retrieval vector
+            # per iteration
+            # ------------------------------------
+            temp = np.einsum("nai,na->ni", K_w, Delta_T_w) + np.matmul(Delta_p, self.S_p_inv.transpose())
+            if damped_update:
+                # Levenberg-Marquardt step, the prior term is inflated by (1 + gamma)
+                step_chol = np.linalg.cholesky(S + gamma[active, np.newaxis, np.newaxis] * self.S_p_inv)
+            else:
+                step_chol = S_chol
+            p_est = self._cholesky_solve(step_chol, temp[:, :, np.newaxis])[:, :, 0]
+            p_prev = p
+            p = p_est + p
+
+            T_A0_prev = T_A0
+            if analytic_jacobian:
+                K_A0_prev = K_A0
+                [T_A0, K_A0] = self._forward_batch_with_jacobian(p, theta_d_act, context_act)
+            else:
+                T_A0 = self._forward_batch(p, theta_d_act, context_act)
+            T_A0_trial = T_A0
+            Delta_T_w = T_A_w_act - self._whiten(T_A0)
+
+            delta_p = p - p_0_act
+            J_act = np.einsum("ni,ij,nj->n", delta_p, self.S_p_inv, delta_p) + np.sum(Delta_T_w * Delta_T_w, axis=1)
+
+            # Convergence - cost function being minimized
+            di2_act = J_prev_act - J_act
+            if di2 is not None:
+                di2[active, ite] = di2_act
+            # a cost function turning invalid counts as an increase
+            cost_increase = ~(di2_act >= 0.0)
+
+            if damped_update:
+                # trial steps increasing the cost function are rejected and the damping is raised
+                rejected = cost_increase
+                p = np.where(rejected[:, np.newaxis], p_prev, p)
+                T_A0 = np.where(rejected[:, np.newaxis], T_A0_prev, T_A0)
+                Delta_T_w = T_A_w_act - self._whiten(T_A0)
+                if analytic_jacobian:
+                    K_A0 = np.where(rejected[:, np.newaxis, np.newaxis], K_A0_prev, K_A0)
+                J_act = np.where(rejected, J_prev_act, J_act)
+                gamma[active] = np.where(rejected, gamma[active] * self.gamma_factor, gamma[active] / self.gamma_factor)
+            Delta_T = T_A_act - T_A0
+            if J is not None:
+                J[active, ite] = J_act
+
+            # ---------------------------------------------
+            # Analysis of the quality of the retrieval result
+            # ---------------------------------------------
+            test_last[active] = np.sqrt(np.mean(Delta_T * Delta_T, axis=1))
+            if test is not None:
+                test[active, ite] = test_last[active]
+            if calculate_chi:
+                chi_last[active] = np.einsum("ni,ij,nj->n", Delta_T, self.S_e, Delta_T)
+                if chi is not None:
+                    chi[active, ite] = chi_last[active]
+
+            x_last[active] = p
+            F_last[active] = T_A0
+            if dtb_last is not None:
+                dtb_last[active] = -Delta_T
+            if not damped_update:
+                self._set_covariance_diagnostics(active, K, S_inv, AK, A_last, S_last, K4_last, ds_last, dn_last)
+
+            # convergence criterion
+            converged = (di2_act < 0.1) & (di2_act > 0.0)
+            convergence_passed_flag[active[converged]] = 1
+            # need to add one as the Matlab code counts to basis one, whereas we
+            # are in Python using zero based counting tb 2018-01-08
+            convergence_passed_idx[active[converged]] = ite + 1
+
+            stopped = converged
+            if self.divergence_guard:
+                num_cost_increases[active] = np.where(cost_increase, num_cost_increases[active] + 1, 0)
+                diverging = num_cost_increases[active] >= self.divergence_limit
+                diverged[active[diverging]] = True
+                convergence_passed_idx[active[diverging]] = ite + 1
+                stopped = converged | diverging
+
+            # compact the active set to the matchups still iterating
+            remaining = ~stopped
+            active = active[remaining]
+            p = p[remaining]
+            T_A0 = T_A0[remaining]
+            Delta_T = Delta_T[remaining]
+            Delta_T_w = Delta_T_w[remaining]
+            T_A_act = T_A_act[remaining]
+            T_A_w_act = T_A_w_act[remaining]
+            p_0_act = p_0_act[remaining]
+            theta_d_act = theta_d_act[remaining]
+            context_act = context_act[remaining]
+            J_prev_act = J_act[remaining]
+            if analytic_jacobian:
+                K_A0 = K_A0[remaining]
+            if broyden_update:
+                K = K[remaining]
+                step = p_est[remaining]
+                delta_F = T_A0_trial[remaining] - T_A0_prev[remaining]
+                cost_increased = di2_act[remaining] < 0.0
+
+        if damped_update:
+            # rejected trial steps leave the accepted state behind the last Jacobian, the diagnostics of damped updates
+            # are calculated from the undamped normal matrix at the final accepted state
+            retrieved = np.arange(num_matchups)
+            if analytic_jacobian:
+                [_, K] = self._forward_batch_with_jacobian(x_last, theta_d, context)
+            else:
+                K = self._finite_difference_jacobian(x_last, F_last, theta_d, context)
+            [_, _, _, S_inv, AK] = self._calc_retrieval_covariance(K)
+            self._set_covariance_diagnostics(retrieved, K, S_inv, AK, A_last, S_last, K4_last, ds_last, dn_last)
+
+        self.run_summary.append("active matchups per iteration: " + ", ".join(str(num_active) for num_active in active_counts))
+        if np.any(diverged):
+            self.run_summary.append(str(np.count_nonzero(diverged)) + " matchups stopped by the divergence guard")
+            diverged_tags = np.zeros(len(flags), dtype=bool)
+            diverged_tags[matchup_indices[diverged]] = True
+            flag_coding.add_retrieval_diverged(diverged_tags)
+
+        # collect results into structure
+        outputs = {"j": J, "tb_rmse_ite": test, "tb_rmse_ite0": tb_rmse_ite0, "tb_chi_ite": chi, "convergence_passed_flag": convergence_passed_flag, "i": convergence_passed_idx, "di2": di2,
+                   "dtb_ite0": dtb_ite0, "TA0_ite0": T_A0_ite0, "j_ite0": j_ite_0, "y": T_A, "p0": p_0, "A": A_last, "chisq": chi_last, "mu_sst": test_last * np.float64(0.55), "x": x_last,
+                   "S": S_last, "F": F_last, "dtb": dtb_last, "ds": ds_last, "dn": dn_last, "K4": K4_last, "ite_index": convergence_passed_idx}
+        self._write_outputs(results, matchup_indices, outputs)
+
+        return results
+
+    def run_numba(self, retrieval_input, results, flag_coding):
+        flags = flag_coding.get_flags()
+        matchup_indices = np.where(flags == 0)[0]
+        num_matchups = len(matchup_indices)
+        if num_matchups == 0:
+            return results
+
+        p_0 = np.empty([num_matchups, 4], dtype=np.float64)
+        p_0[:, 0] = retrieval_input.ws[matchup_indices]
+        p_0[:, 1] = retrieval_input.tcwv[matchup_indices]
+        p_0[:, 2] = retrieval_input.tclw[matchup_indices]
+        p_0[:, 3] = retrieval_input.sst[matchup_indices] + 273.15  # covert sst back to K
+        T_A = retrieval_input.T_A[matchup_indices]
+        theta_d = retrieval_input.sza[matchup_indices]
+        context = create_geometry_context(theta_d, np.float64(35.0), retrieval_input.phi_rd[matchup_indices])
+
+        # the diagnostics level follows the result structure, the kernel skips the diagnostics missing in it
+        if "j" in results:
+            diagnostics_level = retrieval_kernel.DIAGNOSTICS_FULL
+        elif "dtb" in results:
+            diagnostics_level = retrieval_kernel.DIAGNOSTICS_STANDARD
+        else:
+            diagnostics_level = retrieval_kernel.DIAGNOSTICS_MINIMAL
+
+        [out_ite, out_bt, out_F, out_state, out_scalar, out_index] = retrieval_kernel.create_output_arrays(num_matchups, self.maxit, diagnostics_level)
+        [ws_state, ws_bt, ws_K, ws_matrix, ws_dielectric] = retrieval_kernel.create_workspaces(retrieval_kernel.get_num_chunks(num_matchups))
+
+        retrieval_kernel.run_retrieval_kernel(p_0, T_A, theta_d, context, self.eps, self.S_p_inv, self.S_e_inv, self.S_e, self.maxit, np.float64(35.0), diagnostics_level, ws_state, ws_bt, ws_K, ws_matrix,
+                                              ws_dielectric, out_ite, out_bt, out_F, out_state, out_scalar, out_index)
+
+        # wrap the flat kernel output into the result structure
+        outputs = {"j": out_ite[:, retrieval_kernel.ITE_J, :], "tb_rmse_ite": out_ite[:, retrieval_kernel.ITE_TB_RMSE, :], "tb_rmse_ite0": out_scalar[:, retrieval_kernel.SCALAR_TB_RMSE_ITE0],
+                   "tb_chi_ite": out_ite[:, retrieval_kernel.ITE_TB_CHI, :], "convergence_passed_flag": out_index[:, retrieval_kernel.INDEX_CONVERGENCE_PASSED_FLAG],
+                   "i": out_index[:, retrieval_kernel.INDEX_I], "di2": out_ite[:, retrieval_kernel.ITE_DI2, :], "dtb_ite0": out_bt[:, retrieval_kernel.BT_DTB_ITE0, :],
+                   "TA0_ite0": out_bt[:, retrieval_kernel.BT_TA0_ITE0, :], "j_ite0": out_scalar[:, retrieval_kernel.SCALAR_J_ITE0], "y": T_A, "p0": p_0,
+                   "A": out_state[:, retrieval_kernel.STATE_A, :], "chisq": out_scalar[:, retrieval_kernel.SCALAR_CHISQ], "mu_sst": out_scalar[:, retrieval_kernel.SCALAR_MU_SST],
+                   "x": out_state[:, retrieval_kernel.STATE_X, :], "S": out_state[:, retrieval_kernel.STATE_S, :], "F": out_F,
+                   "dtb": out_bt[:, retrieval_kernel.BT_DTB, :], "ds": out_scalar[:, retrieval_kernel.SCALAR_DS], "dn": out_scalar[:, retrieval_kernel.SCALAR_DN],
+                   "K4": out_bt[:, retrieval_kernel.BT_K4, :], "ite_index": out_index[:, retrieval_kernel.INDEX_I]}
+        self._write_outputs(results, matchup_indices, outputs)
+
+        self.forward_model_evaluations += int(np.sum(self._count_forward_evaluations(out_index[:, retrieval_kernel.INDEX_I].astype(np.int64))))
 
         return results
 
+    def _finite_difference_jacobian(self, p, T_A0, theta_d, context):
+        p_plus = p + self.eps
+        K = np.empty([len(p), len(self.S_e), 4], dtype=np.float64)
+        # the perturbations of W, V and L keep the surface temperature and share its dielectric constant
+        dielectric = None
+        if self.fw_model_type == "physical":
+            dielectric = self.fw_model.calc_dielectric(p[:, 3], np.float64(35.0), context)
+        for k in range(0, 4):
+            p_pert = np.copy(p)
+            p_pert[:, k] = p_plus[:, k]
+            T_pert = self._forward_batch(p_pert, theta_d, context, dielectric if k < 3 else None)
+            K[:, :, k] = (T_A0 - T_pert) / (p[:, k] - p_plus[:, k])[:, np.newaxis]
+
+        return K
+
+    def _calc_retrieval_covariance(self, K):
+        """
+        Sets up the normal matrix S = K^T S_e^-1 K + S_p^-1 in the whitened measurement space and factorises it.
+        :return: [K_w, S, S_chol, S_inv, AK] with the whitened Jacobians, the normal matrix, its Cholesky factor, the
+        retrieval covariance and the averaging kernel
+        """
+        K_w = np.matmul(self.S_e_whitening, K)
+        K_Se_inv_K = np.matmul(K_w.transpose(0, 2, 1), K_w)
+        S = self.S_p_inv + K_Se_inv_K
+        S_chol = np.linalg.cholesky(S)
+        S_inv = self._cholesky_solve(S_chol, np.broadcast_to(np.eye(4), S.shape))
+
+        # Averaging Kernel, degrees of freedom for signal and noise
+        AK = np.matmul(S_inv, K_Se_inv_K)
+        return [K_w, S, S_chol, S_inv, AK]
+
+    def _set_covariance_diagnostics(self, indices, K, S_inv, AK, A_last, S_last, K4_last, ds_last, dn_last):
+        A_last[indices] = np.diagonal(AK, axis1=1, axis2=2)
+        if S_last is not None:
+            S_last[indices] = np.sqrt(np.diagonal(S_inv, axis1=1, axis2=2))
+        if K4_last is not None:
+            K4_last[indices] = K[:, :, 3]
+        if ds_last is not None:
+            ds_last[indices] = np.einsum("nii->n", AK)
+        if dn_last is not None:
+            dn_last[indices] = np.einsum("nij,ji->n", S_inv, self.S_p_inv)
+
+    def _broyden_jacobian(self, K, step, delta_F):
+        """
+        Rank-1 Broyden update of the Jacobians from the last state step and the change of the simulated brightness
+        temperatures it caused. The step is weighted by the finite difference perturbation to balance the units of the
+        state vector. Matchups whose step is smaller than freeze_step perturbations keep their Jacobian.
+        """
+        scaled_step = step / self.eps
+        step_norm = np.sum(scaled_step * scaled_step, axis=1)
+        update = np.max(np.abs(scaled_step), axis=1) >= self.freeze_step
+
+        K_new = np.copy(K)
+        if np.any(update):
+            residual = delta_F[update] - np.einsum("nij,nj->ni", K[update], step[update])
+            weighted_step = scaled_step[update] / self.eps / step_norm[update, np.newaxis]
+            K_new[update] += np.einsum("ni,nj->nij", residual, weighted_step)
+
+        return K_new
+
+    @staticmethod
+    def _create_diagnostics_array(results, variable_name, shape):
+        if variable_name not in results:
+            return None
+
+        return np.full(shape, np.NaN, np.float64)
+
+    @staticmethod
+    def _write_outputs(results, matchup_indices, outputs):
+        # outputs missing in the result structure are skipped, depending on the diagnostics level
+        for variable_name, data in outputs.items():
+            if variable_name in results:
+                results[variable_name].data[matchup_indices] = data
+
+    def _print_iterations_histogram(self, num_iterations):
+        # matchups not retrieved carry the fill value and are not counted
+        num_iterations = num_iterations[num_iterations <= self.maxit]
+        histogram = np.bincount(num_iterations.astype(np.int64), minlength=self.maxit + 1)
+        print(" ... iterations histogram: " + ", ".join(str(ite) + ": " + str(histogram[ite]) for ite in range(1, self.maxit + 1)))
+
+    def _whiten(self, T_B):
+        return np.matmul(T_B, self.S_e_whitening.transpose())
+
+    @staticmethod
+    def _cholesky_solve(L, B):
+        """
+        Solves L L^T X = B for a stack of lower triangular Cholesky factors L by forward and back substitution.
+        """
+        size = L.shape[1]
+        Y = np.empty(B.shape, dtype=np.float64)
+        for i in range(0, size):
+            Y[:, i, :] = (B[:, i, :] - np.einsum("nj,njk->nk", L[:, i, :i], Y[:, :i, :])) / L[:, i, i, np.newaxis]
+
+        X = np.empty(B.shape, dtype=np.float64)
+        for i in range(size - 1, -1, -1):
+            X[:, i, :] = (Y[:, i, :] - np.einsum("nj,njk->nk", L[:, i + 1:, i], X[:, i + 1:, :])) / L[:, i, i, np.newaxis]
+
+        return X
+
+    def _count_forward_evaluations(self, num_iterations):
+        # one evaluation for the first guess, per iteration one for the new state plus four for the finite differences
+        if self.jacobian == "analytic":
+            return 1 + num_iterations
+
+        return 1 + 5 * num_iterations
+
+    def _forward_batch(self, p, theta_d, context, dielectric=None):
+        sw = 0  # Switched off ice in forward model
+        sss = np.float64(35.0)
+        self.forward_model_evaluations += len(p)
+
+        # the relative angle enters the forward model through the geometry context only
+        return self.fw_model.run_batch(p[:, 0], p[:, 1], p[:, 2], p[:, 3], sw, sw, theta_d, sss, np.NaN, context=context, dielectric=dielectric)
+
+    def _forward_batch_with_jacobian(self, p, theta_d, context):
+        sw = 0  # Switched off ice in forward model
+        sss = np.float64(35.0)
+
+        self.forward_model_evaluations += len(p)
+
+        return self.fw_model.run_batch_with_jacobian(p[:, 0], p[:, 1], p[:, 2], p[:, 3], sw, sw, theta_d, sss, np.NaN, context=context)
+
     def prepare_first_guess(self, ws, tcwv, tclw, sst, eps):
         sst = sst + 273.15  # covert sst back to K
         p = np.array([[ws - eps[0], ws + eps[0], ws], [tcwv - eps[1], tcwv + eps[1], tcwv], [tclw - eps[2], tclw + eps[2], tclw], [sst - eps[3], sst + eps[3], sst]], dtype=np.float64)
@@ -274,10 +749,4 @@ class Retrieval:
         return [p, p_0]
 
     def create_T_A(self, dataset):
-        num_matchups = len(dataset.coords["matchup_count"])
-        T_A = np.empty((num_matchups, 10))
-        for i in range(6, 16):
-            variable_name = INPUT_VARIABLES[i]
-            T_A[:, i - 6] = dataset[variable_name].data
-
-        return T_A
+        return RetrievalInput.create_T_A(dataset)
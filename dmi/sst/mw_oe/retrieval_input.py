@@ -0,0 +1,46 @@
+import numpy as np
+
+from dmi.sst.mw_oe.constants import INPUT_VARIABLES
+
+NUM_BT = 10
+
+
+class RetrievalInput:
+    """
+    Contiguous float64 block of all per-matchup quantities the retrieval needs. Built once per run
+    from the preprocessed (and bias corrected) dataset, so the retrieval engines never touch the xarray
+    variables inside their loops.
+    """
+    ws = None
+    tcwv = None
+    tclw = None
+    sst = None
+    sza = None
+    phi_rd = None
+    T_A = None
+
+    def __init__(self, dataset):
+        self.ws = RetrievalInput._to_float64(dataset["amsre.nwp.abs_wind_speed"].data)
+        self.tcwv = RetrievalInput._to_float64(dataset["amsre.nwp.total_column_water_vapour"].data)
+        self.tclw = RetrievalInput._to_float64(dataset["amsre.nwp.total_column_liquid_water"].data)
+        self.sst = RetrievalInput._to_float64(dataset["amsre.nwp.sea_surface_temperature"].data)
+        self.sza = RetrievalInput._to_float64(dataset["amsre.satellite_zenith_angle"].data)
+        self.phi_rd = RetrievalInput._to_float64(dataset["relative_angle"].data)
+        self.T_A = RetrievalInput.create_T_A(dataset)
+
+    def get_num_matchups(self):
+        return len(self.T_A)
+
+    @staticmethod
+    def create_T_A(dataset):
+        num_matchups = len(dataset.coords["matchup_count"])
+        T_A = np.empty((num_matchups, NUM_BT), dtype=np.float64)
+        for i in range(6, 16):
+            variable_name = INPUT_VARIABLES[i]
+            T_A[:, i - 6] = dataset[variable_name].data
+
+        return T_A
+
+    @staticmethod
+    def _to_float64(data):
+        return np.ascontiguousarray(data, dtype=np.float64)
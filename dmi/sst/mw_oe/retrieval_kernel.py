@@ -0,0 +1,317 @@
+import numba
+import numpy as np
+from numba import jit, prange
+
+from dmi.sst.mw_oe.fw_model_kernel import NUM_FREQ, open_water_dielectric, open_water_brightness
+
+NUM_BT = 10
+NUM_STATE = 4
+
+# diagnostics levels, see MwOeSstProcessor._create_result_structure
+DIAGNOSTICS_MINIMAL = 0
+DIAGNOSTICS_STANDARD = 1
+DIAGNOSTICS_FULL = 2
+
+# layout of the flat output arrays written by the kernel
+# out_ite      (matchup, 4, iterations), full diagnostics only
+ITE_J = 0
+ITE_TB_RMSE = 1
+ITE_TB_CHI = 2
+ITE_DI2 = 3
+# out_bt       (matchup, 4, num_bt), dtb from standard diagnostics on, the other rows with full diagnostics
+BT_DTB_ITE0 = 0
+BT_TA0_ITE0 = 1
+BT_DTB = 2
+BT_K4 = 3
+# out_F        (matchup, num_bt)
+# out_state    (matchup, 3, kernel_size)
+STATE_A = 0
+STATE_X = 1
+STATE_S = 2
+# out_scalar   (matchup, 6), mu_sst on all levels, the others from standard diagnostics on
+SCALAR_TB_RMSE_ITE0 = 0
+SCALAR_J_ITE0 = 1
+SCALAR_CHISQ = 2
+SCALAR_MU_SST = 3
+SCALAR_DS = 4
+SCALAR_DN = 5
+# out_index    (matchup, 2)
+INDEX_CONVERGENCE_PASSED_FLAG = 0
+INDEX_I = 1
+
+# layout of the per-chunk workspaces
+# ws_state     (chunk, 7, kernel_size)
+WS_P = 0
+WS_P_PLUS = 1
+WS_P_PERT = 2
+WS_DELTA_P = 3
+WS_TEMP = 4
+WS_P_EST = 5
+WS_P_NEW = 6
+# ws_bt        (chunk, 3, num_bt)
+WS_T_A0 = 0
+WS_T_PERT = 1
+WS_DELTA_T = 2
+# ws_K         (chunk, 2, num_bt, kernel_size)
+WS_K = 0
+WS_SE_INV_K = 1
+# ws_matrix    (chunk, 4, kernel_size, kernel_size)
+WS_S = 0
+WS_S_INV = 1
+WS_AK = 2
+WS_CHOL = 3
+# ws_dielectric (chunk, 2, 4, num_freq), see the dielectric buffer layout of fw_model_kernel
+WS_DIELECTRIC = 0
+WS_DIELECTRIC_PERT = 1
+
+
+def create_output_arrays(num_matchups, max_iterations, diagnostics_level=DIAGNOSTICS_FULL):
+    # diagnostics arrays of levels not requested have no matchups, the kernel neither calculates nor writes them
+    num_ite_matchups = num_matchups if diagnostics_level >= DIAGNOSTICS_FULL else 0
+    num_bt_matchups = num_matchups if diagnostics_level >= DIAGNOSTICS_STANDARD else 0
+    out_ite = np.full([num_ite_matchups, 4, max_iterations], np.NaN, dtype=np.float64)
+    out_bt = np.full([num_bt_matchups, 4, NUM_BT], np.NaN, dtype=np.float64)
+    out_F = np.full([num_matchups, NUM_BT], np.NaN, dtype=np.float64)
+    out_state = np.full([num_matchups, 3, NUM_STATE], np.NaN, dtype=np.float64)
+    out_scalar = np.full([num_matchups, 6], np.NaN, dtype=np.float64)
+    out_index = np.zeros([num_matchups, 2], dtype=np.uint8)
+    return [out_ite, out_bt, out_F, out_state, out_scalar, out_index]
+
+
+def create_workspaces(num_chunks):
+    ws_state = np.empty([num_chunks, 7, NUM_STATE], dtype=np.float64)
+    ws_bt = np.empty([num_chunks, 3, NUM_BT], dtype=np.float64)
+    ws_K = np.empty([num_chunks, 2, NUM_BT, NUM_STATE], dtype=np.float64)
+    ws_matrix = np.empty([num_chunks, 4, NUM_STATE, NUM_STATE], dtype=np.float64)
+    ws_dielectric = np.empty([num_chunks, 2, 4, NUM_FREQ], dtype=np.float64)
+    return [ws_state, ws_bt, ws_K, ws_matrix, ws_dielectric]
+
+
+def get_num_chunks(num_matchups):
+    # a few chunks per thread to balance matchups converging at different iterations
+    return max(1, min(num_matchups, numba.get_num_threads() * 4))
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def run_retrieval_kernel(p_0, T_A, theta_d, context, eps, S_p_inv, S_e_inv, S_e, maxit, sss, diagnostics_level, ws_state, ws_bt, ws_K, ws_matrix, ws_dielectric, out_ite, out_bt, out_F, out_state,
+                         out_scalar, out_index):
+    num_matchups = p_0.shape[0]
+    num_chunks = ws_state.shape[0]
+    chunk_size = (num_matchups + num_chunks - 1) // num_chunks
+
+    for c in prange(num_chunks):
+        start = c * chunk_size
+        end = min(start + chunk_size, num_matchups)
+        for m in range(start, end):
+            retrieve_matchup(m, p_0, T_A, theta_d, context, eps, S_p_inv, S_e_inv, S_e, maxit, sss, diagnostics_level, ws_state[c], ws_bt[c], ws_K[c], ws_matrix[c], ws_dielectric[c], out_ite, out_bt,
+                             out_F, out_state, out_scalar, out_index)
+
+
+@jit(nopython=True, cache=True)
+def retrieve_matchup(m, p_0, T_A, theta_d, context, eps, S_p_inv, S_e_inv, S_e, maxit, sss, diagnostics_level, ws_state, ws_bt, ws_K, ws_matrix, ws_dielectric, out_ite, out_bt, out_F, out_state,
+                     out_scalar, out_index):
+    standard_diagnostics = diagnostics_level >= DIAGNOSTICS_STANDARD
+    full_diagnostics = diagnostics_level >= DIAGNOSTICS_FULL
+    p = ws_state[WS_P]
+    p_plus = ws_state[WS_P_PLUS]
+    p_pert = ws_state[WS_P_PERT]
+    Delta_p = ws_state[WS_DELTA_P]
+    temp = ws_state[WS_TEMP]
+    p_est = ws_state[WS_P_EST]
+    p_new = ws_state[WS_P_NEW]
+    T_A0 = ws_bt[WS_T_A0]
+    T_pert = ws_bt[WS_T_PERT]
+    Delta_T = ws_bt[WS_DELTA_T]
+    K = ws_K[WS_K]
+    Se_inv_K = ws_K[WS_SE_INV_K]
+    S = ws_matrix[WS_S]
+    S_inv = ws_matrix[WS_S_INV]
+    AK = ws_matrix[WS_AK]
+    chol = ws_matrix[WS_CHOL]
+    dielectric = ws_dielectric[WS_DIELECTRIC]
+    dielectric_pert = ws_dielectric[WS_DIELECTRIC_PERT]
+
+    y = T_A[m]
+    for k in range(NUM_STATE):
+        p[k] = p_0[m, k]
+        p_plus[k] = p[k] + eps[k]
+
+    # first guess simulation and obs - calc
+    open_water_dielectric(p[3], sss, context[m], dielectric)
+    open_water_brightness(p[0], p[1], p[2], p[3], theta_d[m], context[m], dielectric, T_A0)
+    for b in range(NUM_BT):
+        Delta_T[b] = y[b] - T_A0[b]
+        if full_diagnostics:
+            out_bt[m, BT_DTB_ITE0, b] = -Delta_T[b]
+            out_bt[m, BT_TA0_ITE0, b] = T_A0[b]
+
+    J_prev = _quadratic_form(Delta_T, S_e_inv)
+    if standard_diagnostics:
+        out_scalar[m, SCALAR_TB_RMSE_ITE0] = _rmse(Delta_T)
+        out_scalar[m, SCALAR_J_ITE0] = J_prev
+
+    convergence_passed_flag = 0
+    convergence_passed_idx = maxit
+    for ite in range(maxit):
+        # Jacobian by finite differences, the perturbations of W, V and L reuse the dielectric constant of the
+        # central simulation
+        for k in range(NUM_STATE):
+            for kk in range(NUM_STATE):
+                p_pert[kk] = p[kk]
+            p_pert[k] = p_plus[k]
+            if k == 3:
+                open_water_dielectric(p_pert[3], sss, context[m], dielectric_pert)
+                open_water_brightness(p_pert[0], p_pert[1], p_pert[2], p_pert[3], theta_d[m], context[m], dielectric_pert, T_pert)
+            else:
+                open_water_brightness(p_pert[0], p_pert[1], p_pert[2], p_pert[3], theta_d[m], context[m], dielectric, T_pert)
+            denominator = p[k] - p_plus[k]
+            for b in range(NUM_BT):
+                K[b, k] = (T_A0[b] - T_pert[b]) / denominator
+
+        for k in range(NUM_STATE):
+            Delta_p[k] = p_0[m, k] - p[k]
+
+        # retrieval covariance, S = S_p_inv + K^T S_e_inv K
+        for b in range(NUM_BT):
+            for k in range(NUM_STATE):
+                acc = 0.0
+                for bb in range(NUM_BT):
+                    acc += S_e_inv[b, bb] * K[bb, k]
+                Se_inv_K[b, k] = acc
+
+        for i in range(NUM_STATE):
+            for k in range(NUM_STATE):
+                acc = 0.0
+                for b in range(NUM_BT):
+                    acc += K[b, i] * Se_inv_K[b, k]
+                AK[i, k] = acc  # K_Se_inv_K for now, turned into the averaging kernel below
+                S[i, k] = S_p_inv[i, k] + acc
+
+        _invert_spd(S, chol, S_inv)
+
+        # averaging kernel, degrees of freedom for signal and noise
+        ds = 0.0
+        dn = 0.0
+        for i in range(NUM_STATE):
+            for k in range(NUM_STATE):
+                temp[k] = 0.0
+                for kk in range(NUM_STATE):
+                    temp[k] += S_inv[i, kk] * AK[kk, k]
+                if standard_diagnostics:
+                    dn += S_inv[i, k] * S_p_inv[k, i]
+            ds += temp[i]
+            out_state[m, STATE_A, i] = temp[i]
+            if standard_diagnostics:
+                out_state[m, STATE_S, i] = np.sqrt(S_inv[i, i])
+
+        # update of the retrieval vector
+        for k in range(NUM_STATE):
+            acc = 0.0
+            for b in range(NUM_BT):
+                acc += Se_inv_K[b, k] * Delta_T[b]
+            for kk in range(NUM_STATE):
+                acc += S_p_inv[k, kk] * Delta_p[kk]
+            temp[k] = acc
+
+        for k in range(NUM_STATE):
+            acc = 0.0
+            for kk in range(NUM_STATE):
+                acc += S_inv[k, kk] * temp[kk]
+            p_est[k] = acc
+            p_new[k] = p_est[k] + p[k]
+
+        for k in range(NUM_STATE):
+            p[k] = p_new[k]
+            p_plus[k] = p_new[k] + eps[k]
+
+        open_water_dielectric(p[3], sss, context[m], dielectric)
+        open_water_brightness(p[0], p[1], p[2], p[3], theta_d[m], context[m], dielectric, T_A0)
+        for b in range(NUM_BT):
+            Delta_T[b] = y[b] - T_A0[b]
+
+        # quality of the iteration
+        rmse = _rmse(Delta_T)
+        for k in range(NUM_STATE):
+            temp[k] = p_new[k] - p_0[m, k]
+        J = _quadratic_form(temp, S_p_inv) + _quadratic_form(Delta_T, S_e_inv)
+        di2 = J_prev - J
+        J_prev = J
+
+        if standard_diagnostics:
+            out_scalar[m, SCALAR_CHISQ] = _quadratic_form(Delta_T, S_e)
+            out_scalar[m, SCALAR_DS] = ds
+            out_scalar[m, SCALAR_DN] = dn
+            for b in range(NUM_BT):
+                out_bt[m, BT_DTB, b] = -Delta_T[b]
+
+        if full_diagnostics:
+            out_ite[m, ITE_J, ite] = J
+            out_ite[m, ITE_TB_RMSE, ite] = rmse
+            out_ite[m, ITE_TB_CHI, ite] = out_scalar[m, SCALAR_CHISQ]
+            out_ite[m, ITE_DI2, ite] = di2
+            for b in range(NUM_BT):
+                out_bt[m, BT_K4, b] = K[b, 3]
+
+        out_scalar[m, SCALAR_MU_SST] = rmse * 0.55
+        for k in range(NUM_STATE):
+            out_state[m, STATE_X, k] = p[k]
+        for b in range(NUM_BT):
+            out_F[m, b] = T_A0[b]
+
+        # convergence criterion
+        if (di2 < 0.1) and (di2 > 0.0):
+            convergence_passed_flag = 1
+            convergence_passed_idx = ite + 1
+            break
+
+    out_index[m, INDEX_CONVERGENCE_PASSED_FLAG] = convergence_passed_flag
+    out_index[m, INDEX_I] = convergence_passed_idx
+
+
+@jit(nopython=True, cache=True)
+def _rmse(Delta_T):
+    acc = 0.0
+    for b in range(Delta_T.shape[0]):
+        acc += Delta_T[b] * Delta_T[b]
+    return np.sqrt(acc / Delta_T.shape[0])
+
+
+@jit(nopython=True, cache=True)
+def _quadratic_form(v, matrix):
+    acc = 0.0
+    for i in range(v.shape[0]):
+        row = 0.0
+        for j in range(v.shape[0]):
+            row += matrix[i, j] * v[j]
+        acc += v[i] * row
+    return acc
+
+
+@jit(nopython=True, cache=True)
+def _invert_spd(matrix, chol, inverse):
+    # inverts the symmetric positive definite matrix via its Cholesky factor, chol is used as workspace
+    n = matrix.shape[0]
+    for i in range(n):
+        for j in range(i + 1):
+            acc = matrix[i, j]
+            for k in range(j):
+                acc -= chol[i, k] * chol[j, k]
+            if i == j:
+                chol[i, i] = np.sqrt(acc)
+            else:
+                chol[i, j] = acc / chol[j, j]
+        for j in range(i + 1, n):
+            chol[i, j] = 0.0
+
+    # solve L L^T X = I column by column
+    for c in range(n):
+        for i in range(n):
+            acc = 1.0 if i == c else 0.0
+            for k in range(i):
+                acc -= chol[i, k] * inverse[k, c]
+            inverse[i, c] = acc / chol[i, i]
+        for i in range(n - 1, -1, -1):
+            acc = inverse[i, c]
+            for k in range(i + 1, n):
+                acc -= chol[k, i] * inverse[k, c]
+            inverse[i, c] = acc / chol[i, i]
@@ -0,0 +1,109 @@
+import numpy as np
+from numba import jit
+
+
+class WindowStatistics:
+    """
+    Statistics of the square windows centred in the subsets of a (N, height, width) cube. A single pass accumulates the
+    valid values, squared values and valid pixel counts per ring of equal distance to the centre pixel into cumulative
+    tables, the summed area tables of all centred windows. Mean, standard deviation and number of invalid pixels of a
+    centred window of any size are then looked up in O(1) per matchup. Fill values and NaN are invalid; packed integer
+    data are compared to the fill value in their own dtype by exact equality.
+    """
+    sum_table = None
+    sum_sq_table = None
+    count_table = None
+    num_pixels = None
+    shift = None
+
+    def __init__(self, data, fill_value):
+        num_matchups = data.shape[0]
+        height = data.shape[1]
+        width = data.shape[2]
+        center_y = int(np.floor(height / 2))
+        center_x = int(np.floor(width / 2))
+
+        # number of pixels of the centred windows with offsets 0 .. num_offsets - 1, clipped at the subset border
+        num_offsets = max(center_y, center_x, height - center_y - 1, width - center_x - 1) + 1
+        offsets = np.arange(num_offsets)
+        y_min = np.maximum(center_y - offsets, 0)
+        y_max = np.minimum(center_y + offsets + 1, height)
+        x_min = np.maximum(center_x - offsets, 0)
+        x_max = np.minimum(center_x + offsets + 1, width)
+
+        self.num_pixels = np.concatenate([[0], (y_max - y_min) * (x_max - x_min)])
+        self.sum_table = np.zeros([num_matchups, num_offsets + 1], dtype=np.float64)
+        self.sum_sq_table = np.zeros([num_matchups, num_offsets + 1], dtype=np.float64)
+        self.count_table = np.zeros([num_matchups, num_offsets + 1], dtype=np.int64)
+        self.shift = np.zeros(num_matchups, dtype=np.float64)
+
+        exact = np.issubdtype(data.dtype, np.integer)
+        accumulate_rings(data, data.dtype.type(fill_value), exact, center_y, center_x, self.sum_table, self.sum_sq_table, self.count_table, self.shift)
+
+    def get_num_valid(self, length):
+        return self.count_table[:, self._get_table_index(length)]
+
+    def get_num_invalid(self, length):
+        index = self._get_table_index(length)
+        return self.num_pixels[index] - self.count_table[:, index]
+
+    def get_mean(self, length):
+        index = self._get_table_index(length)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.shift + self.sum_table[:, index] / self.count_table[:, index]
+
+    def get_variance(self, length):
+        # population variance, as np.nanvar
+        index = self._get_table_index(length)
+        count = self.count_table[:, index]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum_table[:, index] / count
+            variance = self.sum_sq_table[:, index] / count - mean * mean
+        return np.maximum(variance, 0.0)
+
+    def get_std_dev(self, length):
+        # population standard deviation, as np.nanstd
+        return np.sqrt(self.get_variance(length))
+
+    def _get_table_index(self, length):
+        # windows larger than the subset are clipped at its border
+        index = int(np.floor(length / 2)) + 1
+        return min(index, self.sum_table.shape[1] - 1)
+
+
+@jit(nopython=True, cache=True)
+def accumulate_rings(data, fill_value, exact, center_y, center_x, sum_table, sum_sq_table, count_table, shift):
+    # column k + 1 of the tables receives the sums over the centred window with offset k
+    for n in range(data.shape[0]):
+        center_value = data[n, center_y, center_x]
+        # values are shifted by the centre pixel to avoid cancellation in the variance
+        if is_invalid(center_value, fill_value, exact):
+            shift[n] = 0.0
+        else:
+            shift[n] = center_value
+
+        for y in range(data.shape[1]):
+            for x in range(data.shape[2]):
+                value = data[n, y, x]
+                if is_invalid(value, fill_value, exact):
+                    continue
+
+                ring = max(abs(y - center_y), abs(x - center_x)) + 1
+                shifted = value - shift[n]
+                sum_table[n, ring] += shifted
+                sum_sq_table[n, ring] += shifted * shifted
+                count_table[n, ring] += 1
+
+        for ring in range(1, sum_table.shape[1]):
+            sum_table[n, ring] += sum_table[n, ring - 1]
+            sum_sq_table[n, ring] += sum_sq_table[n, ring - 1]
+            count_table[n, ring] += count_table[n, ring - 1]
+
+
+@jit(nopython=True, cache=True)
+def is_invalid(value, fill_value, exact):
+    # integer data are compared exactly, float data with the tolerance of the scalar masking and NaN
+    if exact:
+        return value == fill_value
+
+    return abs(value - fill_value) < 1e-9 or np.isnan(value)
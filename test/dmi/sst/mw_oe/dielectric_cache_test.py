@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from dmi.sst.mw_oe.dielectric_cache import DielectricCache
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+
+
+class DielectricCacheTest(unittest.TestCase):
+    fw_model = None
+
+    def setUp(self):
+        self.fw_model = FwModel()
+
+    def test_get(self):
+        cache = DielectricCache(self.fw_model)
+        context = create_geometry_context(55.19, 35.0, 78.1866134486559)
+
+        [epsilon, sqrt_eps_thet] = cache.get(301.679042997567, 35.0, 55.19, context)
+        [expected_epsilon, expected_sqrt_eps_thet] = self.fw_model.calc_dielectric(301.679042997567, 35.0, context)
+        np.testing.assert_array_equal(expected_epsilon, epsilon)
+        np.testing.assert_array_equal(expected_sqrt_eps_thet, sqrt_eps_thet)
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        [epsilon_cached, _] = cache.get(301.679042997567, 35.0, 55.19, context)
+        self.assertIs(epsilon, epsilon_cached)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        cache.get(301.68, 35.0, 55.19, context)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    def test_get_evicts_oldest(self):
+        cache = DielectricCache(self.fw_model, max_size=2)
+        context = create_geometry_context(55.0, 35.0, 10.0)
+
+        cache.get(290.0, 35.0, 55.0, context)
+        cache.get(291.0, 35.0, 55.0, context)
+        cache.get(292.0, 35.0, 55.0, context)
+        self.assertEqual(2, len(cache.entries))
+
+        cache.get(292.0, 35.0, 55.0, context)
+        self.assertEqual(1, cache.hits)
+        cache.get(290.0, 35.0, 55.0, context)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(4, cache.misses)
+
+    def test_clear(self):
+        cache = DielectricCache(self.fw_model)
+        context = create_geometry_context(55.0, 35.0, 10.0)
+
+        cache.get(290.0, 35.0, 55.0, context)
+        cache.clear()
+        cache.get(290.0, 35.0, 55.0, context)
+
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(2, cache.misses)
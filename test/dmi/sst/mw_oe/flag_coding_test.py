@@ -16,11 +16,11 @@ class FlagCodingTest(unittest.TestCase):
 
     def test_get_flag_masks(self):
         masks = FlagCoding.get_flag_masks()
-        self.assertEqual("1,2,4,8,16,32,64,128,256,512,1024,2048,4096", masks)
+        self.assertEqual("1,2,4,8,16,32,64,128,256,512,1024,2048,4096,8192", masks)
 
     def test_get_flag_meanings(self):
         masks = FlagCoding.get_flag_meanings()
-        self.assertEqual("avg_inv_thresh amsre_flag bt_out_of_range ws_out_of_range inv_geolocation sza_out_of_range sst_out_of_range bt_pol_test_failed inv_file_name rfi_possible diurnal_warming rain_possible std_dev_too_high", masks)
+        self.assertEqual("avg_inv_thresh amsre_flag bt_out_of_range ws_out_of_range inv_geolocation sza_out_of_range sst_out_of_range bt_pol_test_failed inv_file_name rfi_possible diurnal_warming rain_possible std_dev_too_high retrieval_diverged", masks)
 
     def test_get_flags_initial(self):
         flags = self.flag_coding.get_flags()
@@ -198,4 +198,17 @@ class FlagCodingTest(unittest.TestCase):
         self.assertEqual(4096, flags[17])
         self.assertEqual(4096, flags[31])
 
+    def test_add_retrieval_diverged(self):
+        tags = np.zeros(NUM_SAMPLES, dtype=np.bool)
+        tags[18] = True
+        tags[32] = True
+
+        self.flag_coding.add_retrieval_diverged(tags)
+
+        flags = self.flag_coding.get_flags()
+        self.assertEqual(0, flags[17])
+        self.assertEqual(0, flags[19])
+        self.assertEqual(8192, flags[18])
+        self.assertEqual(8192, flags[32])
+
     # @todo 2 tb/tb add tests for flag combinations 2017-12-08
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from numba import jit
+
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_kernel import run_open_water, create_dielectric_buffer
+from dmi.sst.mw_oe.fw_model_lut import FwModelLut
+
+NUM_CALLS = 20000
+
+
+@jit(nopython=True)
+def _run_open_water_repeatedly(num_calls, W, V, L, T_ow, theta_d, sss, context, dielectric, T_B):
+    # calls from nopython code, as in the retrieval kernel, exclude the Python dispatch overhead
+    for i in range(num_calls):
+        run_open_water(W + i * 1e-6, V, L, T_ow, theta_d, sss, context, dielectric, T_B)
+
+
+# benchmarks are not part of the unit-test suite, run explicitly with
+# python -m unittest test.dmi.sst.mw_oe.fw_model_benchmark
+class FwModelBenchmark(unittest.TestCase):
+    W = 6.00405503911681
+    V = 59.2188758850098
+    L = 0.153278715134895
+    T_OW = 301.679042997567
+    THETA_D = 55.19
+    SSS = 35.0
+    PHI_RD = 78.1866134486559
+
+    def test_latency_per_call(self):
+        fw_model = FwModel()
+        context = create_geometry_context(self.THETA_D, self.SSS, self.PHI_RD)
+        dielectric = create_dielectric_buffer()
+        T_B = np.empty(10, dtype=np.float64)
+
+        # compile and warm up
+        fw_model.run(self.W, self.V, self.L, self.T_OW, 0.0, 0.0, self.THETA_D, self.SSS, self.PHI_RD, context=context)
+        _run_open_water_repeatedly(1, self.W, self.V, self.L, self.T_OW, self.THETA_D, self.SSS, context, dielectric, T_B)
+
+        start_time = time.perf_counter()
+        for i in range(NUM_CALLS):
+            fw_model.run(self.W + i * 1e-6, self.V, self.L, self.T_OW, 0.0, 0.0, self.THETA_D, self.SSS, self.PHI_RD, context=context)
+        run_latency = (time.perf_counter() - start_time) / NUM_CALLS
+
+        start_time = time.perf_counter()
+        for i in range(NUM_CALLS):
+            run_open_water(self.W + i * 1e-6, self.V, self.L, self.T_OW, self.THETA_D, self.SSS, context, dielectric, T_B)
+        dispatched_latency = (time.perf_counter() - start_time) / NUM_CALLS
+
+        start_time = time.perf_counter()
+        _run_open_water_repeatedly(NUM_CALLS, self.W, self.V, self.L, self.T_OW, self.THETA_D, self.SSS, context, dielectric, T_B)
+        kernel_latency = (time.perf_counter() - start_time) / NUM_CALLS
+
+        print("FwModel.run                      : %9.3f us/call" % (run_latency * 1e6))
+        print("run_open_water, called from Python: %9.3f us/call" % (dispatched_latency * 1e6))
+        print("run_open_water, called nopython   : %9.3f us/call" % (kernel_latency * 1e6))
+
+        self.assertLess(kernel_latency, run_latency)
+
+    def test_lut_latency_per_call(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # built on the first call, the timed lookups run on the memory mapped table
+            lut = FwModelLut.load_or_build(os.path.join(temp_dir, "fw_model_lut.npy"))
+            fw_model = FwModel()
+            context = create_geometry_context(self.THETA_D, self.SSS, self.PHI_RD)
+
+            for name, run in [("run", "run"), ("run_with_jacobian", "run_with_jacobian")]:
+                latencies = []
+                for model in [fw_model, lut]:
+                    getattr(model, run)(self.W, self.V, self.L, self.T_OW, 0.0, 0.0, self.THETA_D, self.SSS, self.PHI_RD, context=context)
+                    start_time = time.perf_counter()
+                    for i in range(NUM_CALLS // 10):
+                        getattr(model, run)(self.W + i * 1e-4, self.V, self.L, self.T_OW, 0.0, 0.0, self.THETA_D, self.SSS, self.PHI_RD, context=context)
+                    latencies.append((time.perf_counter() - start_time) / (NUM_CALLS // 10))
+
+                print("%-18s FwModel: %9.3f us/call, FwModelLut: %9.3f us/call" % (name, latencies[0] * 1e6, latencies[1] * 1e6))
+                self.assertLess(latencies[1] * 10.0, latencies[0])
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,151 @@
+import unittest
+
+import numpy as np
+
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_cache import FwModelCache, SENSITIVITY, DISCONTINUITY
+
+
+class FwModelCacheTest(unittest.TestCase):
+    fw_model = None
+
+    def setUp(self):
+        self.fw_model = FwModel()
+
+    def test_init_steps_from_tolerance(self):
+        cache = FwModelCache(self.fw_model, tolerance=0.01)
+        self.assertAlmostEqual(0.01, cache.error_bound, 12)
+        self.assertAlmostEqual((0.01 - DISCONTINUITY) / 6.0, SENSITIVITY[2] * cache.steps[2], 12)
+
+    def test_init_steps_exceeding_tolerance(self):
+        cache = FwModelCache(self.fw_model, tolerance=0.1, steps=[0.001, 0.001, 0.0001, 0.001, 0.001, 0.1])
+        self.assertAlmostEqual(0.0327, cache.error_bound, 12)
+
+        with self.assertRaises(ValueError):
+            FwModelCache(self.fw_model, tolerance=0.01, steps=[0.001, 0.001, 0.0001, 0.001, 0.001, 0.1])
+
+        with self.assertRaises(ValueError):
+            FwModelCache(self.fw_model, steps=[0.001, 0.001])
+
+        with self.assertRaises(ValueError):
+            FwModelCache(self.fw_model, max_size=0)
+
+        with self.assertRaises(ValueError):
+            FwModelCache(self.fw_model, tolerance=DISCONTINUITY)
+
+    def test_sensitivity_bounds_fw_model(self):
+        random = np.random.RandomState(5)
+        lower = np.array([0.0, 0.0, -0.2, 268.0, 50.0, 0.0])
+        upper = np.array([30.0, 75.0, 0.6, 312.0, 60.0, 360.0])
+        points = lower + random.random_sample([5000, 6]) * (upper - lower)
+        h = np.array([1e-4, 1e-4, 1e-6, 1e-4, 1e-4, 1e-3])
+
+        for j in range(6):
+            upper_points = np.copy(points)
+            upper_points[:, j] += h[j]
+            lower_points = np.copy(points)
+            lower_points[:, j] -= h[j]
+            derivative = (self._run_batch(upper_points) - self._run_batch(lower_points)) / (2.0 * h[j])
+            self.assertLessEqual(np.max(np.abs(derivative)), SENSITIVITY[j], msg=str(j))
+
+        # the brightness temperatures are continuous apart from the switch at V = 48 mm
+        upper_points = np.copy(points)
+        upper_points[:, 1] = 48.0 + 1e-10
+        lower_points = np.copy(points)
+        lower_points[:, 1] = 48.0 - 1e-10
+        self.assertLessEqual(np.max(np.abs(self._run_batch(upper_points) - self._run_batch(lower_points))), DISCONTINUITY)
+
+    def test_run(self):
+        cache = FwModelCache(self.fw_model, tolerance=0.01)
+        context = create_geometry_context(55.19, 35.0, 78.1866134486559)
+
+        T_B = cache.run(8.16, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.1866134486559, context=context)
+        expected = self.fw_model.run(8.16, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.1866134486559, context=context)
+        np.testing.assert_array_equal(expected, T_B)
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        # same quantization cell, the relative angle is recovered from the context
+        T_B_cached = cache.run(8.16 + 1e-6, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, np.NaN, context=context)
+        np.testing.assert_array_equal(expected, T_B_cached)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+        T_B_cached[0] = 0.0
+        np.testing.assert_array_equal(expected, cache.run(8.16, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.1866134486559, context=context))
+
+        cache.run(8.2, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.1866134486559, context=context)
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    def test_run_error_within_tolerance(self):
+        cache = FwModelCache(self.fw_model, tolerance=0.05)
+        random = np.random.RandomState(11)
+        point = np.array([6.5, 31.0, 0.12, 290.2, 55.1, 140.0])
+
+        cache.run(point[0], point[1], point[2], point[3], 0.0, 0.0, point[4], 35.0, point[5])
+        for _ in range(20):
+            # a point in the same cell as the first one
+            cell_origin = np.floor(point / cache.steps) * cache.steps
+            neighbour = cell_origin + random.random_sample(6) * cache.steps
+            T_B = cache.run(neighbour[0], neighbour[1], neighbour[2], neighbour[3], 0.0, 0.0, neighbour[4], 35.0, neighbour[5])
+            expected = self.fw_model.run(neighbour[0], neighbour[1], neighbour[2], neighbour[3], 0.0, 0.0, neighbour[4], 35.0, neighbour[5])
+            self.assertLessEqual(np.max(np.abs(expected - T_B)), 0.05)
+
+        self.assertEqual(20, cache.hits)
+
+    def test_run_with_jacobian_not_cached(self):
+        cache = FwModelCache(self.fw_model)
+
+        cache.run(8.16, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.2)
+        [T_B, K] = cache.run_with_jacobian(8.16 + 1e-6, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.2)
+        [expected_T_B, expected_K] = self.fw_model.run_with_jacobian(8.16 + 1e-6, 29.3, 0.11, 301.68, 0.0, 0.0, 55.19, 35.0, 78.2)
+        np.testing.assert_array_equal(expected_T_B, T_B)
+        np.testing.assert_array_equal(expected_K, K)
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_run_with_ice_not_cached(self):
+        cache = FwModelCache(self.fw_model)
+
+        for _ in range(2):
+            T_B = cache.run(8.16, 29.3, 0.11, 271.4, 0.3, 0.5, 55.19, 35.0, 78.2)
+            np.testing.assert_array_equal(self.fw_model.run(8.16, 29.3, 0.11, 271.4, 0.3, 0.5, 55.19, 35.0, 78.2), T_B)
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(0, cache.misses)
+
+    def test_run_invalid_parameters(self):
+        cache = FwModelCache(self.fw_model)
+
+        T_B = cache.run(np.NaN, 29.3, np.inf, 301.68, 0.0, 0.0, 55.19, np.NaN, 78.2)
+        np.testing.assert_array_equal(T_B, cache.run(np.NaN, 29.3, np.inf, 301.68, 0.0, 0.0, 55.19, np.NaN, 78.2))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_run_evicts_least_recently_used(self):
+        cache = FwModelCache(self.fw_model, max_size=2)
+
+        cache.run(5.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        cache.run(6.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        cache.run(5.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        cache.run(7.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        self.assertEqual(2, len(cache.entries))
+
+        cache.run(5.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        self.assertEqual(2, cache.hits)
+        cache.run(6.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(4, cache.misses)
+
+    def test_clear(self):
+        cache = FwModelCache(self.fw_model)
+
+        cache.run(5.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+        cache.clear()
+        cache.run(5.0, 20.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)
+
+        self.assertEqual(0, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    def _run_batch(self, points):
+        return self.fw_model.run_batch(points[:, 0], points[:, 1], points[:, 2], points[:, 3], 0.0, 0.0, points[:, 4], 35.0, points[:, 5])
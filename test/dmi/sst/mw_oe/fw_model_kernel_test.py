@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_kernel import run_open_water, open_water_dielectric, open_water_brightness, create_dielectric_buffer, DIELECTRIC_EPSILON_RE, DIELECTRIC_EPSILON_IM, \
+    DIELECTRIC_SQRT_RE, DIELECTRIC_SQRT_IM
+
+
+class FwModelKernelTest(unittest.TestCase):
+    #                W                 V                 L                     T_ow              theta_d  sss     phi_rd
+    STATES = [(6.00405503911681, 59.2188758850098, 0.153278715134895, 301.679042997567, 55.19, 35.0, 78.1866134486559),
+              (9.20655470261406, 26.8414897918701, 0.210529339037996, 291.330501737802, 55.23, 34.304, 359.01513331183),
+              (16.44149177243, 51.8229067300751, -0.0104714243105632, 301.499473924529, 55.19, 34.569, 78.1866134486559),
+              (2.72486789578787, 54.0632878810604, -0.0340107990629162, 302.427070713692, 55.025, 34.783, 106.824341933135),
+              (1.5, 50.0, 0.05, 275.0, 55.1, 35.0, 200.0),  # W below both switches, V above 48 mm
+              (14.0, 5.0, 0.0, 298.0, 55.2, 35.0, 300.0)]  # W above 12 m/s, |T_S - T_V| above 20 K
+
+    fw_model = None
+
+    def setUp(self):
+        self.fw_model = FwModel()
+
+    def test_run_open_water_matches_run(self):
+        T_B = np.empty(10, dtype=np.float64)
+        dielectric = create_dielectric_buffer()
+        for (W, V, L, T_ow, theta_d, sss, phi_rd) in self.STATES:
+            run_open_water(W, V, L, T_ow, theta_d, sss, create_geometry_context(theta_d, sss, phi_rd), dielectric, T_B)
+
+            np.testing.assert_allclose(self.fw_model.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd), T_B, rtol=0.0, atol=1e-9)
+
+    def test_run_open_water_matches_run_batch_random_states(self):
+        random = np.random.RandomState(4)
+        num_states = 2000
+        W = random.uniform(0.0, 30.0, num_states)
+        V = random.uniform(0.0, 75.0, num_states)
+        L = random.uniform(-0.2, 0.6, num_states)
+        T_ow = random.uniform(268.0, 312.0, num_states)
+        theta_d = random.uniform(54.5, 55.5, num_states)
+        sss = random.uniform(30.0, 37.0, num_states)
+        phi_rd = random.uniform(0.0, 360.0, num_states)
+        context = create_geometry_context(theta_d, sss, phi_rd)
+
+        expected = self.fw_model.run_batch(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd, context=context)
+
+        T_B = np.empty(10, dtype=np.float64)
+        dielectric = create_dielectric_buffer()
+        for i in range(0, num_states):
+            run_open_water(W[i], V[i], L[i], T_ow[i], theta_d[i], sss[i], context[i], dielectric, T_B)
+            np.testing.assert_allclose(expected[i], T_B, rtol=0.0, atol=1e-9, err_msg=str(i))
+
+    def test_open_water_dielectric_matches_calc_dielectric(self):
+        dielectric = create_dielectric_buffer()
+        for (_, _, _, T_ow, theta_d, sss, phi_rd) in self.STATES:
+            context = create_geometry_context(theta_d, sss, phi_rd)
+            open_water_dielectric(T_ow, sss, context, dielectric)
+
+            [epsilon, sqrt_eps_thet] = self.fw_model.calc_dielectric(T_ow, sss, context)
+            np.testing.assert_allclose(epsilon.real, dielectric[DIELECTRIC_EPSILON_RE], rtol=1e-12)
+            np.testing.assert_allclose(epsilon.imag, dielectric[DIELECTRIC_EPSILON_IM], rtol=1e-12)
+            np.testing.assert_allclose(sqrt_eps_thet.real, dielectric[DIELECTRIC_SQRT_RE], rtol=1e-12)
+            np.testing.assert_allclose(sqrt_eps_thet.imag, dielectric[DIELECTRIC_SQRT_IM], rtol=1e-12)
+
+    def test_open_water_brightness_reuses_dielectric(self):
+        (W, V, L, T_ow, theta_d, sss, phi_rd) = self.STATES[0]
+        context = create_geometry_context(theta_d, sss, phi_rd)
+        dielectric = create_dielectric_buffer()
+        open_water_dielectric(T_ow, sss, context, dielectric)
+
+        T_B = np.empty(10, dtype=np.float64)
+        open_water_brightness(W + 0.5, V - 1.0, L, T_ow, theta_d, context, dielectric, T_B)
+
+        np.testing.assert_allclose(self.fw_model.run(W + 0.5, V - 1.0, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd), T_B, rtol=0.0, atol=1e-9)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_lut import FwModelLut
+
+# coarse grid around the test states, keeps the table build fast
+TEST_GRID = np.array([[0.0, 16.0, 17], [0.0, 75.0, 26], [-0.2, 0.6, 17], [284.0, 306.0, 12], [55.0, 55.5, 2]], dtype=np.float64)
+
+
+class FwModelLutTest(unittest.TestCase):
+    #                W                 V                 L                     T_ow              theta_d  sss     phi_rd
+    STATES = [(6.00405503911681, 59.2188758850098, 0.153278715134895, 301.679042997567, 55.19, 35.0, 78.1866134486559),
+              (9.20655470261406, 26.8414897918701, 0.210529339037996, 291.330501737802, 55.23, 35.0, 359.01513331183),
+              (2.72486789578787, 54.0632878810604, -0.0340107990629162, 302.427070713692, 55.025, 35.0, 106.824341933135)]
+
+    lut = None
+    fw_model = None
+    temp_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.lut = FwModelLut.build(grid=TEST_GRID)
+
+    def setUp(self):
+        self.fw_model = FwModel()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_run_close_to_fw_model(self):
+        for (W, V, L, T_ow, theta_d, sss, phi_rd) in self.STATES:
+            T_B = self.lut.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd)
+
+            np.testing.assert_allclose(self.fw_model.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd), T_B, rtol=0.0, atol=0.1)
+
+    def test_run_at_grid_node(self):
+        T_B = self.lut.run(7.0, 48.0, 0.1, 300.0, 0.0, 0.0, 55.5, 35.0, 45.0)
+
+        np.testing.assert_allclose(self.fw_model.run(7.0, 48.0, 0.1, 300.0, 0.0, 0.0, 55.5, 35.0, 45.0), T_B, rtol=0.0, atol=1e-3)
+
+    def test_run_with_context(self):
+        (W, V, L, T_ow, theta_d, sss, phi_rd) = self.STATES[0]
+        context = create_geometry_context(theta_d, sss, phi_rd)
+
+        np.testing.assert_array_equal(self.lut.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd), self.lut.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd, context=context))
+
+    def test_run_batch_matches_run(self):
+        params = np.array(self.STATES, dtype=np.float64).transpose()
+
+        T_B = self.lut.run_batch(params[0], params[1], params[2], params[3], 0, 0, params[4], params[5], params[6])
+
+        self.assertEqual((len(self.STATES), 10), T_B.shape)
+        for i, (W, V, L, T_ow, theta_d, sss, phi_rd) in enumerate(self.STATES):
+            np.testing.assert_allclose(self.lut.run(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd), T_B[i], rtol=0.0, atol=1e-9)
+
+    def test_run_with_jacobian(self):
+        eps = [1e-4, 1e-4, 1e-6, 1e-4]
+        for state in self.STATES:
+            [T_B, K] = self.lut.run_with_jacobian(state[0], state[1], state[2], state[3], 0.0, 0.0, state[4], state[5], state[6])
+
+            self.assertEqual((10, 4), K.shape)
+            np.testing.assert_allclose(self.lut.run(state[0], state[1], state[2], state[3], 0.0, 0.0, state[4], state[5], state[6]), T_B, rtol=0.0, atol=1e-9)
+            for k in range(0, 4):
+                perturbed = list(state)
+                perturbed[k] += eps[k]
+                T_B_pert = self.lut.run(perturbed[0], perturbed[1], perturbed[2], perturbed[3], 0.0, 0.0, perturbed[4], perturbed[5], perturbed[6])
+                np.testing.assert_allclose((T_B_pert - T_B) / eps[k], K[:, k], rtol=1e-3, atol=1e-3)
+
+    def test_run_batch_with_jacobian_matches_run_with_jacobian(self):
+        params = np.array(self.STATES, dtype=np.float64).transpose()
+
+        [T_B, K] = self.lut.run_batch_with_jacobian(params[0], params[1], params[2], params[3], 0, 0, params[4], params[5], params[6])
+
+        self.assertEqual((len(self.STATES), 10), T_B.shape)
+        self.assertEqual((len(self.STATES), 10, 4), K.shape)
+        for i, (W, V, L, T_ow, theta_d, sss, phi_rd) in enumerate(self.STATES):
+            [T_B_expected, K_expected] = self.lut.run_with_jacobian(W, V, L, T_ow, 0.0, 0.0, theta_d, sss, phi_rd)
+            np.testing.assert_allclose(T_B_expected, T_B[i], rtol=0.0, atol=1e-9)
+            np.testing.assert_allclose(K_expected, K[i], rtol=0.0, atol=1e-9)
+
+    def test_run_unsupported_salinity(self):
+        with self.assertRaises(ValueError):
+            self.lut.run(6.0, 30.0, 0.1, 290.0, 0.0, 0.0, 55.2, 34.0, 10.0)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.temp_dir, "lut.npy")
+        self.lut.save(path)
+
+        lut = FwModelLut.load(path)
+
+        self.assertIsInstance(lut.table.base, np.memmap)
+        np.testing.assert_array_equal(self.lut.table, lut.table)
+        np.testing.assert_array_equal(self.lut.origin, lut.origin)
+        np.testing.assert_array_equal(self.lut.step, lut.step)
+        self.assertEqual(35.0, lut.sss)
+
+    def test_save_and_load_without_npy_suffix(self):
+        path = os.path.join(self.temp_dir, "lut.bin")
+        self.lut.save(path)
+
+        self.assertEqual(["lut.bin", "lut_grid.npz"], sorted(os.listdir(self.temp_dir)))
+        lut = FwModelLut.load(path)
+        np.testing.assert_array_equal(self.lut.table, lut.table)
+
+        lut = FwModelLut.load_or_build(path)
+        self.assertIsInstance(lut.table.base, np.memmap)
+        np.testing.assert_array_equal(self.lut.table, lut.table)
+
+    def test_load_or_build_loads_existing_table(self):
+        path = os.path.join(self.temp_dir, "lut.npy")
+        self.lut.save(path)
+
+        lut = FwModelLut.load_or_build(path)
+
+        self.assertEqual(self.lut.table.shape, lut.table.shape)
+
+    def test_accuracy_report(self):
+        report = self.lut.accuracy_report(num_points=200)
+
+        self.assertEqual(200, report["num_points"])
+        self.assertEqual((10,), report["max_error"].shape)
+        self.assertTrue(np.all(report["rms_error"] <= report["max_error"]))
+        self.assertLess(np.max(report["max_error"]), 0.25)
@@ -2,11 +2,19 @@ import unittest
 
 import numpy as np
 
+from dmi.sst.mw_oe.dielectric_cache import DielectricCache
 from dmi.sst.mw_oe.fw_model import FwModel, create_Delta_S2, calc_F_vertical, calc_F_horizontal, calc_sig_TS_TV, calc_T_V, calc_open_water_temp, calc_ice_temp, clamp_to_0_1, \
-    calc_horizontal_polarised_BT, calc_vertical_polarised_BT
+    calc_horizontal_polarised_BT, calc_vertical_polarised_BT, create_geometry_context, CTX_SIZE, CTX_COS_THETA, CTX_BIAS_TRIG, FREQ
 
 
 class FwModelTest(unittest.TestCase):
+    #                 W                 V                 L                     T_ow              C_is F_MY  theta_d  sss     phi_rd
+    JACOBIAN_STATES = [(6.00405503911681, 59.2188758850098, 0.153278715134895, 301.679042997567, 0.0, 0.0, 55.19, 35.0, 78.1866134486559),
+                       (9.20655470261406, 26.8414897918701, 0.210529339037996, 291.330501737802, 0.0, 0.0, 55.23, 34.304, 359.01513331183),
+                       (16.44149177243, 51.8229067300751, -0.0104714243105632, 301.499473924529, 0.0, 0.0, 55.19, 34.569, 78.1866134486559),
+                       (2.72486789578787, 54.0632878810604, -0.0340107990629162, 302.427070713692, 0.0, 0.0, 55.025, 34.783, 106.824341933135),
+                       (5.0, 20.0, 0.1, 272.0, 0.3, 0.4, 55.0, 35.0, 10.0)]
+
     fw_model = None
 
     def setUp(self):
@@ -35,6 +43,196 @@ class FwModelTest(unittest.TestCase):
         self.assertAlmostEqual(238.14396039699585, T_B[8], 8)
         self.assertAlmostEqual(187.14834061640363, T_B[9], 8)
 
+    def test_run_with_jacobian_brightness_temperatures_match_run(self):
+        for state in self.JACOBIAN_STATES:
+            T_B = self.fw_model.run(*state)
+            [T_B_jac, K] = self.fw_model.run_with_jacobian(*state)
+
+            self.assertEqual((10,), T_B_jac.shape)
+            self.assertEqual((10, 4), K.shape)
+            np.testing.assert_allclose(T_B, T_B_jac, rtol=0.0, atol=1e-9)
+
+    def test_run_with_jacobian_matches_central_differences(self):
+        steps = np.array([1e-5, 1e-5, 1e-7, 1e-5])
+        for state in self.JACOBIAN_STATES:
+            [_, K] = self.fw_model.run_with_jacobian(*state)
+
+            for k in range(0, 4):
+                state_plus = list(state)
+                state_plus[k] += steps[k]
+                state_minus = list(state)
+                state_minus[k] -= steps[k]
+                K_num = (self.fw_model.run(*state_plus) - self.fw_model.run(*state_minus)) / (2.0 * steps[k])
+
+                np.testing.assert_allclose(K_num, K[:, k], rtol=0.0, atol=1e-4 * np.max(np.abs(K_num)))
+
+    def test_run_with_jacobian_matches_retrieval_finite_differences(self):
+        # the step sizes used by the retrieval to build K
+        eps = np.array([0.2, 0.1, 0.02, 0.25], dtype=np.float64)
+        for state in self.JACOBIAN_STATES:
+            [T_B, K] = self.fw_model.run_with_jacobian(*state)
+
+            for k in range(0, 4):
+                state_plus = list(state)
+                state_plus[k] += eps[k]
+                K_fd = (self.fw_model.run(*state_plus) - T_B) / eps[k]
+
+                np.testing.assert_allclose(K_fd, K[:, k], rtol=0.0, atol=0.02 * np.max(np.abs(K_fd)))
+
+    def test_run_batch_matches_run(self):
+        states = self.JACOBIAN_STATES + [(1.5, 50.0, 0.05, 275.0, 0.0, 0.0, 55.1, 35.0, 200.0),  # W below both switches, V above 48 mm
+                                         (14.0, 5.0, 0.0, 298.0, 0.0, 0.0, 55.2, 35.0, 300.0),  # W above 12 m/s, |T_S - T_V| above 20 K
+                                         (4.0, 10.0, 0.02, 274.0, 1.2, -0.5, 55.0, 35.0, 45.0)]  # ice parameters clamped, T_ow above 273.15 K
+        params = np.array(states, dtype=np.float64)
+
+        T_B = self.fw_model.run_batch(*params.transpose())
+
+        self.assertEqual((len(states), 10), T_B.shape)
+        for i, state in enumerate(states):
+            np.testing.assert_allclose(self.fw_model.run(*state), T_B[i, :], rtol=0.0, atol=1e-9)
+
+    def test_run_batch_with_jacobian_matches_run_with_jacobian(self):
+        states = self.JACOBIAN_STATES + [(1.5, 50.0, 0.05, 275.0, 0.0, 0.0, 55.1, 35.0, 200.0),  # W below both switches, V above 48 mm
+                                         (14.0, 5.0, 0.0, 298.0, 0.0, 0.0, 55.2, 35.0, 300.0),  # W above 12 m/s, |T_S - T_V| above 20 K
+                                         (20.0, 30.0, 0.1, 290.0, 0.0, 0.0, 55.0, 35.0, 10.0)]  # Delta_S2 clamped
+        params = np.array(states, dtype=np.float64)
+
+        [T_B, K] = self.fw_model.run_batch_with_jacobian(*params.transpose())
+
+        self.assertEqual((len(states), 10), T_B.shape)
+        self.assertEqual((len(states), 10, 4), K.shape)
+        for i, state in enumerate(states):
+            [T_B_expected, K_expected] = self.fw_model.run_with_jacobian(*state)
+            np.testing.assert_allclose(T_B_expected, T_B[i, :], rtol=0.0, atol=1e-9)
+            np.testing.assert_allclose(K_expected, K[i, :, :], rtol=0.0, atol=1e-9)
+
+    def test_run_batch_scalar_parameters(self):
+        W = np.array([6.00405503911681, 9.20655470261406], dtype=np.float64)
+        V = np.array([59.2188758850098, 26.8414897918701], dtype=np.float64)
+        L = np.array([0.153278715134895, 0.210529339037996], dtype=np.float64)
+        T_ow = np.array([301.679042997567, 291.330501737802], dtype=np.float64)
+        theta_d = np.array([55.19, 55.23], dtype=np.float64)
+        phi_rd = np.array([78.1866134486559, 359.01513331183], dtype=np.float64)
+
+        T_B = self.fw_model.run_batch(W, V, L, T_ow, 0, 0, theta_d, 35.0, phi_rd)
+
+        self.assertEqual((2, 10), T_B.shape)
+        self.assertAlmostEqual(174.13541100122336, T_B[0, 0], 8)
+        self.assertAlmostEqual(187.14834061640363, T_B[0, 9], 8)
+        np.testing.assert_allclose(self.fw_model.run(W[1], V[1], L[1], T_ow[1], 0.0, 0.0, theta_d[1], 35.0, phi_rd[1]), T_B[1, :], rtol=0.0, atol=1e-9)
+
+    def test_run_with_geometry_context(self):
+        for state in self.JACOBIAN_STATES:
+            context = create_geometry_context(state[6], state[7], state[8])
+
+            np.testing.assert_allclose(self.fw_model.run(*state), self.fw_model.run(*state, context=context), rtol=0.0, atol=1e-9)
+            [T_B, K] = self.fw_model.run_with_jacobian(*state)
+            [T_B_ctx, K_ctx] = self.fw_model.run_with_jacobian(*state, context=context)
+            np.testing.assert_allclose(T_B, T_B_ctx, rtol=0.0, atol=1e-9)
+            np.testing.assert_allclose(K, K_ctx, rtol=0.0, atol=1e-9)
+
+    def test_run_batch_with_geometry_context(self):
+        params = np.array(self.JACOBIAN_STATES, dtype=np.float64).transpose()
+        context = create_geometry_context(params[6], params[7], params[8])
+
+        T_B = self.fw_model.run_batch(*params, context=context)
+
+        np.testing.assert_allclose(self.fw_model.run_batch(*params), T_B, rtol=0.0, atol=1e-9)
+
+    def test_run_with_dielectric_cache(self):
+        cache = DielectricCache(self.fw_model)
+        for state in self.JACOBIAN_STATES[0:4]:
+            cache.clear()
+            perturbed = (state[0] + 0.1,) + state[1:]
+
+            np.testing.assert_array_equal(self.fw_model.run(*state), self.fw_model.run(*state, dielectric_cache=cache))
+            np.testing.assert_array_equal(self.fw_model.run(*perturbed), self.fw_model.run(*perturbed, dielectric_cache=cache))
+
+        self.assertEqual(4, cache.hits)
+        self.assertEqual(4, cache.misses)
+
+    def test_calc_dielectric_batch_matches_scalar(self):
+        params = np.array(self.JACOBIAN_STATES, dtype=np.float64).transpose()
+        context = create_geometry_context(params[6], params[7], params[8])
+
+        [epsilon, sqrt_eps_thet] = self.fw_model.calc_dielectric(params[3], params[7], context)
+
+        self.assertEqual((len(self.JACOBIAN_STATES), 5), epsilon.shape)
+        for i in range(0, len(self.JACOBIAN_STATES)):
+            [epsilon_i, sqrt_eps_thet_i] = self.fw_model.calc_dielectric(params[3, i], params[7, i], context[i])
+            np.testing.assert_allclose(epsilon_i, epsilon[i], rtol=1e-14)
+            np.testing.assert_allclose(sqrt_eps_thet_i, sqrt_eps_thet[i], rtol=1e-14)
+
+    def test_run_batch_with_dielectric(self):
+        params = np.array(self.JACOBIAN_STATES[0:4], dtype=np.float64).transpose()
+        context = create_geometry_context(params[6], params[7], params[8])
+        dielectric = self.fw_model.calc_dielectric(params[3], params[7], context)
+
+        T_B = self.fw_model.run_batch(*params, context=context, dielectric=dielectric)
+
+        np.testing.assert_allclose(self.fw_model.run_batch(*params), T_B, rtol=0.0, atol=1e-9)
+
+    def test_run_batch_matches_run_random_states(self):
+        states = _create_random_states(2000, 7)
+
+        T_B = self.fw_model.run_batch(*states.transpose())
+
+        for i, state in enumerate(states):
+            np.testing.assert_allclose(self.fw_model.run(*state), T_B[i, :], rtol=0.0, atol=1e-9, err_msg=str(state))
+
+    def test_run_with_jacobian_matches_run_random_states(self):
+        states = _create_random_states(300, 8)
+
+        for state in states:
+            [T_B, K] = self.fw_model.run_with_jacobian(*state)
+
+            np.testing.assert_allclose(self.fw_model.run(*state), T_B, rtol=0.0, atol=1e-9, err_msg=str(state))
+            self.assertEqual((10, 4), K.shape)
+
+    def test_run_batch_with_jacobian_matches_central_differences_random_states(self):
+        states = _create_random_states(2000, 9)
+        steps = np.array([1e-5, 1e-5, 1e-7, 1e-5])
+        # the model is not differentiable at its switches, states closer than the steps are left out
+        Delta_S2 = states[:, 0:1] * 5.22e-3 * np.append(1.0 - 0.00748 * np.power(37.0 - FREQ[0:4], 1.3), 1.0)
+        smooth = (np.min(np.abs(states[:, 0:1] - [3.0, 7.0, 12.0]), axis=1) > 1e-3) & (np.min(np.abs(Delta_S2 - 0.069), axis=1) > 1e-6) & (np.abs(states[:, 1] - 48.0) > 1e-3) & \
+                 (np.abs(states[:, 3] - 273.15) > 1e-3)
+
+        [_, K] = self.fw_model.run_batch_with_jacobian(*states.transpose())
+
+        for k in range(0, 4):
+            states_plus = np.copy(states)
+            states_plus[:, k] += steps[k]
+            states_minus = np.copy(states)
+            states_minus[:, k] -= steps[k]
+            K_num = (self.fw_model.run_batch(*states_plus.transpose()) - self.fw_model.run_batch(*states_minus.transpose())) / (2.0 * steps[k])
+
+            np.testing.assert_allclose(K_num[smooth], K[smooth, :, k], rtol=0.0, atol=1e-4 * np.max(np.abs(K_num)) + 1e-5, err_msg=str(k))
+
+    def test_calc_dielectric_derivative_matches_central_differences(self):
+        T_ow = np.linspace(271.0, 310.0, 40)
+        sss = np.linspace(30.0, 37.0, 40)
+        context = create_geometry_context(np.linspace(54.0, 56.0, 40), sss, 0.0)
+
+        [epsilon, sqrt_eps_thet, depsilon, dsqrt_eps_thet] = self.fw_model.calc_dielectric(T_ow, sss, context, with_derivative=True)
+
+        [expected_epsilon, expected_sqrt_eps_thet] = self.fw_model.calc_dielectric(T_ow, sss, context)
+        np.testing.assert_array_equal(expected_epsilon, epsilon)
+        np.testing.assert_array_equal(expected_sqrt_eps_thet, sqrt_eps_thet)
+        [epsilon_plus, sqrt_eps_thet_plus] = self.fw_model.calc_dielectric(T_ow + 1e-5, sss, context)
+        [epsilon_minus, sqrt_eps_thet_minus] = self.fw_model.calc_dielectric(T_ow - 1e-5, sss, context)
+        np.testing.assert_allclose((epsilon_plus - epsilon_minus) / 2e-5, depsilon, rtol=1e-6)
+        np.testing.assert_allclose((sqrt_eps_thet_plus - sqrt_eps_thet_minus) / 2e-5, dsqrt_eps_thet, rtol=1e-6)
+
+    def test_create_geometry_context(self):
+        context = create_geometry_context(55.0, 35.0, 90.0)
+        self.assertEqual((CTX_SIZE,), context.shape)
+        self.assertAlmostEqual(np.cos(np.deg2rad(55.0)), context[CTX_COS_THETA], 12)
+        self.assertAlmostEqual(0.0, context[CTX_BIAS_TRIG], 12)
+        self.assertAlmostEqual(1.0, context[CTX_BIAS_TRIG + 1], 12)
+
+        context = create_geometry_context(np.array([55.0, 55.2, 54.9]), 35.0, np.array([10.0, 20.0, 30.0]))
+        self.assertEqual((3, CTX_SIZE), context.shape)
+
     def test_run_atmosphere_T_V_is_switch(self):
         W = np.float64(9.20655470261406)
         V = np.float64(26.8414897918701)
@@ -252,3 +450,21 @@ class FwModelTest(unittest.TestCase):
         self.assertAlmostEqual(210.09393012654223, T_BH[2], 8)
         self.assertAlmostEqual(246.4076719622741, T_BH[3], 8)
         self.assertAlmostEqual(231.17052656945668, T_BH[4], 8)
+
+
+def _create_random_states(num_states, seed):
+    # states over the range of the matchups, including the switches of the model: W around 3, 7 and 12 m/s and the
+    # Delta_S2 clamp, V around 48 mm, |T_S - T_V| above 20 K, sea ice below and above 5 % and clamped ice parameters
+    random = np.random.RandomState(seed)
+    states = np.empty([num_states, 9], dtype=np.float64)
+    states[:, 0] = random.uniform(0.0, 30.0, num_states)
+    states[:, 1] = random.uniform(0.0, 75.0, num_states)
+    states[:, 2] = random.uniform(-0.2, 0.6, num_states)
+    states[:, 3] = random.uniform(265.0, 312.0, num_states)
+    with_ice = random.random_sample(num_states) < 0.3
+    states[:, 4] = np.where(with_ice, random.uniform(-0.2, 1.2, num_states), 0.0)
+    states[:, 5] = np.where(with_ice, random.uniform(-0.2, 1.2, num_states), 0.0)
+    states[:, 6] = random.uniform(54.5, 55.5, num_states)
+    states[:, 7] = random.uniform(30.0, 37.0, num_states)
+    states[:, 8] = random.uniform(0.0, 360.0, num_states)
+    return states
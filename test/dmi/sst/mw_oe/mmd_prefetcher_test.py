@@ -0,0 +1,94 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from dmi.sst.mw_oe.mmd_prefetcher import MmdPrefetcher
+from dmi.sst.mw_oe.mmd_reader import MmdReader, FILE_LOCK
+from test.dmi.test_data_utils import TestDataUtils
+
+
+class CountingMmdReader(MmdReader):
+    lock = threading.Lock()
+    open_files = 0
+    max_open_files = 0
+
+    def read(self, input_file, footprints=None, packed=False, workers=0, executor=None):
+        with CountingMmdReader.lock:
+            CountingMmdReader.open_files += 1
+            CountingMmdReader.max_open_files = max(CountingMmdReader.max_open_files, CountingMmdReader.open_files)
+        return MmdReader.read(self, input_file, footprints=footprints, packed=packed, workers=workers, executor=executor)
+
+    def close(self):
+        with CountingMmdReader.lock:
+            CountingMmdReader.open_files -= 1
+        MmdReader.close(self)
+
+
+class MmdPrefetcherTest(unittest.TestCase):
+    temp_dir = None
+    input_files = None
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_files = []
+        for index in range(0, 4):
+            input_file = os.path.join(self.temp_dir.name, "mmd_" + str(index) + ".nc")
+            TestDataUtils.write_synthetic_mmd(input_file, 3 + index, seed=index)
+            self.input_files.append(input_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_iterate_in_order(self):
+        footprints = {"amsre.brightness_temperature23V": 3}
+
+        num_files = 0
+        for [input_file, mmd_data], expected_file in zip(MmdPrefetcher(self.input_files, footprints=footprints), self.input_files):
+            self.assertEqual(expected_file, input_file)
+
+            with FILE_LOCK:
+                reader = MmdReader()
+                expected = reader.read(expected_file, footprints=footprints).load()
+                reader.close()
+            np.testing.assert_array_equal(expected["amsre.brightness_temperature23V"].values, mmd_data["amsre.brightness_temperature23V"].values)
+            np.testing.assert_array_equal(expected["amsre.nwp.skin_temperature"].values, mmd_data["amsre.nwp.skin_temperature"].values)
+            num_files += 1
+
+        self.assertEqual(4, num_files)
+
+    def test_at_most_two_files_in_flight(self):
+        CountingMmdReader.open_files = 0
+        CountingMmdReader.max_open_files = 0
+
+        with mock.patch("dmi.sst.mw_oe.mmd_prefetcher.MmdReader", CountingMmdReader):
+            for _ in MmdPrefetcher(self.input_files):
+                # a slow consumer, the reader thread has time to read further ahead
+                time.sleep(0.05)
+
+        self.assertEqual(2, CountingMmdReader.max_open_files)
+        self.assertEqual(0, CountingMmdReader.open_files)
+
+    def test_read_error_raised_in_turn(self):
+        input_files = [self.input_files[0], os.path.join(self.temp_dir.name, "missing.nc"), self.input_files[1]]
+
+        read_files = []
+        with self.assertRaises(IOError):
+            for input_file, _ in MmdPrefetcher(input_files):
+                read_files.append(input_file)
+
+        self.assertEqual([self.input_files[0]], read_files)
+
+    def test_abandoned_iteration(self):
+        CountingMmdReader.open_files = 0
+
+        with mock.patch("dmi.sst.mw_oe.mmd_prefetcher.MmdReader", CountingMmdReader):
+            for input_file, _ in MmdPrefetcher(self.input_files):
+                break
+
+        self.assertEqual(self.input_files[0], input_file)
+        self.assertEqual(0, CountingMmdReader.open_files)
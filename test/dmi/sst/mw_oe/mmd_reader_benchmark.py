@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+import unittest
+
+import xarray as xr
+
+from dmi.sst.mw_oe.mmd_reader import MmdReader
+from test.dmi.test_data_utils import TestDataUtils
+
+NUM_MATCHUPS = 50000
+WORKER_COUNTS = [0, 2, 4]
+
+
+# benchmarks are not part of the unit-test suite, run explicitly with
+# python -m unittest test.dmi.sst.mw_oe.mmd_reader_benchmark
+# the input is a compressed synthetic MMD, set MMD_BENCHMARK_FILE to measure a real one
+class MmdReaderBenchmark(unittest.TestCase):
+    temp_dir = None
+    input_file = None
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.environ.get("MMD_BENCHMARK_FILE")
+        if self.input_file is None:
+            self.input_file = os.path.join(self.temp_dir.name, "mmd_benchmark.nc")
+            TestDataUtils.write_synthetic_mmd(self.input_file, NUM_MATCHUPS, compress=True)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_time_per_variable(self):
+        reader = MmdReader()
+        reader.input_data = xr.open_dataset(self.input_file, decode_times=False)
+        try:
+            read_times = []
+            for variable_name, _ in reader._get_variable_names():
+                variable = reader.input_data.variables[variable_name]
+
+                start_time = time.perf_counter()
+                variable.values
+                read_times.append([time.perf_counter() - start_time, variable_name, variable.nbytes])
+        finally:
+            reader.close()
+
+        total_time = sum(read_time for read_time, _, _ in read_times)
+        print("read and decompression time per variable, slowest first:")
+        for read_time, variable_name, num_bytes in sorted(read_times, reverse=True):
+            print("%-42s %9.4f s %6.1f %% %10.1f MB" % (variable_name, read_time, read_time / total_time * 100.0, num_bytes / 1e6))
+        print("%-42s %9.4f s" % ("total", total_time))
+
+    def test_read_parallel(self):
+        for workers in WORKER_COUNTS:
+            reader = MmdReader()
+
+            start_time = time.perf_counter()
+            reader.read(self.input_file, workers=workers).load()
+            elapsed = time.perf_counter() - start_time
+
+            reader.close()
+            print("read with %d workers: %9.4f s" % (workers, elapsed))
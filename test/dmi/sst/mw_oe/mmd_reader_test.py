@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 
 import numpy as np
@@ -6,6 +8,7 @@ from xarray import Variable
 
 from dmi.sst.mw_oe.mmd_reader import MmdReader
 from dmi.sst.util.default_data import DefaultData
+from test.dmi.test_data_utils import TestDataUtils
 
 
 class MmdReaderTest(unittest.TestCase):
@@ -98,6 +101,13 @@ class MmdReaderTest(unittest.TestCase):
         MmdReader._add_fill_value_attributes(variable, "amsre.brightness_temperature23V")
         self.assertAlmostEqual(0.0, variable.attrs["_FillValue"], 8)
 
+    def test_add_fill_value_attributes_packed_brightness_temperature(self):
+        variable = self._create_variable(np.int16)
+        variable.attrs["OFFSET"] = 327.68
+        variable.attrs["SCALE_FACTOR"] = 0.01
+        MmdReader._add_fill_value_attributes(variable, "amsre.brightness_temperature23V", packed=True)
+        self.assertEqual(-32768, variable.attrs["_FillValue"])
+
     def test_add_fill_value_attributes_scaling_no_fill_value_int16(self):
         variable = self._create_variable(np.int16)
         variable.attrs["OFFSET"] = 0.0
@@ -116,6 +126,157 @@ class MmdReaderTest(unittest.TestCase):
         MmdReader._add_fill_value_attributes(variable, "insitu.lon")
         self.assertAlmostEqual(-32768, variable.attrs["_FillValue"], 8)
 
+    def test_select_footprint(self):
+        array = np.arange(2 * 7 * 6, dtype=np.int16).reshape(2, 7, 6)
+        variable = Variable(["matchup_count", "ny", "nx"], array)
+        variable.attrs["SCALE_FACTOR"] = 0.01
+
+        footprint = MmdReader._select_footprint(variable, 3)
+        self.assertEqual(("matchup_count", "ny_3", "nx_3"), footprint.dims)
+        np.testing.assert_array_equal(array[:, 2:5, 2:5], footprint.values)
+        self.assertEqual(0.01, footprint.attrs["SCALE_FACTOR"])
+
+        center = MmdReader._select_footprint(variable, 1)
+        self.assertEqual((2, 1, 1), center.shape)
+        np.testing.assert_array_equal(array[:, 3:4, 3:4], center.values)
+
+    def test_select_footprint_clipped_at_subset_border(self):
+        variable = Variable(["matchup_count", "ny", "nx"], np.zeros([2, 5, 21], dtype=np.float32))
+
+        footprint = MmdReader._select_footprint(variable, 21)
+        self.assertEqual(("matchup_count", "ny", "nx"), footprint.dims)
+        self.assertEqual((2, 5, 21), footprint.shape)
+
+        footprint = MmdReader._select_footprint(variable, 7)
+        self.assertEqual(("matchup_count", "ny", "nx_7"), footprint.dims)
+
+    def test_select_footprint_invalid_length(self):
+        variable = Variable(["matchup_count", "ny", "nx"], np.zeros([2, 5, 5], dtype=np.float32))
+
+        with self.assertRaises(ValueError):
+            MmdReader._select_footprint(variable, 4)
+
+        with self.assertRaises(ValueError):
+            MmdReader._select_footprint(variable, 0)
+
+    def test_select_footprint_reads_hyperslab_from_file(self):
+        array = np.arange(3 * 2 * 9 * 9, dtype=np.int16).reshape(3, 2, 9, 9)
+        dataset = xr.Dataset({"amsre.brightness_temperature23V": (["matchup_count", "levels", "ny", "nx"], array, {"SCALE_FACTOR": 0.01, "OFFSET": 327.68})})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "footprint.nc")
+            dataset.to_netcdf(file_path)
+
+            with xr.open_dataset(file_path, decode_times=False) as input_data:
+                variable = input_data.variables["amsre.brightness_temperature23V"]
+                footprint = MmdReader._select_footprint(variable, 5)
+                self.assertFalse(footprint._in_memory)
+
+                MmdReader._scale_data(footprint)
+                MmdReader._add_fill_value_attributes(footprint, "amsre.brightness_temperature23V")
+
+                np.testing.assert_allclose(array[:, :, 2:7, 2:7] * 0.01 + 327.68, footprint.values, rtol=1e-12)
+                self.assertAlmostEqual(0.0, footprint.attrs["_FillValue"], 8)
+
+    def test_iter_chunks(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "mmd.nc")
+            TestDataUtils.write_synthetic_mmd(file_path, 10)
+            footprints = {"amsre.brightness_temperature23V": 3}
+
+            reader = MmdReader()
+            expected = reader.read(file_path, footprints=footprints).load()
+            reader.close()
+
+            reader = MmdReader()
+            chunks = [chunk.load() for chunk in reader.iter_chunks(file_path, 4, footprints=footprints)]
+            reader.close()
+
+            self.assertEqual([4, 4, 2], [chunk.dims["matchup_count"] for chunk in chunks])
+            for variable_name in ["amsre.brightness_temperature23V", "amsre.brightness_temperature6H", "amsre.nwp.cloud_liquid_water", "insitu.sea_surface_temperature"]:
+                concatenated = np.concatenate([chunk[variable_name].values for chunk in chunks])
+                np.testing.assert_array_equal(expected[variable_name].values, concatenated)
+                self.assertEqual(expected[variable_name].attrs["_FillValue"], chunks[2][variable_name].attrs["_FillValue"])
+            self.assertEqual((2, 3, 3), chunks[2]["amsre.brightness_temperature23V"].shape)
+
+    def test_read_packed(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "mmd.nc")
+            TestDataUtils.write_synthetic_mmd(file_path, 4)
+
+            reader = MmdReader()
+            scaled = reader.read(file_path).load()
+            reader.close()
+
+            reader = MmdReader()
+            packed = reader.read(file_path, packed=True).load()
+            reader.close()
+
+            variable = packed["amsre.brightness_temperature10H"]
+            self.assertEqual(np.int16, variable.dtype)
+            self.assertEqual(-32768, variable.attrs["_FillValue"])
+            self.assertTrue(MmdReader.is_packed(variable))
+            np.testing.assert_allclose(scaled["amsre.brightness_temperature10H"].values, variable.values * 0.01 + 327.68, rtol=1e-12)
+
+            self.assertFalse(MmdReader.is_packed(scaled["amsre.brightness_temperature10H"]))
+            np.testing.assert_array_equal(scaled["amsre.nwp.skin_temperature"].values, packed["amsre.nwp.skin_temperature"].values)
+
+    def test_read_parallel(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "mmd.nc")
+            TestDataUtils.write_synthetic_mmd(file_path, 9, compress=True)
+            footprints = {"amsre.brightness_temperature23V": 3, "amsre.latitude": 1}
+
+            reader = MmdReader()
+            expected = reader.read(file_path, footprints=footprints).load()
+            reader.close()
+
+            reader = MmdReader()
+            parallel = reader.read(file_path, footprints=footprints, workers=2)
+            reader.close()
+            self.assertEqual(list(expected.data_vars), list(parallel.data_vars))
+            xr.testing.assert_identical(expected, parallel)
+
+            reader = MmdReader()
+            chunks = list(reader.iter_chunks(file_path, 5, footprints=footprints, packed=True, workers=2))
+            reader.close()
+            self.assertEqual(np.int16, chunks[1]["amsre.brightness_temperature23V"].dtype)
+            np.testing.assert_array_equal(expected["amsre.brightness_temperature23V"].values[5:9], chunks[1]["amsre.brightness_temperature23V"].values * 0.01 + 327.68)
+
+    def test_read_shared_executor(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = os.path.join(temp_dir, "mmd.nc")
+            TestDataUtils.write_synthetic_mmd(file_path, 9, compress=True)
+
+            reader = MmdReader()
+            expected = reader.read(file_path).load()
+            reader.close()
+
+            executor = MmdReader.create_read_executor(2)
+            try:
+                self.assertEqual("spawn", executor._mp_context.get_start_method())
+                for _ in range(2):
+                    reader = MmdReader()
+                    parallel = reader.read(file_path, workers=2, executor=executor)
+                    reader.close()
+                    xr.testing.assert_identical(expected, parallel)
+
+                # the shared executor is kept open by the reads
+                self.assertEqual(3, executor.submit(abs, -3).result())
+            finally:
+                executor.shutdown()
+
+    def test_read_invalid_number_of_workers(self):
+        reader = MmdReader()
+        with self.assertRaises(ValueError):
+            reader.read("/in/put/mmd.nc", workers=-1)
+
+        self.assertIsNone(MmdReader.create_read_executor(0))
+
+    def test_iter_chunks_invalid_size(self):
+        reader = MmdReader()
+        with self.assertRaises(ValueError):
+            next(reader.iter_chunks("/in/put/mmd.nc", 0))
+
     def _create_dataset_with_variable(self, variable_name):
         dataset = xr.Dataset()
         array = DefaultData.create_default_array(2, 2, np.int16)
@@ -1,8 +1,14 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
+import xarray as xr
 
 from dmi.sst.mw_oe.mw_oe_sst_processor import MwOeSstProcessor
+from test.dmi.test_data_utils import TestDataUtils
 
 
 class MwOeMMDProcessorTest(unittest.TestCase):
@@ -148,6 +154,177 @@ class MwOeMMDProcessorTest(unittest.TestCase):
         self.assertEqual(255, ite_index.data[5])
         self.assertEqual(255, ite_index.attrs["_FillValue"])  # @todo tb/tb request description from DMI and add 2017-10-25
 
+    def test_create_result_structure_minimal_diagnostics(self):
+        result = MwOeSstProcessor._create_result_structure(22, 5, 10, diagnostics="minimal")
+
+        self.assertEqual(["i", "A", "mu_sst", "x", "p0", "F", "y"], list(result.data_vars))
+        self.assertEqual((22, 10), result.variables["F"].shape)
+
+    def test_create_result_structure_standard_diagnostics(self):
+        result = MwOeSstProcessor._create_result_structure(22, 5, 10, diagnostics="standard")
+
+        self.assertEqual(["tb_rmse_ite0", "convergence_passed_flag", "i", "j_ite0", "A", "chisq", "mu_sst", "x", "p0", "S", "F", "y", "dtb", "ds", "dn"], list(result.data_vars))
+
     def test_create_target_file_name(self):
         target_file_name = MwOeSstProcessor._create_target_file_name("mmd6c_sst_ship-sst_amsre-aq_2010-272_2010-273.nc")
         self.assertEqual("mmd6c_sst_ship-sst_amsre-aq_2010-272_2010-273_oe-sst.nc", target_file_name)
+
+    def test_parse_cmd_line(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["-o", "/out/put", "/in/put/mmd.nc"])
+        self.assertEqual("/in/put/mmd.nc", processor.input_file)
+        self.assertEqual(["/in/put/mmd.nc"], processor.input_files)
+        self.assertEqual("/out/put", processor.output_directory)
+        self.assertEqual("batch", processor.engine)
+        self.assertEqual("full", processor.jacobian_update)
+        self.assertEqual("gauss_newton", processor.update)
+        self.assertFalse(processor.divergence_guard)
+        self.assertEqual("full", processor.diagnostics)
+        self.assertEqual("physical", processor.fw_model)
+        self.assertEqual(os.path.join("/out/put", "fw_model_lut.npy"), processor.lut_file)
+        self.assertEqual(0, processor.fw_cache_size)
+        self.assertEqual(0.001, processor.fw_cache_tolerance)
+        self.assertIsNone(processor.fw_cache_steps)
+        self.assertEqual(5, processor.averaging_length)
+        self.assertEqual(21, processor.stddev_length)
+        self.assertEqual(0, processor.chunk_size)
+        self.assertFalse(processor.packed)
+        self.assertEqual(0, processor.read_workers)
+
+    def test_import_without_numba(self):
+        # command line parsing must not load the numba kernels, numba is imported by the processing only
+        script = "import sys; import dmi.sst.mw_oe.mw_oe_sst_main; sys.exit(1 if 'numba' in sys.modules else 0)"
+        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+
+        self.assertEqual(0, subprocess.run([sys.executable, "-c", script], cwd=root_dir).returncode)
+
+    def test_parse_cmd_line_engine(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--engine", "loop", "/in/put/mmd.nc"])
+        self.assertEqual("/in/put", processor.output_directory)
+        self.assertEqual("loop", processor.engine)
+
+    def test_parse_cmd_line_jacobian_update(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--jacobian-update", "broyden", "/in/put/mmd.nc"])
+        self.assertEqual("broyden", processor.jacobian_update)
+
+    def test_parse_cmd_line_damped_update(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--update", "levenberg_marquardt", "--divergence-guard", "/in/put/mmd.nc"])
+        self.assertEqual("levenberg_marquardt", processor.update)
+        self.assertTrue(processor.divergence_guard)
+
+    def test_parse_cmd_line_fw_model(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--fw-model", "lut", "--lut-file", "/data/lut.npy", "/in/put/mmd.nc"])
+        self.assertEqual("lut", processor.fw_model)
+        self.assertEqual("/data/lut.npy", processor.lut_file)
+
+    def test_parse_cmd_line_fw_model_cache(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--fw-cache-size", "50000", "--fw-cache-tolerance", "0.01", "--fw-cache-steps", "0.001", "0.001", "1e-5", "0.001", "0.001", "0.1", "/in/put/mmd.nc"])
+        self.assertEqual(50000, processor.fw_cache_size)
+        self.assertEqual(0.01, processor.fw_cache_tolerance)
+        self.assertEqual([0.001, 0.001, 1e-5, 0.001, 0.001, 0.1], processor.fw_cache_steps)
+
+    def test_parse_cmd_line_window_lengths(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--averaging-length", "3", "--stddev-length", "11", "/in/put/mmd.nc"])
+        self.assertEqual(3, processor.averaging_length)
+        self.assertEqual(11, processor.stddev_length)
+
+    def test_parse_cmd_line_diagnostics(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--diagnostics", "minimal", "/in/put/mmd.nc"])
+        self.assertEqual("minimal", processor.diagnostics)
+
+    def test_parse_cmd_line_chunk_size(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--chunk-size", "50000", "/in/put/mmd.nc"])
+        self.assertEqual(50000, processor.chunk_size)
+
+    def test_parse_cmd_line_packed(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--packed", "/in/put/mmd.nc"])
+        self.assertTrue(processor.packed)
+
+    def test_parse_cmd_line_input_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for file_name in ["mmd_2010-273.nc", "mmd_2010-272.nc", "other.nc"]:
+                open(os.path.join(temp_dir, file_name), "w").close()
+
+            processor = MwOeSstProcessor()
+            processor.parse_cmd_line(["/in/put/first.nc", os.path.join(temp_dir, "mmd_*.nc")])
+            self.assertEqual(["/in/put/first.nc", os.path.join(temp_dir, "mmd_2010-272.nc"), os.path.join(temp_dir, "mmd_2010-273.nc")], processor.input_files)
+            self.assertEqual("/in/put/first.nc", processor.input_file)
+            self.assertEqual("/in/put", processor.output_directory)
+
+            with self.assertRaises(SystemExit):
+                processor.parse_cmd_line([os.path.join(temp_dir, "missing_*.nc")])
+
+    def test_parse_cmd_line_read_workers(self):
+        processor = MwOeSstProcessor()
+        processor.parse_cmd_line(["--read-workers", "4", "/in/put/mmd.nc"])
+        self.assertEqual(4, processor.read_workers)
+
+    def test_append_result_data(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = MwOeSstProcessor()
+            results = MwOeSstProcessor._create_result_structure(3, 5, 10, diagnostics="minimal")
+            results["i"].data[:] = 2
+            processor._write_result_data(temp_dir, "mmd.nc", results, unlimited_dims=["matchup"])
+
+            results = MwOeSstProcessor._create_result_structure(2, 5, 10, diagnostics="minimal")
+            results["i"].data[:] = 4
+            results["x"].data[1, 2] = 0.5
+            target_path = os.path.join(temp_dir, "mmd_oe-sst.nc")
+            MwOeSstProcessor._append_result_data(target_path, results)
+            MwOeSstProcessor._set_global_attribute(target_path, "forward_model_evaluations", np.int64(17))
+
+            with xr.open_dataset(target_path) as target_data:
+                self.assertEqual(5, target_data.dims["matchup"])
+                np.testing.assert_array_equal([2, 2, 2, 4, 4], target_data["i"].values)
+                self.assertAlmostEqual(0.5, target_data["x"].values[4, 2], 7)
+                self.assertTrue(np.isnan(target_data["x"].values[4, 1]))
+                self.assertEqual(17, target_data.attrs["forward_model_evaluations"])
+
+    def test_run_chunked(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "mmd.nc")
+            TestDataUtils.write_synthetic_mmd(input_file, 12)
+            target_path = os.path.join(temp_dir, "mmd_oe-sst.nc")
+
+            MwOeSstProcessor().run(["-o", temp_dir, "--diagnostics", "minimal", input_file])
+            with xr.open_dataset(target_path) as target_data:
+                expected = target_data.load()
+
+            MwOeSstProcessor().run(["-o", temp_dir, "--diagnostics", "minimal", "--chunk-size", "5", input_file])
+            with xr.open_dataset(target_path) as target_data:
+                self.assertEqual(12, target_data.dims["matchup"])
+                self.assertEqual(expected.attrs["forward_model_evaluations"], target_data.attrs["forward_model_evaluations"])
+                np.testing.assert_array_equal(expected["flags"].values, target_data["flags"].values)
+                np.testing.assert_array_equal(expected["i"].values, target_data["i"].values)
+                np.testing.assert_allclose(expected["x"].values, target_data["x"].values, rtol=1e-6)
+                np.testing.assert_allclose(expected["F"].values, target_data["F"].values, rtol=1e-6)
+
+    def test_run_multiple_input_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_files = []
+            for index in range(0, 3):
+                input_file = os.path.join(temp_dir, "mmd_" + str(index) + ".nc")
+                TestDataUtils.write_synthetic_mmd(input_file, 4 + index, seed=index)
+                input_files.append(input_file)
+
+            MwOeSstProcessor().run(["-o", temp_dir, "--diagnostics", "minimal", os.path.join(temp_dir, "mmd_*.nc")])
+
+            for index in range(0, 3):
+                target_path = os.path.join(temp_dir, "mmd_" + str(index) + "_oe-sst.nc")
+                with xr.open_dataset(target_path) as target_data:
+                    self.assertEqual(4 + index, target_data.dims["matchup"])
+                    prefetched = target_data.load()
+
+                MwOeSstProcessor().run(["-o", temp_dir, "--diagnostics", "minimal", input_files[index]])
+                with xr.open_dataset(target_path) as target_data:
+                    np.testing.assert_array_equal(target_data["flags"].values, prefetched["flags"].values)
+                    np.testing.assert_array_equal(target_data["x"].values, prefetched["x"].values)
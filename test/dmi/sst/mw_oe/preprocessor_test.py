@@ -149,6 +149,56 @@ class PreprocessorTest(unittest.TestCase):
     #     flags = flag_coding.get_flags()
     #     self.assertEqual(1, flags[0])
 
+    def test_average_subset(self):
+        fill_value = -79
+
+        data = DefaultData.create_default_array_3d(7, 7, 3, np.float32)
+        data[:, :, :] = 100.0
+        data[:, 3, 3] = 110.0
+        data[0, 1, 1] = fill_value
+        data[0, 5, 5] = np.NaN
+        data[0, 0, 0] = fill_value  # outside of the 5x5 window
+        data[1, 2, 1:5] = fill_value
+        data[2, 2:5, 2] = fill_value
+        variable = Variable(["matchup_count", "ny", "nx"], data)
+        variable.attrs["_FillValue"] = fill_value
+        self.dataset["amsre.brightness_temperature6V"] = variable
+
+        flag_coding = FlagCoding(3)
+        preprocessed_data = xr.Dataset()
+        self.preprocessor.average_subset(self.dataset, preprocessed_data, "amsre.brightness_temperature6V", flag_coding)
+
+        variable = preprocessed_data.variables["amsre.brightness_temperature6V"]
+        self.assertEqual((3,), variable.shape)
+        self.assertAlmostEqual(100.434783, variable.data[0], 5)
+        self.assertAlmostEqual(fill_value, variable.data[1], 7)
+        self.assertAlmostEqual(100.454545, variable.data[2], 5)
+
+        flags = flag_coding.get_flags()
+        np.testing.assert_array_equal([0, 1, 0], flags)
+
+    def test_calc_std_dev_window_length(self):
+        data = DefaultData.create_default_array_3d(21, 21, 2, np.float32)
+        for x in range(0, 21):
+            for y in range(0, 21):
+                data[:, y, x] = x + y
+        variable = Variable(["matchup_count", "ny", "nx"], data)
+        variable.attrs["_FillValue"] = -81
+        self.dataset["amsre.brightness_temperature36V"] = variable
+
+        preprocessed_data = xr.Dataset()
+        Preprocessor(stddev_length=3).calc_std_dev(self.dataset, preprocessed_data, "amsre.brightness_temperature36V")
+
+        variable = preprocessed_data.variables["amsre.brightness_temperature36V_stddev"]
+        self.assertAlmostEqual(1.1547005, variable.data[0], 6)
+
+    def test_init_invalid_window_length(self):
+        with self.assertRaises(ValueError):
+            Preprocessor(averaging_length=4)
+
+        with self.assertRaises(ValueError):
+            Preprocessor(stddev_length=0)
+
     def test_run_total_column_water_vapour(self):
         self.dataset = xr.Dataset()
 
@@ -225,6 +275,17 @@ class PreprocessorTest(unittest.TestCase):
         self.assertTrue(variable.data[3])
         self.assertFalse(variable.data[4])
 
+    def test_extract_ascending_descending_repeated_filenames(self):
+        data = ["AMSR_E_L2A_BrightnessTemperatures_V12_200807110947_D.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_200807110947_D.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_200807112208_A.hdf",
+                "AMSR_E_ohlala_something_is_wrong_here.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_200807110947_D.hdf"]
+        self.dataset["amsre.l2a_filename"] = Variable(["matchup_count"], data)
+
+        flag_coding = FlagCoding(5)
+        prep_data = self.preprocessor.run(self.dataset, flag_coding=flag_coding)
+
+        np.testing.assert_array_equal([False, False, True, False, False], prep_data.variables["amsre.ascending"].data)
+        np.testing.assert_array_equal([0, 0, 0, 256, 0], flag_coding.get_flags())
+
     def test_extract_ascending_descending_corrupt_filename(self):
         data = ["AMSR_E_L2A_BrightnessTemperatures_V12_200807110947_D.hdf", "AMSR_E_ohlala_something_is_wrong_here.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_200807112208_A.hdf",
                 "AMSR_E_L2A_BrightnessTemperatures_V12_200807111215_A.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_200807112258_D.hdf"]
@@ -268,6 +329,32 @@ class PreprocessorTest(unittest.TestCase):
         flags = flag_coding.get_flags()
         self.assertEqual(0, flags[0])
 
+    def test_run_stddev_variables_packed(self):
+        packed = np.zeros([5, 21, 21], dtype=np.int16)
+        for x in range(0, 21):
+            for y in range(0, 21):
+                packed[:, y, x] = -10000 + (x + y) * 23
+        packed[:, 10, 10] = -32768
+        packed[1, 3:19, 3:19] = -32768
+
+        variable = Variable(["matchup_count", "ny", "nx"], packed)
+        variable.attrs["SCALE_FACTOR"] = 0.01
+        variable.attrs["OFFSET"] = 327.68
+        variable.attrs["_FillValue"] = -32768
+        self.dataset["amsre.brightness_temperature36V"] = variable
+        packed_data = self.preprocessor.run(self.dataset, flag_coding=FlagCoding(5))
+
+        variable = Variable(["matchup_count", "ny", "nx"], packed * 0.01 + 327.68)
+        variable.attrs["_FillValue"] = -32768 * 0.01 + 327.68
+        self.dataset["amsre.brightness_temperature36V"] = variable
+        scaled_data = self.preprocessor.run(self.dataset, flag_coding=FlagCoding(5))
+
+        for variable_name in ["amsre.brightness_temperature36V", "amsre.brightness_temperature36V_stddev"]:
+            np.testing.assert_allclose(scaled_data.variables[variable_name].data, packed_data.variables[variable_name].data, rtol=1e-6)
+        self.assertAlmostEqual(1.9718392, packed_data.variables["amsre.brightness_temperature36V_stddev"].data[0], 6)
+        self.assertAlmostEqual(0.0, packed_data.variables["amsre.brightness_temperature36V_stddev"].data[1], 8)
+        self.assertAlmostEqual(0.0, packed_data.variables["amsre.brightness_temperature36V"].data[1], 8)
+
     def test_run_stddev_variables_masks_fill_value(self):
         data = DefaultData.create_default_array_3d(21, 21, 5, np.float32)
         for x in range(0, 21):
@@ -319,6 +406,16 @@ class PreprocessorTest(unittest.TestCase):
         flags = flag_coding.get_flags()
         self.assertEqual(1, flags[1])
 
+    def test_get_footprints(self):
+        preprocessor = Preprocessor(averaging_length=3, stddev_length=11)
+
+        footprints = preprocessor.get_footprints()
+        self.assertEqual(1, footprints["amsre.latitude"])
+        self.assertEqual(1, footprints["amsre.nwp.10m_north_wind_component"])
+        self.assertEqual(1, footprints["amsre.brightness_temperature6V"])
+        self.assertEqual(11, footprints["amsre.brightness_temperature36H"])
+        self.assertNotIn("insitu.sea_surface_temperature", footprints)
+
     def test_calculate_rlative_angle(self):
         phi_sat = np.float32([-79.92, 14.84, -160.4, -164.43, 10.1600, 132.75])
         north_wind = np.float32([1.147087, 9.204754, 4.513235, -0.228445, 4.386336, -2.5637])
@@ -330,3 +427,7 @@ class PreprocessorTest(unittest.TestCase):
         for i in range(0, len(phi_sat)):
             phi_rel = self.preprocessor.calculate_relative_angle(phi_sat[i], north_wind[i], east_wind[i])
             self.assertAlmostEqual(expecetd[i], phi_rel, 4)
+
+        phi_rel = self.preprocessor.calculate_relative_angle(phi_sat, north_wind, east_wind)
+        self.assertEqual((6,), phi_rel.shape)
+        np.testing.assert_allclose(expecetd, phi_rel, atol=1e-4)
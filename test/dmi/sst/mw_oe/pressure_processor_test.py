@@ -35,3 +35,17 @@ class PreprocessorTest(unittest.TestCase):
         self.assertAlmostEqual(np.float64(3797.5745), pressure_levels.data[2, 42], 4)
         self.assertAlmostEqual(np.float64(2572.1658), pressure_levels.data[2, 49], 4)
         self.assertAlmostEqual(np.float64(240.33505), pressure_levels.data[2, 59], 5)
+
+    def test_integrate_levels(self):
+        sea_level_pressure = np.float32([101592.46875, 101585.5859375, 101407.1953125])
+        level_data = np.random.RandomState(5).random_sample([3, 60]).astype(np.float32)
+        level_data[2, 17] = np.NaN
+
+        processor = PressureProcessor()
+        pressure_levels = processor.calculate_pressure_levels(sea_level_pressure)
+        expected = np.sum(level_data.astype(np.float64) * pressure_levels, axis=1)
+
+        column = processor.integrate_levels(sea_level_pressure, level_data)
+        self.assertEqual((3,), column.shape)
+        np.testing.assert_allclose(expected[0:2], column[0:2], rtol=1e-6)
+        self.assertTrue(np.isnan(column[2]))
@@ -0,0 +1,79 @@
+import time
+import unittest
+
+import numpy as np
+import xarray as xr
+from xarray import Variable
+
+from dmi.sst.mw_oe.flag_coding import FlagCoding
+from dmi.sst.mw_oe.mw_oe_sst_processor import MwOeSstProcessor
+from dmi.sst.mw_oe.retrieval import Retrieval
+from dmi.sst.mw_oe.retrieval_input import RetrievalInput
+
+MATCHUP_COUNTS = [1000, 10000, 100000]
+
+
+# benchmarks are not part of the unit-test suite, run explicitly with
+# python -m unittest test.dmi.sst.mw_oe.retrieval_benchmark
+class RetrievalBenchmark(unittest.TestCase):
+    BT_VARIABLE_NAMES = ["amsre.brightness_temperature6V", "amsre.brightness_temperature6H", "amsre.brightness_temperature10V", "amsre.brightness_temperature10H", "amsre.brightness_temperature18V",
+                         "amsre.brightness_temperature18H", "amsre.brightness_temperature23V", "amsre.brightness_temperature23H", "amsre.brightness_temperature36V", "amsre.brightness_temperature36H"]
+
+    BT_VALUES = np.array([[176.4254, 90.9698, 181.49, 98.8989, 212.9936, 153.7084, 250.0724, 219.4987, 232.129, 183.7511],
+                          [169.4794, 86.6282, 174.48, 93.5897, 199.0224, 133.4428, 226.9596, 184.0727, 220.8774, 167.1675],
+                          [169.3118, 82.611, 173.5316, 86.9333, 192.7028, 115.918, 215.15, 153.9983, 217.5726, 151.3251]], dtype=np.float64)
+
+    def test_scaling_retrieval_input(self):
+        times_per_matchup = []
+        for num_matchups in MATCHUP_COUNTS:
+            dataset = self._create_dataset(num_matchups)
+
+            start_time = time.perf_counter()
+            RetrievalInput(dataset)
+            elapsed = time.perf_counter() - start_time
+
+            times_per_matchup.append(elapsed / num_matchups)
+            print("retrieval input block - %7d matchups: %9.4f s, %8.3f us/matchup" % (num_matchups, elapsed, elapsed / num_matchups * 1e6))
+
+        # the block is built once, cost per matchup must not grow with the number of matchups
+        self.assertLess(times_per_matchup[-1], times_per_matchup[0] * 2.0 + 1e-6)
+
+    def test_scaling_retrieval_loop_engine(self):
+        self._run_scaling(Retrieval(engine="loop"))
+
+    def test_scaling_retrieval_batch_engine(self):
+        self._run_scaling(Retrieval(engine="batch"))
+
+    def _run_scaling(self, retrieval):
+        retrieval.maxit = 1
+
+        times_per_matchup = []
+        for num_matchups in MATCHUP_COUNTS:
+            dataset = self._create_dataset(num_matchups)
+            results = MwOeSstProcessor._create_result_structure(num_matchups, retrieval.maxit, 10)
+
+            start_time = time.perf_counter()
+            retrieval.run(dataset, results, FlagCoding(num_matchups))
+            elapsed = time.perf_counter() - start_time
+
+            times_per_matchup.append(elapsed / num_matchups)
+            print("retrieval engine %-6s - %7d matchups: %9.4f s, %8.3f us/matchup" % (retrieval.engine, num_matchups, elapsed, elapsed / num_matchups * 1e6))
+
+        # linear behaviour: the time per matchup stays (roughly) constant
+        self.assertLess(times_per_matchup[-1], times_per_matchup[0] * 2.0)
+
+    def _create_dataset(self, num_matchups):
+        indices = np.arange(num_matchups) % 3
+
+        dataset = xr.Dataset()
+        for i in range(0, len(self.BT_VARIABLE_NAMES)):
+            dataset[self.BT_VARIABLE_NAMES[i]] = Variable(["matchup_count"], self.BT_VALUES[indices, i])
+
+        dataset["amsre.nwp.abs_wind_speed"] = Variable(["matchup_count"], np.array([6.00405503911681, 9.20655470261406, 5.10105703955726])[indices])
+        dataset["amsre.nwp.total_column_water_vapour"] = Variable(["matchup_count"], np.array([59.2188758850098, 26.8414897918701, 14.3991870880127])[indices])
+        dataset["amsre.nwp.total_column_liquid_water"] = Variable(["matchup_count"], np.array([0.153278715134895, 0.210529339037996, 0.00125914319133341])[indices])
+        dataset["amsre.nwp.sea_surface_temperature"] = Variable(["matchup_count"], np.array([28.529042997567, 18.180501737802, 21.908376493661])[indices])
+        dataset["amsre.satellite_zenith_angle"] = Variable(["matchup_count"], np.array([55.19, 55.23, 55.2])[indices])
+        dataset["relative_angle"] = Variable(["matchup_count"], np.array([78.1866134486559, 359.01513331183, 26.1734235301682])[indices])
+        dataset = dataset.assign_coords(matchup_count=np.arange(num_matchups))
+        return dataset
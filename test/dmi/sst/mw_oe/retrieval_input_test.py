@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+import xarray as xr
+from xarray import Variable
+
+from dmi.sst.mw_oe.retrieval_input import RetrievalInput
+from dmi.sst.util.default_data import DefaultData
+
+
+class RetrievalInputTest(unittest.TestCase):
+    BT_VARIABLE_NAMES = ["amsre.brightness_temperature6V", "amsre.brightness_temperature6H", "amsre.brightness_temperature10V", "amsre.brightness_temperature10H", "amsre.brightness_temperature18V",
+                         "amsre.brightness_temperature18H", "amsre.brightness_temperature23V", "amsre.brightness_temperature23H", "amsre.brightness_temperature36V", "amsre.brightness_temperature36H"]
+
+    def test_create(self):
+        dataset = xr.Dataset()
+        for i in range(0, len(self.BT_VARIABLE_NAMES)):
+            data = DefaultData.create_default_vector(7, np.float32, fill_value=100 + i)
+            dataset[self.BT_VARIABLE_NAMES[i]] = Variable(["matchup_count"], data)
+
+        dataset["amsre.nwp.abs_wind_speed"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float32, fill_value=6.5))
+        dataset["amsre.nwp.total_column_water_vapour"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float32, fill_value=34.0))
+        dataset["amsre.nwp.total_column_liquid_water"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float64, fill_value=0.12))
+        dataset["amsre.nwp.sea_surface_temperature"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float32, fill_value=18.5))
+        dataset["amsre.satellite_zenith_angle"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float32, fill_value=55.25))
+        dataset["relative_angle"] = Variable(["matchup_count"], DefaultData.create_default_vector(7, np.float32, fill_value=123.5))
+
+        retrieval_input = RetrievalInput(dataset)
+
+        self.assertEqual(7, retrieval_input.get_num_matchups())
+        self.assertEqual(np.float64, retrieval_input.ws.dtype)
+        self.assertAlmostEqual(6.5, retrieval_input.ws[3], 8)
+        self.assertAlmostEqual(34.0, retrieval_input.tcwv[4], 8)
+        self.assertAlmostEqual(0.12, retrieval_input.tclw[5], 8)
+        self.assertAlmostEqual(18.5, retrieval_input.sst[6], 8)
+        self.assertAlmostEqual(55.25, retrieval_input.sza[0], 8)
+        self.assertAlmostEqual(123.5, retrieval_input.phi_rd[1], 8)
+
+        self.assertEqual((7, 10), retrieval_input.T_A.shape)
+        self.assertEqual(np.float64, retrieval_input.T_A.dtype)
+        self.assertTrue(retrieval_input.T_A.flags["C_CONTIGUOUS"])
+        self.assertAlmostEqual(100.0, retrieval_input.T_A[2, 0], 8)
+        self.assertAlmostEqual(109.0, retrieval_input.T_A[2, 9], 8)
@@ -1,12 +1,21 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
 import xarray as xr
 from xarray import Variable
 
+from dmi.sst.mw_oe import retrieval_kernel
 from dmi.sst.mw_oe.flag_coding import FlagCoding
+from dmi.sst.mw_oe.fw_model import create_geometry_context
+from dmi.sst.mw_oe.fw_model_lut import FwModelLut
 from dmi.sst.mw_oe.mw_oe_sst_processor import MwOeSstProcessor
 from dmi.sst.mw_oe.retrieval import Retrieval
+from dmi.sst.mw_oe.retrieval_input import RetrievalInput
 from dmi.sst.util.default_data import DefaultData
 
 
@@ -157,6 +166,308 @@ class RetrievalTest(unittest.TestCase):
         self.assertEqual(3, result.ite_index.data[1])
         self.assertEqual(3, result.ite_index.data[2])
 
+    def test_run_batch_engine_matches_loop_engine(self):
+        dataset = self._create_retrieval_input()
+        flag_coding = FlagCoding(3)
+        flag_coding.add_amsre_flag(np.array([False, True, False]))
+
+        loop_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="loop").run(dataset, loop_result, flag_coding)
+
+        batch_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="batch").run(dataset, batch_result, flag_coding)
+
+        for variable_name in loop_result.data_vars:
+            np.testing.assert_allclose(loop_result[variable_name].data, batch_result[variable_name].data, rtol=1e-5, atol=1e-6, err_msg=variable_name)
+
+        self.assertTrue(np.isnan(batch_result.x.data[1, 0]))
+        self.assertEqual(255, batch_result.i.data[1])
+
+    def test_run_numba_engine_matches_loop_engine(self):
+        dataset = self._create_retrieval_input()
+        flag_coding = FlagCoding(3)
+        flag_coding.add_amsre_flag(np.array([False, False, True]))
+
+        loop_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="loop").run(dataset, loop_result, flag_coding)
+
+        numba_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="numba").run(dataset, numba_result, flag_coding)
+
+        for variable_name in loop_result.data_vars:
+            np.testing.assert_allclose(loop_result[variable_name].data, numba_result[variable_name].data, rtol=1e-5, atol=1e-6, err_msg=variable_name)
+
+        self.assertTrue(np.isnan(numba_result.x.data[2, 0]))
+        self.assertEqual(255, numba_result.i.data[2])
+
+    def test_init_numba_engine_analytic_jacobian(self):
+        with self.assertRaises(ValueError):
+            Retrieval(engine="numba", jacobian="analytic")
+
+    def test_run_analytic_jacobian(self):
+        dataset = self._create_retrieval_input()
+
+        fd_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(jacobian="finite_difference").run(dataset, fd_result, FlagCoding(3))
+
+        analytic_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(jacobian="analytic").run(dataset, analytic_result, FlagCoding(3))
+
+        loop_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="loop", jacobian="analytic").run(dataset, loop_result, FlagCoding(3))
+
+        np.testing.assert_array_equal(fd_result.i.data, analytic_result.i.data)
+        np.testing.assert_allclose(fd_result.x.data, analytic_result.x.data, rtol=0.0, atol=0.01)
+        np.testing.assert_allclose(fd_result.A.data, analytic_result.A.data, rtol=0.0, atol=0.002)
+        np.testing.assert_allclose(fd_result.F.data, analytic_result.F.data, rtol=0.0, atol=0.01)
+
+        np.testing.assert_allclose(loop_result.x.data, analytic_result.x.data, rtol=1e-6)
+        np.testing.assert_allclose(loop_result.K4.data, analytic_result.K4.data, rtol=1e-6)
+
+    def test_run_broyden_jacobian_update(self):
+        dataset = self._create_retrieval_input()
+
+        full_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(jacobian_update="full").run(dataset, full_result, FlagCoding(3))
+
+        broyden_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(jacobian_update="broyden").run(dataset, broyden_result, FlagCoding(3))
+
+        self.assertEqual(53, full_result.attrs["forward_model_evaluations"])
+        self.assertEqual(28, broyden_result.attrs["forward_model_evaluations"])
+        np.testing.assert_array_equal([1, 1, 1], broyden_result.convergence_passed_flag.data)
+        np.testing.assert_allclose(full_result.x.data[:, 3], broyden_result.x.data[:, 3], rtol=0.0, atol=0.15)
+
+    def test_run_forward_model_evaluations_match_between_engines(self):
+        dataset = self._create_retrieval_input()
+        flag_coding = FlagCoding(3)
+        flag_coding.add_amsre_flag(np.array([False, True, False]))
+
+        for engine in ["loop", "batch", "numba"]:
+            result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+            Retrieval(engine=engine).run(dataset, result, flag_coding)
+            self.assertEqual(37, result.attrs["forward_model_evaluations"], msg=engine)
+
+    def test_run_lut_fw_model(self):
+        dataset = self._create_retrieval_input()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            lut_file = os.path.join(temp_dir, "lut.npy")
+            grid = np.array([[0.0, 16.0, 17], [0.0, 75.0, 26], [-0.2, 0.6, 17], [284.0, 306.0, 12], [55.0, 55.5, 2]], dtype=np.float64)
+            FwModelLut.build(grid=grid).save(lut_file)
+
+            for engine in ["loop", "batch"]:
+                physical_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+                Retrieval(engine=engine).run(dataset, physical_result, FlagCoding(3))
+
+                lut_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+                Retrieval(engine=engine, fw_model="lut", lut_file=lut_file).run(dataset, lut_result, FlagCoding(3))
+
+                np.testing.assert_array_equal([1, 1, 1], lut_result.convergence_passed_flag.data)
+                np.testing.assert_allclose(physical_result.x.data[:, 3], lut_result.x.data[:, 3], rtol=0.0, atol=0.1, err_msg=engine)
+
+            # the batch engine evaluates the analytic Jacobians of the table for all matchups at once
+            loop_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+            Retrieval(engine="loop", jacobian="analytic", fw_model="lut", lut_file=lut_file).run(dataset, loop_result, FlagCoding(3))
+            batch_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+            Retrieval(engine="batch", jacobian="analytic", fw_model="lut", lut_file=lut_file).run(dataset, batch_result, FlagCoding(3))
+            for variable_name in loop_result.data_vars:
+                np.testing.assert_allclose(loop_result[variable_name].data, batch_result[variable_name].data, rtol=1e-5, atol=1e-6, err_msg=variable_name)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_fw_model_cache(self):
+        dataset = self._create_retrieval_input()
+
+        expected_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="loop").run(dataset, expected_result, FlagCoding(3))
+
+        retrieval = Retrieval(engine="loop", fw_cache_size=1000)
+        result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        retrieval.run(dataset, result, FlagCoding(3))
+        np.testing.assert_allclose(expected_result.x.data, result.x.data, rtol=0.0, atol=1e-8)
+        misses = retrieval.fw_model_cache.misses
+
+        # a second run is served from the cache
+        result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        retrieval.run(dataset, result, FlagCoding(3))
+        np.testing.assert_allclose(expected_result.x.data, result.x.data, rtol=0.0, atol=1e-8)
+        self.assertEqual(misses, retrieval.fw_model_cache.misses)
+        self.assertGreater(retrieval.fw_model_cache.hits, 0)
+
+    def test_init_fw_model_cache_unsupported(self):
+        with self.assertRaises(ValueError):
+            Retrieval(engine="numba", fw_cache_size=1000)
+
+        with self.assertRaises(ValueError):
+            Retrieval(engine="batch", fw_cache_size=1000)
+
+        with self.assertRaises(ValueError):
+            Retrieval(engine="loop", fw_cache_size=1000, fw_cache_tolerance=0.001, fw_cache_steps=[0.1, 0.1, 0.1, 0.1, 0.1, 0.1])
+
+    def test_init_lut_fw_model_unsupported(self):
+        with self.assertRaises(ValueError):
+            Retrieval(fw_model="emulator")
+
+        with self.assertRaises(ValueError):
+            Retrieval(fw_model="lut")
+
+        with self.assertRaises(ValueError):
+            Retrieval(engine="numba", fw_model="lut", lut_file="lut.npy")
+
+    def test_init_broyden_jacobian_update_unsupported_combinations(self):
+        with self.assertRaises(ValueError):
+            Retrieval(engine="loop", jacobian_update="broyden")
+
+        with self.assertRaises(ValueError):
+            Retrieval(jacobian="analytic", jacobian_update="broyden")
+
+    def test_init_unsupported_jacobian_update(self):
+        with self.assertRaises(ValueError):
+            Retrieval(jacobian_update="secant")
+
+    def test_run_levenberg_marquardt_update(self):
+        dataset = self._create_retrieval_input()
+
+        gauss_newton_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(update="gauss_newton").run(dataset, gauss_newton_result, FlagCoding(3))
+
+        damped_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(update="levenberg_marquardt").run(dataset, damped_result, FlagCoding(3))
+
+        np.testing.assert_array_equal([1, 1, 1], damped_result.convergence_passed_flag.data)
+        np.testing.assert_array_equal(gauss_newton_result.i.data, damped_result.i.data)
+        np.testing.assert_allclose(gauss_newton_result.x.data[:, 3], damped_result.x.data[:, 3], rtol=0.0, atol=0.01)
+
+    def test_run_levenberg_marquardt_rejected_step_diagnostics(self):
+        dataset = self._create_retrieval_input()
+        retrieval = Retrieval(update="levenberg_marquardt")
+        fw_model = retrieval.fw_model
+        # the first trial step follows the first guess and its four finite difference perturbations
+        retrieval.fw_model = RejectingFwModel(fw_model, 6)
+
+        result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        retrieval.run(dataset, result, FlagCoding(3))
+        self.assertTrue(retrieval.fw_model.rejected)
+        np.testing.assert_array_equal([1, 1, 1], result.convergence_passed_flag.data)
+
+        # A and S of a plain Gauss-Newton evaluation at the retrieved state
+        x = result.x.data.astype(np.float64)
+        retrieval_input = RetrievalInput(dataset)
+        theta_d = retrieval_input.sza
+        context = create_geometry_context(theta_d, 35.0, retrieval_input.phi_rd)
+        T_A0 = fw_model.run_batch(x[:, 0], x[:, 1], x[:, 2], x[:, 3], 0.0, 0.0, theta_d, 35.0, np.NaN, context=context)
+        K = retrieval._finite_difference_jacobian(x, T_A0, theta_d, context)
+        S = retrieval.S_p_inv + np.matmul(np.matmul(K.transpose(0, 2, 1), retrieval.S_e_inv), K)
+        S_inv = np.linalg.inv(S)
+        A = np.diagonal(np.matmul(S_inv, np.matmul(np.matmul(K.transpose(0, 2, 1), retrieval.S_e_inv), K)), axis1=1, axis2=2)
+        np.testing.assert_allclose(A, result.A.data, rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(np.sqrt(np.diagonal(S_inv, axis1=1, axis2=2)), result.S.data, rtol=1e-4, atol=1e-6)
+
+    def test_run_divergence_guard(self):
+        dataset = self._create_retrieval_input()
+        dataset["amsre.nwp.total_column_liquid_water"].data[2] = 3.0   # forward model turns invalid
+        flag_coding = FlagCoding(3)
+
+        result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(divergence_guard=True).run(dataset, result, flag_coding)
+
+        np.testing.assert_array_equal([0, 0, FlagCoding.RETRIEVAL_DIVERGED], flag_coding.get_flags())
+        np.testing.assert_array_equal([1, 1, 0], result.convergence_passed_flag.data)
+        np.testing.assert_array_equal([4, 3, 3], result.i.data)
+
+    def test_run_divergence_guard_levenberg_marquardt(self):
+        dataset = self._create_retrieval_input()
+        dataset["amsre.nwp.total_column_liquid_water"].data[2] = 2.0
+        flag_coding = FlagCoding(3)
+
+        result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(update="levenberg_marquardt", divergence_guard=True).run(dataset, result, flag_coding)
+
+        np.testing.assert_array_equal([0, 0, FlagCoding.RETRIEVAL_DIVERGED], flag_coding.get_flags())
+        np.testing.assert_array_equal([4, 3, 3], result.i.data)
+        # all trial steps were rejected, the state stays at the first guess
+        np.testing.assert_allclose(result.p0.data[2, :], result.x.data[2, :], rtol=1e-6)
+
+    def test_run_prints_one_summary_per_run(self):
+        dataset = self._create_retrieval_input()
+        dataset["amsre.nwp.total_column_liquid_water"].data[2] = 3.0
+
+        summaries = {}
+        for engine in ["batch", "loop"]:
+            output = io.StringIO()
+            result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+            with contextlib.redirect_stdout(output):
+                Retrieval(engine=engine, divergence_guard=engine == "batch").run(dataset, result, FlagCoding(3))
+
+            # the run summary and the iterations histogram
+            lines = output.getvalue().splitlines()
+            self.assertEqual(2, len(lines), msg=engine)
+            self.assertTrue(lines[1].startswith(" ... iterations histogram: "), msg=lines[1])
+            summaries[engine] = lines[0].split("; ")
+            self.assertEqual(" ... " + str(result.attrs["forward_model_evaluations"]) + " forward model evaluations", summaries[engine][0])
+
+        self.assertEqual(["active matchups per iteration: 3, 3, 3, 1", "1 matchups stopped by the divergence guard"], summaries["batch"][1:])
+        self.assertEqual(1, len(summaries["loop"][1:]))
+        self.assertTrue(summaries["loop"][1].startswith("dielectric cache: "), msg=summaries["loop"][1])
+
+    def test_init_damped_update_unsupported_engine(self):
+        with self.assertRaises(ValueError):
+            Retrieval(engine="loop", update="levenberg_marquardt")
+
+        with self.assertRaises(ValueError):
+            Retrieval(engine="numba", divergence_guard=True)
+
+    def test_init_unsupported_update(self):
+        with self.assertRaises(ValueError):
+            Retrieval(update="steepest_descent")
+
+    def test_run_reduced_diagnostics(self):
+        dataset = self._create_retrieval_input()
+
+        full_result = MwOeSstProcessor._create_result_structure(3, 10, 10)
+        Retrieval(engine="loop").run(dataset, full_result, FlagCoding(3))
+
+        for diagnostics in ["minimal", "standard"]:
+            for engine in ["loop", "batch", "numba"]:
+                reduced_result = MwOeSstProcessor._create_result_structure(3, 10, 10, diagnostics=diagnostics)
+                Retrieval(engine=engine).run(dataset, reduced_result, FlagCoding(3))
+
+                self.assertNotIn("j", reduced_result.data_vars)
+                for variable_name in reduced_result.data_vars:
+                    np.testing.assert_allclose(full_result[variable_name].data, reduced_result[variable_name].data, rtol=1e-5, atol=1e-6, err_msg=engine + " " + variable_name)
+
+    def test_create_kernel_output_arrays_reduced_diagnostics(self):
+        [out_ite, out_bt, out_F, _, _, _] = retrieval_kernel.create_output_arrays(3, 10, retrieval_kernel.DIAGNOSTICS_MINIMAL)
+        self.assertEqual((0, 4, 10), out_ite.shape)
+        self.assertEqual((0, 4, 10), out_bt.shape)
+        self.assertEqual((3, 10), out_F.shape)
+
+        [out_ite, out_bt, _, _, _, _] = retrieval_kernel.create_output_arrays(3, 10, retrieval_kernel.DIAGNOSTICS_STANDARD)
+        self.assertEqual((0, 4, 10), out_ite.shape)
+        self.assertEqual((3, 4, 10), out_bt.shape)
+
+    def test_cholesky_solve(self):
+        A = np.array([[[4.0, 1.0, 0.5], [1.0, 3.0, 0.2], [0.5, 0.2, 2.0]], [[2.0, 0.3, 0.0], [0.3, 1.0, 0.1], [0.0, 0.1, 5.0]]], dtype=np.float64)
+        B = np.array([[[1.0], [2.0], [3.0]], [[-1.0], [0.5], [2.0]]], dtype=np.float64)
+
+        X = Retrieval._cholesky_solve(np.linalg.cholesky(A), B)
+
+        np.testing.assert_allclose(np.linalg.solve(A, B), X, rtol=1e-12)
+
+    def test_whitening(self):
+        W = self.retrieval.S_e_whitening
+
+        np.testing.assert_allclose(self.retrieval.S_e_inv, np.matmul(W.transpose(), W), rtol=0.0, atol=1e-8)
+
+    def test_init_unsupported_jacobian(self):
+        with self.assertRaises(ValueError):
+            Retrieval(jacobian="guessed")
+
+    def test_init_unsupported_engine(self):
+        with self.assertRaises(ValueError):
+            Retrieval(engine="quantum")
+
     def test_prepare_first_guess(self):
         ws = np.float64(22.3)
         tcwv = np.float64(33.4)
@@ -191,3 +502,49 @@ class RetrievalTest(unittest.TestCase):
         self.assertAlmostEqual(20, T_A[0, 2], 8)
         self.assertAlmostEqual(30, T_A[0, 3], 8)
         self.assertAlmostEqual(90, T_A[0, 9], 8)
+
+    @staticmethod
+    def _create_retrieval_input():
+        dataset = xr.Dataset()
+        dataset["amsre.brightness_temperature6V"] = Variable(["matchup_count"], np.array([176.4254, 169.4794, 169.3118], dtype=np.float64))
+        dataset["amsre.brightness_temperature6H"] = Variable(["matchup_count"], np.array([90.9698, 86.6282, 82.611], dtype=np.float64))
+        dataset["amsre.brightness_temperature10V"] = Variable(["matchup_count"], np.array([181.49, 174.48, 173.5316], dtype=np.float64))
+        dataset["amsre.brightness_temperature10H"] = Variable(["matchup_count"], np.array([98.8989, 93.5897, 86.9333], dtype=np.float64))
+        dataset["amsre.brightness_temperature18V"] = Variable(["matchup_count"], np.array([212.9936, 199.0224, 192.7028], dtype=np.float64))
+        dataset["amsre.brightness_temperature18H"] = Variable(["matchup_count"], np.array([153.7084, 133.4428, 115.918], dtype=np.float64))
+        dataset["amsre.brightness_temperature23V"] = Variable(["matchup_count"], np.array([250.0724, 226.9596, 215.15], dtype=np.float64))
+        dataset["amsre.brightness_temperature23H"] = Variable(["matchup_count"], np.array([219.4987, 184.0727, 153.9983], dtype=np.float64))
+        dataset["amsre.brightness_temperature36V"] = Variable(["matchup_count"], np.array([232.129, 220.8774, 217.5726], dtype=np.float64))
+        dataset["amsre.brightness_temperature36H"] = Variable(["matchup_count"], np.array([183.7511, 167.1675, 151.3251], dtype=np.float64))
+        dataset["amsre.nwp.abs_wind_speed"] = Variable(["matchup_count"], np.array([6.00405503911681, 9.20655470261406, 5.10105703955726], dtype=np.float64))
+        dataset["amsre.nwp.total_column_water_vapour"] = Variable(["matchup_count"], np.array([59.2188758850098, 26.8414897918701, 14.3991870880127], dtype=np.float64))
+        dataset["amsre.nwp.total_column_liquid_water"] = Variable(["matchup_count"], np.array([0.153278715134895, 0.210529339037996, 0.00125914319133341], dtype=np.float64))
+        dataset["amsre.nwp.sea_surface_temperature"] = Variable(["matchup_count"], np.array([301.679042997567, 291.330501737802, 295.058376493661], dtype=np.float64) - 273.15)
+        dataset["amsre.satellite_zenith_angle"] = Variable(["matchup_count"], np.array([55.19, 55.23, 55.2], dtype=np.float64))
+        dataset["relative_angle"] = Variable(["matchup_count"], np.array([78.1866134486559, 359.01513331183, 26.1734235301682], dtype=np.float64))
+        return dataset
+
+
+class RejectingFwModel:
+    """
+    Forward model raising the brightness temperatures of one batch evaluation, the trial step it belongs to increases
+    the cost function and is rejected.
+    """
+
+    def __init__(self, fw_model, rejected_call):
+        self.fw_model = fw_model
+        self.rejected_call = rejected_call
+        self.num_calls = 0
+        self.rejected = False
+
+    def run_batch(self, W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=None, dielectric=None):
+        self.num_calls += 1
+        T_B = self.fw_model.run_batch(W, V, L, T_ow, C_is, F_MY, theta_d, sss, phi_rd, context=context, dielectric=dielectric)
+        if self.num_calls == self.rejected_call:
+            self.rejected = True
+            return T_B + 30.0
+
+        return T_B
+
+    def calc_dielectric(self, T_ow, sss, context):
+        return self.fw_model.calc_dielectric(T_ow, sss, context)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", ".."))
+
+HELP_SCRIPT = "from dmi.sst.mw_oe.mw_oe_sst_main import main; main(['--help'])"
+
+KERNEL_SCRIPT = """
+import numpy as np
+from dmi.sst.mw_oe.fw_model import FwModel, create_geometry_context
+from dmi.sst.mw_oe.fw_model_kernel import run_open_water, create_dielectric_buffer
+context = create_geometry_context(55.2, 34.5, 45.0)
+FwModel().run(7.5, 30.0, 0.1, 290.0, 0.0, 0.0, 55.2, 34.5, 45.0, context=context)
+run_open_water(7.5, 30.0, 0.1, 290.0, 55.2, 34.5, context, create_dielectric_buffer(), np.empty(10))
+"""
+
+
+# benchmarks are not part of the unit-test suite, run explicitly with
+# python -m unittest test.dmi.sst.mw_oe.startup_benchmark
+class StartupBenchmark(unittest.TestCase):
+    cache_dir = None
+
+    def setUp(self):
+        # a private numba cache directory, the first run starts from a cold cache
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_startup_cold_and_warm_cache(self):
+        help_time = self._run_python(HELP_SCRIPT)
+        cold_time = self._run_python(KERNEL_SCRIPT)
+        warm_time = self._run_python(KERNEL_SCRIPT)
+
+        print("command line help:                 %7.3f s" % help_time)
+        print("kernel import and run, cold cache: %7.3f s" % cold_time)
+        print("kernel import and run, warm cache: %7.3f s" % warm_time)
+
+        self.assertLess(warm_time, cold_time)
+        self.assertLess(help_time, cold_time)
+
+    def _run_python(self, script):
+        env = dict(os.environ)
+        env["NUMBA_CACHE_DIR"] = self.cache_dir
+        env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", script], env=env, cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start_time
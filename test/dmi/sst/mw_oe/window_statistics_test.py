@@ -0,0 +1,71 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from dmi.sst.mw_oe.window_statistics import WindowStatistics
+
+
+class WindowStatisticsTest(unittest.TestCase):
+
+    def test_statistics_match_numpy(self):
+        random = np.random.RandomState(3)
+        data = (150.0 + 100.0 * random.random_sample([50, 9, 7])).astype(np.float32)
+        data[random.random_sample(data.shape) < 0.05] = -32768
+        data[random.random_sample(data.shape) < 0.02] = np.NaN
+
+        window_statistics = WindowStatistics(data, -32768)
+
+        for length in [1, 3, 5, 7]:
+            offset = length // 2
+            windows = data[:, 4 - offset:4 + offset + 1, 3 - offset:3 + offset + 1].reshape(50, -1).astype(np.float64)
+            windows[windows == -32768] = np.NaN
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                expected_mean = np.nanmean(windows, axis=1)
+                expected_std_dev = np.nanstd(windows, axis=1)
+
+            np.testing.assert_array_equal(np.count_nonzero(np.isnan(windows), axis=1), window_statistics.get_num_invalid(length))
+            np.testing.assert_array_equal(np.count_nonzero(np.isfinite(windows), axis=1), window_statistics.get_num_valid(length))
+            np.testing.assert_allclose(expected_mean, window_statistics.get_mean(length), rtol=1e-12, err_msg=str(length))
+            np.testing.assert_allclose(expected_std_dev, window_statistics.get_std_dev(length), rtol=1e-9, atol=1e-9, err_msg=str(length))
+
+    def test_window_clipped_at_subset_border(self):
+        data = np.arange(2 * 5 * 5, dtype=np.float32).reshape(2, 5, 5)
+
+        window_statistics = WindowStatistics(data, -1)
+
+        np.testing.assert_array_equal([0, 0], window_statistics.get_num_invalid(9))
+        np.testing.assert_array_equal([25, 25], window_statistics.get_num_valid(9))
+        np.testing.assert_allclose([12.0, 37.0], window_statistics.get_mean(9), rtol=1e-12)
+
+    def test_all_pixels_invalid(self):
+        data = np.full([1, 3, 3], -5.0, dtype=np.float32)
+
+        window_statistics = WindowStatistics(data, -5.0)
+
+        np.testing.assert_array_equal([9], window_statistics.get_num_invalid(3))
+        self.assertTrue(np.isnan(window_statistics.get_mean(3)[0]))
+        self.assertTrue(np.isnan(window_statistics.get_std_dev(3)[0]))
+
+    def test_large_offset_precision(self):
+        data = np.full([1, 21, 21], 280.0, dtype=np.float32)
+        data[0, ::2, :] = 280.01
+
+        window_statistics = WindowStatistics(data, -32768)
+
+        windows = data[0].astype(np.float64)
+        self.assertAlmostEqual(np.std(windows), window_statistics.get_std_dev(21)[0], 9)
+
+    def test_packed_fill_value_exact(self):
+        data = np.array([[[-32767, -32768, 12000], [-32768, -32767, 12001], [12002, -32767, -32768]]], dtype=np.int16)
+
+        window_statistics = WindowStatistics(data, np.int16(-32768))
+
+        # values adjacent to the fill value are valid
+        np.testing.assert_array_equal([3], window_statistics.get_num_invalid(3))
+        np.testing.assert_array_equal([6], window_statistics.get_num_valid(3))
+        valid = np.array([-32767, 12000, 12001, 12002, -32767, -32767], dtype=np.float64)
+        np.testing.assert_allclose([np.mean(valid)], window_statistics.get_mean(3), rtol=1e-12)
+        np.testing.assert_allclose([np.std(valid)], window_statistics.get_std_dev(3), rtol=1e-12)
+        np.testing.assert_array_equal([1], window_statistics.get_num_valid(1))
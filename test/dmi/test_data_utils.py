@@ -2,6 +2,9 @@ import os
 import tempfile
 from configparser import ConfigParser
 
+import numpy as np
+import xarray as xr
+
 TEST_FILE_NAME = "mmd6c_sst_ship-sst_amsre-aq_2010-272_2010-273.nc"
 
 
@@ -31,3 +34,61 @@ class TestDataUtils:
     @staticmethod
     def get_output_dir():
         return tempfile.gettempdir()
+
+    @staticmethod
+    def write_synthetic_mmd(file_path, num_matchups, seed=0, compress=False):
+        # a small MMD with all input variables of the processor and plausible open ocean values, for tests that need an
+        # input file but not the reference data
+        random = np.random.RandomState(seed)
+        dataset = xr.Dataset()
+
+        def add_variable(name, dims, data, attrs=None):
+            dataset[name] = xr.Variable(dims, data, attrs)
+
+        amsre_dims = ["matchup_count", "amsre.ny", "amsre.nx"]
+        nwp_dims = ["matchup_count", "amsre.nwp.ny", "amsre.nwp.nx"]
+        insitu_dims = ["matchup_count", "ship-sst.insitu.ntime"]
+        amsre_shape = [num_matchups, 7, 7]
+        nwp_shape = [num_matchups, 3, 3]
+
+        add_variable("amsre.latitude", amsre_dims, (random.random_sample(amsre_shape) * 120.0 - 60.0).astype(np.float32))
+        add_variable("amsre.longitude", amsre_dims, (random.random_sample(amsre_shape) * 360.0 - 180.0).astype(np.float32))
+        file_names = ["AMSR_E_L2A_BrightnessTemperatures_V12_201009291215_A.hdf", "AMSR_E_L2A_BrightnessTemperatures_V12_201009291303_D.hdf"]
+        add_variable("amsre.l2a_filename", ["matchup_count"], np.array([file_names[i * 2 // max(num_matchups, 1)] for i in range(num_matchups)]))
+        add_variable("amsre.solar_zenith_angle", amsre_dims, np.full(amsre_shape, 120.0, dtype=np.float32))
+        add_variable("amsre.satellite_zenith_angle", amsre_dims, np.full(amsre_shape, 55.0, dtype=np.float32))
+        add_variable("amsre.satellite_azimuth_angle", amsre_dims, (random.random_sample(amsre_shape) * 360.0 - 180.0).astype(np.float32))
+
+        bt_means = {"6V": 160.0, "6H": 85.0, "10V": 165.0, "10H": 92.0, "18V": 190.0, "18H": 125.0, "23V": 215.0, "23H": 165.0, "36V": 215.0, "36H": 150.0}
+        for channel, bt_mean in bt_means.items():
+            bt = bt_mean + random.standard_normal(amsre_shape)
+            add_variable("amsre.brightness_temperature" + channel, amsre_dims, np.round((bt - 327.68) / 0.01).astype(np.int16), {"SCALE_FACTOR": 0.01, "OFFSET": 327.68})
+            add_variable("amsre.pixel_data_quality" + channel, amsre_dims, np.zeros(amsre_shape, dtype=np.int16))
+
+        add_variable("amsre.scan_data_quality", amsre_dims, np.zeros(amsre_shape, dtype=np.int32))
+        add_variable("amsre.Geostationary_Reflection_Latitude", amsre_dims, np.full(amsre_shape, -32767.0, dtype=np.float32))
+        add_variable("amsre.Geostationary_Reflection_Longitude", amsre_dims, np.full(amsre_shape, -32767.0, dtype=np.float32))
+
+        sst = 275.0 + 25.0 * random.random_sample([num_matchups, 1, 1])
+        nwp_attrs = {"source": "GRIB data"}
+        add_variable("amsre.nwp.sea_surface_temperature", nwp_dims, np.broadcast_to(sst, nwp_shape).astype(np.float32), nwp_attrs)
+        add_variable("amsre.nwp.skin_temperature", nwp_dims, np.broadcast_to(sst + 0.2, nwp_shape).astype(np.float32), nwp_attrs)
+        add_variable("amsre.nwp.10m_east_wind_component", nwp_dims, (random.standard_normal(nwp_shape) * 5.0).astype(np.float32), nwp_attrs)
+        add_variable("amsre.nwp.10m_north_wind_component", nwp_dims, (random.standard_normal(nwp_shape) * 5.0).astype(np.float32), nwp_attrs)
+        add_variable("amsre.nwp.log_surface_pressure", nwp_dims, np.full(nwp_shape, np.log(101300.0), dtype=np.float32), nwp_attrs)
+        add_variable("amsre.nwp.cloud_liquid_water", ["matchup_count", "amsre.nwp.nz", "amsre.nwp.ny", "amsre.nwp.nx"], np.full([num_matchups, 60, 3, 3], 1e-6, dtype=np.float32), nwp_attrs)
+        add_variable("amsre.nwp.total_column_water_vapour", nwp_dims, (10.0 + 40.0 * random.random_sample(nwp_shape)).astype(np.float32), nwp_attrs)
+        add_variable("amsre.nwp.total_precip", nwp_dims, np.zeros(nwp_shape, dtype=np.float32), nwp_attrs)
+
+        add_variable("ship-sst_insitu.time", insitu_dims, np.arange(num_matchups, dtype=np.int32).reshape(num_matchups, 1))
+        add_variable("ship-sst_insitu.lat", insitu_dims, np.zeros([num_matchups, 1], dtype=np.float32))
+        add_variable("ship-sst_insitu.lon", insitu_dims, np.zeros([num_matchups, 1], dtype=np.float32))
+        add_variable("ship-sst_insitu.sst_depth", insitu_dims, np.ones([num_matchups, 1], dtype=np.float32))
+        add_variable("ship-sst_insitu.sea_surface_temperature", insitu_dims, (sst[:, :, 0] - 273.15).astype(np.float32))
+        add_variable("ship-sst_insitu.sst_qc_flag", insitu_dims, np.zeros([num_matchups, 1], dtype=np.int16))
+        add_variable("ship-sst_insitu.sst_track_flag", insitu_dims, np.zeros([num_matchups, 1], dtype=np.int16))
+
+        encoding = None
+        if compress:
+            encoding = {variable_name: dict(zlib=True, complevel=5) for variable_name in dataset.data_vars}
+        dataset.to_netcdf(file_path, format="netCDF4", engine="netcdf4", encoding=encoding)